@@ -13,13 +13,13 @@ import json
 import asyncio
 import random
 import requests
-import httpx
 import fcntl
+import functools
+import hmac
 from contextlib import contextmanager
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional, Tuple
-from requests_oauthlib import OAuth1
 from bs4 import BeautifulSoup
 from aiohttp import web
 
@@ -27,27 +27,44 @@ from pathlib import Path
 from dotenv import load_dotenv
 from openai import OpenAI
 
+from utils import http
 from utils.config import get_secret
 from utils.logging import logger
-from utils.db import db_get, db_set, db_keys_prefix
-from utils.cache import _cache_get, _cache_put, CACHE_SCHEMA
-
-OPENFOOD_USER_AGENT = "HealCoLite/1.0 (rafael.sayadi@gmail.com)"
+from utils.db import db_get, db_set, db_items_prefix, db_flush
+from utils.cache import (
+    _cache_get_swr_async, _cache_put_async, _neg_cached_async, _neg_store_async, CACHE_SCHEMA,
+)
+from utils.cache import cache_export, cache_import, cache_stats
+from utils.consts import (
+    CACHE_SNAPSHOT_PATH,
+    CACHE_SNAPSHOT_TOP,
+    CACHE_STATS_TOKEN,
+    FATSECRET_KEY,
+    FATSECRET_SECRET,
+    SEARCH_CACHE_TTL,
+)
+from utils.fatsecret import _fs_find_by_barcode, _fs_get_food, _fs_search_best
+from utils.leaderboard import LeaderboardIndex
+from utils.locks import KeyedLocks
+from utils.breaker import CLOSED, breakers
+from utils.ratelimit import limiter
+from utils.singleflight import single_flight
+from utils.utils import _norm_text, _scale_portion
 
 OPENFOOD_USER_AGENT = "HealCoLite/1.0 (rafael.sayadi@gmail.com)"
+OFF_HOST = "world.openfoodfacts.org"
 
 # Импортируем Open Food Facts модуль
 try:
     import openfoodfacts
     from openfoodfacts import products as off_products, search as off_search, utils as off_utils
 
+    # SDK ходит в сеть сам (requests), поэтому вызываем его в потоке, но через лимитер хоста OFF
     async def off_by_barcode(barcode: str, **kwargs):
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, off_products.get_product, barcode)
+        return await http.call_blocking(OFF_HOST, off_products.get_product, barcode)
 
     async def off_search_by_name(name: str, **kwargs):
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, off_search.search, name)
+        return await http.call_blocking(OFF_HOST, off_search.search, name)
 
     def set_user_agent(user_agent: str) -> None:
         off_utils.user_agent = user_agent
@@ -63,6 +80,11 @@ except ImportError:
         logger.warning(f"Open Food Facts module not available: {e}")
         HAS_OPENFOOD = False
 
+if HAS_OPENFOOD:
+    # одинаковые одновременные запросы к Open Food Facts выполняются один раз
+    off_by_barcode = single_flight(off_by_barcode)
+    off_search_by_name = single_flight(off_search_by_name)
+
 from telegram import (
     Update,
     ReplyKeyboardMarkup,
@@ -157,6 +179,7 @@ GOOGLE_CSE_KEY = get_secret("GOOGLE_CSE_KEY", "")
 GOOGLE_CSE_CX  = get_secret("GOOGLE_CSE_CX", "")
 VISION_KEY     = get_secret("VISION_KEY", "")        # опционально
 USDA_API_KEY   = get_secret("USDA_FDC_API_KEY", "")  # USDA FoodData Central API key
+DIARY_HOT_DAYS = int(os.getenv("HLITE_DIARY_HOT_DAYS", "30"))  # старше — в помесячный архив
 
 # ========= КНОПКИ =========
 MAIN_MENU = [
@@ -386,6 +409,10 @@ def today_key() -> str:
 def state_key(uid: int) -> str:
     return f"user:{uid}"
 
+def points_key(uid: int) -> str:
+    """Очки дублируются в points:{uid}, чтобы лидерборд строился без чтения полных состояний"""
+    return f"points:{uid}"
+
 def default_state() -> Dict[str, Any]:
     return {
         "profile": {
@@ -402,6 +429,7 @@ def default_state() -> Dict[str, Any]:
         },
         "diaries": {"food": [], "train": [], "metrics": []},
         "daily_energy": {},
+        "daily_nutrition": {},
         "awards": {},
         "points": 0,
         "access_level": "free",  # free/basic/premium/maximum
@@ -415,9 +443,12 @@ def load_state(uid: int) -> Dict[str, Any]:
     if not s:
         s = default_state()
         db_set(state_key(uid), s)
+        db_set(points_key(uid), 0)
     s.setdefault("profile", {}).setdefault("preferences", {})
     s.setdefault("diaries", {"food": [], "train": [], "metrics": []})
     s.setdefault("daily_energy", {})
+    if "daily_nutrition" not in s:
+        rebuild_food_rollups(s)
     s.setdefault("awards", {})
     s.setdefault("points", 0)
     s.setdefault("access_level", "free")
@@ -425,7 +456,128 @@ def load_state(uid: int) -> Dict[str, Any]:
     return s
 
 def save_state(uid: int, s: Dict[str, Any]):
+    archive_old_diaries(uid, s)
     db_set(state_key(uid), s)
+    points = int(s.get("points", 0))
+    if not _leaderboard_ready or LEADERBOARD.points(uid) != points:
+        db_set(points_key(uid), points)
+    if _leaderboard_ready:
+        LEADERBOARD.update(uid, points)
+
+# ========= АРХИВ ДНЕВНИКОВ =========
+# Записи старше DIARY_HOT_DAYS переезжают из user:{uid} в помесячные разделы
+# diary:{uid}:{YYYY-MM}, чтобы load_state не тащил всю историю аккаунта.
+_ARCHIVE_LISTS = ("food", "train", "metrics")
+_ARCHIVE_DAYS = ("daily_energy", "daily_nutrition", "awards")
+
+def archive_key(uid: int, month: str) -> str:
+    return f"diary:{uid}:{month}"
+
+def _entry_day(x: Any) -> Optional[str]:
+    ts = x.get("ts") if isinstance(x, dict) else None
+    return ts[:10] if isinstance(ts, str) and len(ts) >= 10 else None
+
+def archive_old_diaries(uid: int, st: Dict[str, Any]) -> int:
+    """Переносит старые записи в архив; возвращает число перенесённых записей."""
+    cutoff = (datetime.now() - timedelta(days=DIARY_HOT_DAYS)).strftime("%Y-%m-%d")
+    diaries = st.get("diaries") or {}
+    # Дневники пишутся по времени, так что свежая первая запись — частый быстрый выход
+    old_lists = any(
+        (_entry_day(lst[0]) or cutoff) < cutoff
+        for lst in (_safe_list(diaries.get(kind)) for kind in _ARCHIVE_LISTS) if lst
+    )
+    old_days = any(
+        isinstance(st.get(field), dict) and any(d < cutoff for d in st[field])
+        for field in _ARCHIVE_DAYS
+    )
+    if not (old_lists or old_days):
+        return 0
+
+    archived_counts(uid, st)  # счётчик должен быть заполнен до переноса
+    parts: Dict[str, Dict[str, Any]] = {}
+    moved = 0
+    for kind in _ARCHIVE_LISTS:
+        keep = []
+        for x in _safe_list(diaries.get(kind)):
+            day = _entry_day(x)
+            if day and day < cutoff:
+                parts.setdefault(day[:7], {}).setdefault(kind, []).append(x)
+                if kind == "metrics" and x.get("type") == "zones":
+                    # get_last_hrrest смотрит только горячие метрики — пульс покоя остаётся в профиле
+                    hrrest = (x.get("data") or {}).get("hrrest")
+                    if isinstance(hrrest, int):
+                        st.setdefault("profile", {})["hrrest"] = hrrest
+                st["archived_counts"][kind] = st["archived_counts"].get(kind, 0) + 1
+                moved += 1
+            else:
+                keep.append(x)
+        if kind in diaries:
+            diaries[kind] = keep
+    for field in _ARCHIVE_DAYS:
+        days = st.get(field)
+        if not isinstance(days, dict):
+            continue
+        for day in [d for d in days if d < cutoff]:
+            parts.setdefault(day[:7], {}).setdefault(field, {})[day] = days.pop(day)
+
+    months = set(st.get("archive_months") or [])
+    for month, delta in parts.items():
+        part = db_get(archive_key(uid, month)) or {}
+        for kind in _ARCHIVE_LISTS:
+            if kind in delta:
+                part[kind] = _safe_list(part.get(kind)) + delta[kind]
+        for field in _ARCHIVE_DAYS:
+            if field in delta:
+                part.setdefault(field, {}).update(delta[field])
+        db_set(archive_key(uid, month), part)
+        months.add(month)
+    st["archive_months"] = sorted(months)
+    return moved
+
+def archived_counts(uid: int, st: Dict[str, Any]) -> Dict[str, int]:
+    """Сколько записей каждого вида уже в архиве; для старых аккаунтов считается один раз по разделам."""
+    counts = st.get("archived_counts")
+    if not isinstance(counts, dict):
+        counts = {}
+        for month in st.get("archive_months") or []:
+            part = db_get(archive_key(uid, month)) or {}
+            for kind in _ARCHIVE_LISTS:
+                counts[kind] = counts.get(kind, 0) + len(_safe_list(part.get(kind)))
+        st["archived_counts"] = counts
+    return counts
+
+def diary_entry_count(uid: int, st: Dict[str, Any]) -> int:
+    """Записи питания и тренировок за всё время (горячие + архив) — для лимита free-тарифа."""
+    diaries = st.get("diaries") or {}
+    archived = archived_counts(uid, st)
+    return sum(len(_safe_list(diaries.get(kind))) + archived.get(kind, 0) for kind in ("food", "train"))
+
+def diary_view(uid: int, st: Dict[str, Any], min_days: int = 7) -> Dict[str, Any]:
+    """Состояние с подмешанным архивом, если в горячей части меньше *min_days* дней.
+
+    Разделы читаются от свежих к старым и только пока не наберётся нужное
+    число дней; исходное *st* не изменяется.
+    """
+    months = sorted(st.get("archive_months") or [], reverse=True)
+    days = set(st.get("daily_energy") or {}) | set(st.get("daily_nutrition") or {})
+    if not months or len(days) >= min_days:
+        return st
+    view = dict(st)
+    view["diaries"] = {k: list(_safe_list((st.get("diaries") or {}).get(k))) for k in _ARCHIVE_LISTS}
+    for field in _ARCHIVE_DAYS:
+        view[field] = dict(st.get(field) or {})
+    for month in months:
+        part = db_get(archive_key(uid, month)) or {}
+        for kind in _ARCHIVE_LISTS:
+            view["diaries"][kind] = _safe_list(part.get(kind)) + view["diaries"][kind]
+        for field in _ARCHIVE_DAYS:
+            merged = dict(part.get(field) or {})
+            merged.update(view[field])
+            view[field] = merged
+        days.update(view["daily_energy"], view["daily_nutrition"])
+        if len(days) >= min_days:
+            break
+    return view
 
 def is_developer(user_id: int) -> bool:
     return user_id == DEVELOPER_USER_ID
@@ -455,6 +607,9 @@ def check_feature_access(state: Dict[str, Any], user_id: int, feature: str) -> b
         return level in ["maximum"]
     return False
 
+def _safe_list(v):
+    return v if isinstance(v, list) else []
+
 def add_points(st: Dict[str, Any], amount: int) -> int:
     st["points"] = int(st.get("points", 0)) + int(amount)
     return st["points"]
@@ -468,6 +623,36 @@ def add_kcal_in(st: Dict[str, Any], kcal: int):
     day = ensure_day(st)
     day["in"] += int(max(0, kcal))
 
+_ROLLUP_KEYS = ("kcal", "p", "f", "c")
+
+def _food_rollup_add(rollups: Dict[str, Dict[str, float]], entry: Dict[str, Any]):
+    ts = entry.get("ts") if isinstance(entry, dict) else None
+    if not (isinstance(ts, str) and len(ts) >= 10):
+        return
+    day = rollups.setdefault(ts[:10], {k: 0 for k in _ROLLUP_KEYS})
+    for k in _ROLLUP_KEYS:
+        try:
+            if entry.get(k) is not None:
+                day[k] = round(day[k] + float(entry[k]), 2)
+        except (ValueError, TypeError):
+            pass
+
+def add_food_entry(st: Dict[str, Any], entry: Dict[str, Any]):
+    """Дописывает запись в дневник питания и обновляет итоги КБЖУ за её день."""
+    st["diaries"]["food"].append(entry)
+    _food_rollup_add(st.setdefault("daily_nutrition", {}), entry)
+
+def rebuild_food_rollups(st: Dict[str, Any]):
+    """Пересчитывает итоги по дням из дневника (после удаления записей)."""
+    rollups: Dict[str, Dict[str, float]] = {}
+    for x in _safe_list((st.get("diaries") or {}).get("food")):
+        _food_rollup_add(rollups, x)
+    st["daily_nutrition"] = rollups
+
+def food_day_totals(st: Dict[str, Any], day: str) -> Optional[Dict[str, int]]:
+    r = (st.get("daily_nutrition") or {}).get(day)
+    return {k: int(r.get(k, 0)) for k in _ROLLUP_KEYS} if r else None
+
 def add_kcal_out(st: Dict[str, Any], kcal: int):
     day = ensure_day(st)
     day["out"] += int(max(0, kcal))
@@ -757,6 +942,7 @@ def _heuristic_normalize(text: str) -> dict:
         "usda_queries": [], "brand_queries": []
     }
 
+@single_flight
 async def call_llm_normalizer(user_text: str) -> dict:
     """Если есть OPENAI_API_KEY — используем LLM, иначе евристику."""
     if not OPENAI_API_KEY:
@@ -852,6 +1038,7 @@ def _extract_portions(text: str) -> Tuple[str, Optional[float], Optional[float]]
 
     return s.strip(), grams, ml
 
+@single_flight
 async def _google_cse_search_branded(q: str, num: int = 8) -> List[str]:
     """Optimized Google CSE search for branded products with targeted parameters"""
     if not GOOGLE_CSE_KEY or not GOOGLE_CSE_CX:
@@ -880,10 +1067,9 @@ async def _google_cse_search_branded(q: str, num: int = 8) -> List[str]:
         
         logger.info(f"Google CSE branded search: '{exact}' with nutrition terms")
         
-        async with httpx.AsyncClient(timeout=20.0) as cli:
-            r = await cli.get("https://www.googleapis.com/customsearch/v1", params=params)
-            r.raise_for_status()
-            items = (r.json().get("items") or [])
+        r = await http.get("https://www.googleapis.com/customsearch/v1", params=params)
+        r.raise_for_status()
+        items = (r.json().get("items") or [])
         
         urls = [item["link"] for item in items if "link" in item]
         
@@ -898,7 +1084,7 @@ async def _google_cse_search_branded(q: str, num: int = 8) -> List[str]:
         logger.warning(f"Google CSE branded search failed: {e}")
         return []
 
-def _google_cse_search(q: str, num: int = 6, site_filter: str = None) -> List[str]:
+async def _google_cse_search(q: str, num: int = 6, site_filter: str = None) -> List[str]:
     """Legacy Google Custom Search для получения URL (fallback)"""
     if not GOOGLE_CSE_KEY or not GOOGLE_CSE_CX:
         logger.warning("Google CSE credentials not configured")
@@ -911,12 +1097,12 @@ def _google_cse_search(q: str, num: int = 6, site_filter: str = None) -> List[st
             
         logger.info(f"Google CSE legacy search: '{search_query}'")
         
-        response = requests.get("https://www.googleapis.com/customsearch/v1",
-                              params={"q": search_query,
-                                     "key": GOOGLE_CSE_KEY,
-                                     "cx": GOOGLE_CSE_CX,
-                                     "num": num},
-                              timeout=20)
+        response = await http.get("https://www.googleapis.com/customsearch/v1",
+                                  params={"q": search_query,
+                                         "key": GOOGLE_CSE_KEY,
+                                         "cx": GOOGLE_CSE_CX,
+                                         "num": num},
+                                  timeout=20)
         
         if response.status_code == 200:
             items = response.json().get("items", [])
@@ -1024,19 +1210,19 @@ def _cand_score(candidate: dict, category: str = None) -> float:
         logger.warning(f"Error scoring candidate: {e}")
         return 0
 
-def _google_cse_images(q: str, num: int = 4) -> List[str]:
+async def _google_cse_images(q: str, num: int = 4) -> List[str]:
     """Google Custom Search для получения изображений с nutrition labels"""
     if not GOOGLE_CSE_KEY or not GOOGLE_CSE_CX:
         return []
     try:
         # Используем переданный запрос напрямую
-        response = requests.get("https://www.googleapis.com/customsearch/v1",
-                              params={"q": q,
-                                     "key": GOOGLE_CSE_KEY,
-                                     "cx": GOOGLE_CSE_CX,
-                                     "searchType": "image",
-                                     "num": num},
-                              timeout=20)
+        response = await http.get("https://www.googleapis.com/customsearch/v1",
+                                  params={"q": q,
+                                         "key": GOOGLE_CSE_KEY,
+                                         "cx": GOOGLE_CSE_CX,
+                                         "searchType": "image",
+                                         "num": num},
+                                  timeout=20)
         if response.status_code == 200:
             return [item["link"] for item in response.json().get("items", []) if "link" in item]
         else:
@@ -1214,16 +1400,55 @@ async def search_branded_product_via_google(
         logger.warning("Google CSE credentials not configured")
         return None
         
-    # кэш с версионированием
-    ck = f"brand:{CACHE_SCHEMA}:{query_text.lower()}"
-    cached = _cache_get(ck)
+    clean, g, ml = _extract_portions(query_text)
+    logger.info(f"Branded search: clean='{clean}', grams={g}, ml={ml}")
+
+    # кэш с версионированием; храним значения на 100 г/мл, порцию досчитываем после чтения.
+    # Просроченная запись отдаётся сразу, а поиск повторяется в фоне.
+    ck = f"brand:{CACHE_SCHEMA}:{clean.lower()}"
+    cached = await _cache_get_swr_async(
+        ck, lambda: _branded_lookup(query_text, clean, forced_urls, revalidate=True), ttl=SEARCH_CACHE_TTL
+    )
     if cached:
         logger.info(f"Found cached result for: {query_text}")
-        return cached
+        return _scale_portion(cached, g, ml)
 
-    clean, g, ml = _extract_portions(query_text)
-    logger.info(f"Branded search: clean='{clean}', grams={g}, ml={ml}")
-    
+    best = await _branded_lookup(query_text, clean, forced_urls)
+    if not best:
+        return None
+    await _cache_put_async(ck, best, ttl=SEARCH_CACHE_TTL)
+    return _scale_portion(best, g, ml)
+
+async def _fs_barcode_per100(barcode: str) -> Optional[dict]:
+    """FatSecret по штрих-коду → значения на 100 г/мл (без порции)"""
+    fid = await _fs_find_by_barcode(barcode)
+    if not fid:
+        return None
+    logger.info(f"Found FatSecret food ID by barcode: {fid}")
+    food = await _fs_get_food(fid)
+    res = _fs_norm(food, None, None) if food else None
+    return res if res and res.get('kcal_100g') is not None else None
+
+async def _fs_query_per100(query: str) -> Optional[dict]:
+    """Лучшее совпадение FatSecret по названию → значения на 100 г/мл (без порции)"""
+    food = await _fs_search_best(query)
+    if not food:
+        return None
+    logger.info(f"Found FatSecret food: {food.get('food_name', 'Unknown')}")
+    res = _fs_norm(food, None, None)
+    return res if res and res.get('kcal_100g') is not None else None
+
+async def _branded_lookup(
+    query_text: str,
+    clean: str,
+    forced_urls: Optional[list[str]] = None,
+    revalidate: bool = False
+) -> Optional[dict]:
+    """
+    Сам брендовый поиск (FatSecret → страницы CSE → OCR); результат на 100 г/мл, без кэша brand:.
+    revalidate=True — фоновое обновление brand:, записи fs:* не читаем, а запрашиваем заново
+    (они обычно просрочены вместе с brand:).
+    """
     # ========= 0) FATSECRET — ПРИОРИТЕТНЫЙ ШАГ =========
     if FATSECRET_KEY and FATSECRET_SECRET:
         logger.info("Trying FatSecret API...")
@@ -1232,38 +1457,35 @@ async def search_branded_product_via_google(
             barcode = _extract_barcode(query_text)
             if barcode:
                 logger.info(f"Searching FatSecret by barcode: {barcode}")
-                ck_fs_bar = f"fs:bar:{CACHE_SCHEMA}:{barcode}:{g}:{ml}"
-                c = _cache_get(ck_fs_bar)
+                ck_fs_bar = f"fs:bar:{CACHE_SCHEMA}:{barcode}"
+                c = None if revalidate else await _cache_get_swr_async(
+                    ck_fs_bar, lambda: _fs_barcode_per100(barcode), ttl=SEARCH_CACHE_TTL
+                )
                 if c:
                     logger.info(f"FatSecret cache hit by barcode {barcode}")
-                    return c
+                    return c[0] if isinstance(c, list) else c
                 
-                fid = await _fs_find_by_barcode(barcode)
-                if fid:
-                    logger.info(f"Found FatSecret food ID by barcode: {fid}")
-                    food = await _fs_get_food(fid)
-                    res = _fs_norm(food, g, ml) if food else None
-                    if res and (res.get('kcal_100g') is not None):
-                        logger.info(f"FatSecret barcode result: {res.get('name', 'Unknown')}")
-                        _cache_put(ck_fs_bar, res)
-                        return res
+                res = await _fs_barcode_per100(barcode)
+                if res:
+                    logger.info(f"FatSecret barcode result: {res.get('name', 'Unknown')}")
+                    await _cache_put_async(ck_fs_bar, res, ttl=SEARCH_CACHE_TTL)
+                    return res
                 
             # 0b) поиск по названию/бренду
             logger.info(f"Searching FatSecret by name: {clean}")
-            ck_fs_q = f"fs:q:{CACHE_SCHEMA}:{clean}:{g}:{ml}"
-            c = _cache_get(ck_fs_q)
+            ck_fs_q = f"fs:q:{CACHE_SCHEMA}:{_norm_text(clean)}"
+            c = None if revalidate else await _cache_get_swr_async(
+                ck_fs_q, lambda: _fs_query_per100(clean), ttl=SEARCH_CACHE_TTL
+            )
             if c:
                 logger.info(f"FatSecret cache hit by query {clean}")
-                return c
+                return c[0] if isinstance(c, list) else c
                 
-            food = await _fs_search_best(clean)
-            if food:
-                logger.info(f"Found FatSecret food: {food.get('food_name', 'Unknown')}")
-                res = _fs_norm(food, g, ml)
-                if res and (res.get('kcal_100g') is not None):
-                    logger.info(f"FatSecret search result: {res.get('name', 'Unknown')}")
-                    _cache_put(ck_fs_q, res)
-                    return res
+            res = await _fs_query_per100(clean)
+            if res:
+                logger.info(f"FatSecret search result: {res.get('name', 'Unknown')}")
+                await _cache_put_async(ck_fs_q, res, ttl=SEARCH_CACHE_TTL)
+                return res
                     
         except Exception as e:
             logger.warning(f"FatSecret search failed: {e}")
@@ -1293,7 +1515,7 @@ async def search_branded_product_via_google(
         ]
         
         for search_query in search_queries:
-            urls = _google_cse_search(search_query, num=6)
+            urls = await _google_cse_search(search_query, num=6)
             if urls:
                 break
     
@@ -1306,10 +1528,7 @@ async def search_branded_product_via_google(
             continue
         seen.add(url)
         try:
-            def _fetch_html():
-                return requests.get(url, timeout=20, headers={"User-Agent": "Mozilla/5.0"}).text
-            
-            html = await asyncio.to_thread(_fetch_html)
+            html = (await http.get(url, timeout=20, headers={"User-Agent": "Mozilla/5.0"})).text
             logger.info(f"Parsing HTML from: {url}")
             
         except Exception as e:
@@ -1344,7 +1563,7 @@ async def search_branded_product_via_google(
             continue
 
         d["url"] = d.get("url", url)
-        res = normalize_result(_unify_and_scale(d, g, ml))
+        res = normalize_result(_unify_and_scale(d, None, None))
         res = _fix_portion_leak(res)
         candidates.append(res)
 
@@ -1352,7 +1571,7 @@ async def search_branded_product_via_google(
     if VISION_KEY:
         logger.info(f"Healco: trying Vision OCR on image search for: {clean}")
         img_query = f"{clean} nutrition facts пищевая ценность"
-        img_urls = _google_cse_images(img_query, num=12)
+        img_urls = await _google_cse_images(img_query, num=12)
         
         for img in img_urls:
             txt = await _vision_ocr_text(img)
@@ -1364,7 +1583,7 @@ async def search_branded_product_via_google(
                 continue
                 
             d["url"] = img
-            res = normalize_result(_unify_and_scale(d, g, ml))
+            res = normalize_result(_unify_and_scale(d, None, None))
             res = _fix_portion_leak(res)
             candidates.append(res)
 
@@ -1386,14 +1605,12 @@ async def search_branded_product_via_google(
             logger.info("Trying fallback search for barcode-like query")
             fallback_result = await search_google_for_product(query_text)
             if fallback_result:
-                _cache_put(ck, fallback_result)
                 return fallback_result
         return None
 
     # Выбираем лучшего кандидата (по _cand_score)
     valid_candidates.sort(key=lambda r: _cand_score(r, cat), reverse=True)
     best = valid_candidates[0]
-    _cache_put(ck, best)
     return best
 
 async def _old_search_branded_product_via_google(
@@ -1416,16 +1633,13 @@ async def _old_search_branded_product_via_google(
     logger.info(f"Branded search: '{query_text}' → clean='{search_q}', grams={grams}, ml={ml}")
 
     # 1) веб-страницы через CSE
-    urls = _google_cse_search(search_q, google_cse_key, google_cse_cx, num=cse_results, site_filter=site_filter)
+    urls = await _google_cse_search(search_q, num=cse_results, site_filter=site_filter)
 
     for url in urls:
         try:
-            def _fetch_page():
-                response = requests.get(url, timeout=20, headers={"User-Agent": "Mozilla/5.0"})
-                response.raise_for_status()
-                return response.text
-
-            html = await asyncio.to_thread(_fetch_page)
+            response = await http.get(url, timeout=20, headers={"User-Agent": "Mozilla/5.0"})
+            response.raise_for_status()
+            html = response.text
         except Exception as e:
             logger.debug(f"Failed to fetch {url}: {e}")
             continue
@@ -1448,7 +1662,7 @@ async def _old_search_branded_product_via_google(
     # 2) картинки + OCR (если Vision API доступен)
     if vision_key:
         logger.info("Trying Vision OCR for images...")
-        img_urls = _google_cse_images(search_q, google_cse_key, google_cse_cx, num=image_results)
+        img_urls = await _google_cse_images(search_q, num=image_results)
 
         for img in img_urls:
             text = await _vision_ocr_text(img, vision_key)
@@ -1521,11 +1735,8 @@ async def search_google_for_product(query: str) -> Optional[Dict[str, Any]]:
                 'num': 6
             }
 
-            def _make_request():
-                response = requests.get(url, params=params, timeout=15)
-                return response.json() if response.status_code == 200 else None
-
-            data = await asyncio.to_thread(_make_request)
+            response = await http.get(url, params=params, timeout=15)
+            data = response.json() if response.status_code == 200 else None
 
             if not data or not data.get('items'):
                 continue
@@ -2086,63 +2297,9 @@ def calculate_nutrition_from_external_jsonl(product_data: Dict[str, Any], grams:
 # ========= USDA FDC API =========
 USDA_FDC_API_KEY = USDA_API_KEY
 
-# ===================== FATSECRET CONFIG =====================
-FATSECRET_KEY    = get_secret("FATSECRET_KEY", "")
-FATSECRET_SECRET = get_secret("FATSECRET_SECRET", "")
-FS_BASE = "https://platform.fatsecret.com/rest/server.api"
-
-def _fatsecret_auth():
-    if not FATSECRET_KEY or not FATSECRET_SECRET:
-        return None
-    return OAuth1(FATSECRET_KEY, FATSECRET_SECRET)
-
-async def _fs_request(method: str, params: dict | None = None) -> dict | None:
-    """Universal FatSecret REST call (OAuth1 signed)."""
-    auth = _fatsecret_auth()
-    if not auth:
-        logger.warning("FatSecret credentials are not set (FATSECRET_KEY/SECRET empty). Skipping FS call.")
-        return None
-    
-    # Правильные параметры для FatSecret API
-    p = {"method": method, "format": "json"}
-    if params:
-        p.update(params)
-    
-    def _do():
-        try:
-            # FatSecret требует GET запросы с OAuth1 подписью
-            response = requests.get(FS_BASE, params=p, auth=auth, timeout=25)
-            return response
-        except Exception as e:
-            logger.error(f"FatSecret request exception: {e}")
-            raise
-    
-    try:
-        r = await asyncio.to_thread(_do)
-        logger.info(f"FatSecret API call: {method}, status: {r.status_code}")
-        
-        if r.status_code != 200:
-            body = r.text[:1000]
-            if r.status_code in (401, 403):
-                logger.error(
-                    "FatSecret auth/permission error %s. "
-                    "Check: consumer key/secret, API plan, IP whitelist. "
-                    "Your IP: 34.47.244.213. Response: %s", r.status_code, body
-                )
-            else:
-                logger.warning("FatSecret HTTP %s. Response: %s", r.status_code, body)
-            return None
-        
-        try:
-            result = r.json()
-            logger.info(f"FatSecret response received: {type(result)}")
-            return result
-        except Exception as je:
-            logger.warning("FatSecret JSON decode failed: %s... (%s)", r.text[:300], je)
-            return None
-    except Exception as e:
-        logger.warning("FatSecret request failed: %s", e)
-        return None
+# ===================== FATSECRET =====================
+# Сетевые вызовы (_fs_get_food/_fs_search_best/_fs_find_by_barcode) — в utils/fatsecret.py,
+# общие с search.py; здесь только нормализация ответа.
 
 def _fs_to_float(x):
     try:
@@ -2212,77 +2369,6 @@ def _fs_norm(food: dict, grams: float | None, ml: float | None) -> dict | None:
         if c100   is not None:  out["carbs_portion"]  = c100 * k
     return out
 
-async def _fs_get_food(food_id: str) -> dict | None:
-    """Get detailed food information by ID."""
-    logger.info(f"Getting FatSecret food details for ID: {food_id}")
-    
-    # Используем правильный метод API
-    data = await _fs_request("food.get", {"food_id": food_id})
-    
-    if not data:
-        logger.warning(f"No data returned for food_id: {food_id}")
-        return None
-    
-    food = data.get("food")
-    if food:
-        logger.info(f"Successfully got FatSecret food: {food.get('food_name', 'Unknown')}")
-    else:
-        logger.warning(f"No food object in response for food_id: {food_id}")
-    
-    return food
-
-async def _fs_search_best(query: str) -> dict | None:
-    """Search by name → best food with metric serving."""
-    # Используем правильный параметр для FatSecret API
-    data = await _fs_request("foods.search", {"search_expression": query, "max_results": 5})
-    
-    if not data:
-        logger.info(f"No FatSecret data returned for query: {query}")
-        return None
-    
-    foods = data.get("foods", {})
-    if isinstance(foods, dict):
-        food_list = foods.get("food", [])
-    else:
-        food_list = foods
-        
-    if isinstance(food_list, dict):
-        food_list = [food_list]
-    
-    if not food_list:
-        logger.info(f"No foods found in FatSecret response for: {query}")
-        return None
-    
-    logger.info(f"Found {len(food_list)} foods in FatSecret for: {query}")
-    
-    def _score(fd):
-        s = ((fd.get("servings") or {}).get("serving")) or []
-        if isinstance(s, dict): 
-            s = [s]
-        metr = 0
-        for it in s:
-            u = (it.get("metric_serving_unit") or it.get("serving_unit") or "").lower()
-            if u in ("g","ml"): 
-                metr += 1
-        return (2 if fd.get("brand_name") else 0) + metr
-    
-    best = max(food_list, key=_score)
-    food_id = best.get("food_id")
-    if food_id:
-        logger.info(f"Getting detailed info for FatSecret food_id: {food_id}")
-        return await _fs_get_food(str(food_id))
-    
-    return None
-
-async def _fs_find_by_barcode(barcode: str) -> Optional[str]:
-    """Find food ID by barcode (if available in FatSecret plan)"""
-    data = await _fs_request("food.find_id_for_barcode", {"barcode": barcode})
-    try:
-        fid = (data or {}).get("food_id")
-        return str(fid) if fid else None
-    except Exception:
-        return None
-
 def _extract_barcode(text: str) -> Optional[str]:
     """Extract barcode from text"""
     match = re.search(r'\b\d{8,14}\b', text)
@@ -2465,6 +2551,7 @@ def _desc_ok_for_base(desc: str, base_en: str) -> bool:
     dl = desc.lower()
     return all(tok in dl for tok in base_en.lower().split())
 
+@single_flight
 async def search_usda_fdc_product(query: str, base_en: str = None) -> Optional[Dict[str, Any]]:
     """Улучшенный поиск продукта в USDA FDC API с фильтрацией по базовому продукту"""
     if not USDA_FDC_API_KEY:
@@ -2487,11 +2574,8 @@ async def search_usda_fdc_product(query: str, base_en: str = None) -> Optional[D
             'pageSize': 25
         }
 
-        def _make_request():
-            response = requests.get(url, params=params, timeout=20)
-            return response.json() if response.status_code == 200 else None
-
-        data = await asyncio.to_thread(_make_request)
+        response = await http.get(url, params=params, timeout=20)
+        data = response.json() if response.status_code == 200 else None
 
         if not data or not data.get('foods'):
             return None
@@ -2630,6 +2714,7 @@ def calculate_nutrition_from_usda_fdc(product_data: Dict[str, Any], grams: int)
     }
 
 # ========= OPEN FOOD FACTS API =========
+@single_flight
 async def search_openfoodfacts_product(query: str) -> Optional[Dict[str, Any]]:
     """Поиск продукта в Open Food Facts API"""
     try:
@@ -2685,17 +2770,12 @@ async def search_openfoodfacts_product(query: str) -> Optional[Dict[str, Any]]:
                 'sort_by': 'unique_scans_n'
             }
 
-            def _make_request():
-                import time
-                time.sleep(0.3)
-                response = requests.get(url, params=params, headers=headers, timeout=20)
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    logger.warning(f"Open Food Facts API returned status {response.status_code}")
-                    return None
-
-            data = await asyncio.to_thread(_make_request)
+            response = await http.get(url, params=params, headers=headers, timeout=20)
+            if response.status_code == 200:
+                data = response.json()
+            else:
+                logger.warning(f"Open Food Facts API returned status {response.status_code}")
+                data = None
 
             if not data or not data.get('products'):
                 continue
@@ -3297,8 +3377,8 @@ async def recipes_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not r:
                 await query.answer("Рецепт не найден")
                 return
-            st["diaries"]["food"].append(
-                {"ts": now_ts(), "text": f"Рецепт: {r.title}", "kcal": r.kcal, "p": r.protein_g, "f": r.fat_g, "c": r.carbs_g}
+            add_food_entry(
+                st, {"ts": now_ts(), "text": f"Рецепт: {r.title}", "kcal": r.kcal, "p": r.protein_g, "f": r.fat_g, "c": r.carbs_g}
             )
             add_kcal_in(st, r.kcal)
             add_points(st, 2)
@@ -3316,15 +3396,33 @@ async def recipes_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("Ошибка")
 
 # ========= ЛИДЕРБОРД =========
-def leaderboard_all() -> List[Dict[str, Any]]:
-    arr = []
-    for k in db_keys_prefix("user:"):
-        st = db_get(k, {})
-        if isinstance(st, dict):
-            pts = int(st.get("points", 0))
-            arr.append({"user_id": k.split(":", 1)[-1], "points": pts})
-    arr.sort(key=lambda x: x["points"], reverse=True)
-    return arr
+# Индекс баллов: собирается из хранилища один раз, дальше обновляется в save_state.
+LEADERBOARD = LeaderboardIndex()
+_leaderboard_ready = False
+_POINTS_MIGRATED = "meta:points_keys"
+
+def rebuild_leaderboard() -> None:
+    global _leaderboard_ready
+    # Потоковый обход без заполнения LRU горячих состояний
+    if db_get(_POINTS_MIGRATED):
+        items = [(k.split(":", 1)[-1], int(v)) for k, v in db_items_prefix("points:")]
+    else:
+        # однократный перенос: очки из полных состояний в ключи points:{uid}
+        items = []
+        for k, st in db_items_prefix("user:"):
+            if isinstance(st, dict):
+                uid = k.split(":", 1)[-1]
+                items.append((uid, int(st.get("points", 0))))
+                db_set(points_key(uid), items[-1][1])
+        db_set(_POINTS_MIGRATED, 1)
+    LEADERBOARD.rebuild(items)
+    _leaderboard_ready = True
+    logger.info("Leaderboard index built: %d users", len(LEADERBOARD))
+
+def leaderboard() -> LeaderboardIndex:
+    if not _leaderboard_ready:
+        rebuild_leaderboard()
+    return LEADERBOARD
 
 # ========= КОМАНДЫ =========
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -3364,7 +3462,9 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "\n\n👑 Команды разработчика:\n"
             "/add_admin <user_id> — добавить администратора\n"
             "/remove_admin <user_id> — удалить администратора\n"
-            "/list_admins — список администраторов"
+            "/list_admins — список администраторов\n"
+            "/cache_snapshot [N] — снимок N самых горячих записей кэша\n"
+            "/cache_stats — статистика кэша по пространствам ключей"
         )
 
     await update.message.reply_text(help_text, reply_markup=role_keyboard(st.get("current_role")))
@@ -3441,6 +3541,72 @@ async def list_admins_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text("\n".join(lines))
 
+async def cache_snapshot_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгружает самые горячие записи кэша в снимок для холодного старта новых инстансов"""
+    user = update.effective_user
+    if not (is_developer(user.id) or is_admin_user(user.id)):
+        await update.message.reply_text("❌ Только администраторы могут делать снимок кэша.")
+        return
+
+    try:
+        top = int(context.args[0]) if context.args else CACHE_SNAPSHOT_TOP
+    except ValueError:
+        await update.message.reply_text("Использование: /cache_snapshot [N]\nПример: /cache_snapshot 5000")
+        return
+
+    path = CACHE_SNAPSHOT_PATH or "./data/cache.snapshot"
+    try:
+        count = await asyncio.to_thread(cache_export, path, top)
+    except Exception as e:
+        logger.error(f"Cache snapshot failed: {e}")
+        await update.message.reply_text(f"❌ Не удалось сделать снимок: {e}")
+        return
+
+    await update.message.reply_text(f"✅ Снимок кэша: {count} записей, {os.path.getsize(path) // 1024} КБ → {path}")
+    with open(path, "rb") as f:
+        await update.message.reply_document(f, filename=os.path.basename(path))
+
+def load_cache_snapshot() -> None:
+    """Подгружает снимок кэша при старте, до того как инстанс начнёт отвечать на /healthz"""
+    if not CACHE_SNAPSHOT_PATH or not os.path.exists(CACHE_SNAPSHOT_PATH):
+        return
+    try:
+        added = cache_import(CACHE_SNAPSHOT_PATH)
+        logger.info(f"Cache snapshot loaded: {added} entries from {CACHE_SNAPSHOT_PATH}")
+    except Exception as e:
+        logger.warning(f"Cache snapshot not loaded: {e}")
+
+def _format_cache_stats(stats: dict) -> str:
+    """Текстовая сводка cache_stats() для Telegram: по строке-блоку на пространство ключей"""
+    lines = [
+        f"🗄 Кэш: {stats['db_bytes'] // 1024} КБ на диске, "
+        f"{stats['mem_entries']} записей в памяти ({stats['mem_bytes'] // 1024} КБ)"
+    ]
+    namespaces = sorted(stats["namespaces"].items(), key=lambda kv: -(kv[1]["hits"] + kv[1]["misses"]))
+    for ns, n in namespaces:
+        ratio = "—" if n["hit_ratio"] is None else f"{n['hit_ratio'] * 100:.1f}%"
+        quota = f" / {n['quota_bytes'] // 1024} КБ" if n["quota_bytes"] else ""
+        lines.append(
+            f"\n• {ns or '(без префикса)'}: попаданий {ratio}\n"
+            f"  hit {n['hits']} · stale {n['stale']} · miss {n['misses']} · "
+            f"истекло {n['expirations']} · вытеснено {n['evictions']}\n"
+            f"  {n['entries']} записей, {n['bytes'] // 1024} КБ{quota}, записано {n['bytes_written'] // 1024} КБ\n"
+            f"  чтение p50/p95 {n['hit_ms']['p50']:g}/{n['hit_ms']['p95']:g} мс, "
+            f"заполнение p50/p95 {n['fill_ms']['p50']:g}/{n['fill_ms']['p95']:g} мс, "
+            f"сэкономлено ≈{n['saved_ms'] / 1000:.0f} с"
+        )
+    return "\n".join(lines)
+
+async def cache_stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает эффективность кэша: попадания, промахи, истечения, вытеснения и задержки"""
+    user = update.effective_user
+    if not (is_developer(user.id) or is_admin_user(user.id)):
+        await update.message.reply_text("❌ Только администраторы могут смотреть статистику кэша.")
+        return
+
+    stats = await asyncio.to_thread(cache_stats)
+    await update.message.reply_text(_format_cache_stats(stats))
+
 async def refresh_database_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для обновления базы данных продуктов"""
     user = update.effective_user
@@ -3489,24 +3655,6 @@ async def refresh_database_cmd(update: Update, context: ContextTypes.DEFAULT_TYP
             os.unlink(temp_path)
 
 # ========= ДНЕВНИК/СВОДКИ =========
-def _safe_list(v):
-    return v if isinstance(v, list) else []
-
-def _aggregate_food_day(food_entries: List[Dict[str, Any]], day: str) -> Optional[Dict[str, int]]:
-    kcal = p = f = c = 0
-    has = False
-    for x in food_entries:
-        if isinstance(x, dict) and isinstance(x.get("ts", ""), str) and x["ts"][:10] == day:
-            has = True
-            try:
-                # Более безопасное извлечение числовых значений
-                kcal += float(x.get("kcal", 0)) if x.get("kcal") is not None else 0
-                p += float(x.get("p", 0)) if x.get("p") is not None else 0
-                f += float(x.get("f", 0)) if x.get("f") is not None else 0
-                c += float(x.get("c", 0)) if x.get("c") is not None else 0
-            except (ValueError, TypeError):
-                pass
-    return {"kcal": int(kcal), "p": int(p), "f": int(f), "c": int(c)} if has else None
 
 def format_diary_entries_for_editing(entries: List[Dict[str, Any]], entry_type: str) -> str:
     """Форматирует записи дневника для редактирования"""
@@ -3548,20 +3696,27 @@ def format_diary_entries_for_editing(entries: List[Dict[str, Any]], entry_type:
 
 async def show_diaries(update: Update, st: Dict[str, Any]):
     try:
+        st = diary_view(update.effective_user.id, st)
         diaries, daily_energy = st.get("diaries", {}), st.get("daily_energy", {})
-        foods, trains, metrics = _safe_list(diaries.get("food")), _safe_list(diaries.get("train")), _safe_list(diaries.get("metrics"))
-        days_set = {
-            ts[:10]
-            for ts in [x.get("ts") for lst in (foods, trains, metrics) for x in lst if isinstance(x, dict) and isinstance(x.get("ts"), str) and len(x["ts"]) >= 10]
-        }
+        trains, metrics = _safe_list(diaries.get("train")), _safe_list(diaries.get("metrics"))
+        # Еда берётся из итогов по дням (daily_nutrition), тренировки группируем за один проход
+        trains_by_day: Dict[str, List[Dict[str, Any]]] = {}
+        for t in trains:
+            if isinstance(t, dict) and isinstance(t.get("ts"), str) and len(t["ts"]) >= 10:
+                trains_by_day.setdefault(t["ts"][:10], []).append(t)
+        days_set = set(trains_by_day)
+        days_set.update(st.get("daily_nutrition") or {})
+        days_set.update(
+            x["ts"][:10] for x in metrics if isinstance(x, dict) and isinstance(x.get("ts"), str) and len(x["ts"]) >= 10
+        )
         days_set.update(k for k in daily_energy.keys() if isinstance(k, str) and len(k) == 10)
         if not days_set:
             days_set.add(today_key())
         days = sorted(days_set, reverse=True)[:7]
         lines = ["Сводка последних дней: 📅"]
         for d in days:
-            agg = _aggregate_food_day(foods, d)
-            day_trains = [t for t in trains if isinstance(t, dict) and isinstance(t.get("ts"), str) and t["ts"].startswith(d)]
+            agg = food_day_totals(st, d)
+            day_trains = trains_by_day.get(d, [])
             total_train_kcal = sum(int(t.get("kcal", 0)) for t in day_trains)
             lines.append(f"\n{d}")
             if agg and agg['kcal'] > 0:
@@ -3615,7 +3770,7 @@ async def show_diaries(update: Update, st: Dict[str, Any]):
             )
             # Добавляем остаток калорий и БЖУ
             remaining_kcal = k['target_kcal'] - eat
-            today_agg = _aggregate_food_day(foods, today_key())
+            today_agg = food_day_totals(st, today_key())
             consumed_p = today_agg['p'] if today_agg and today_agg['kcal'] > 0 else 0
             consumed_f = today_agg['f'] if today_agg and today_agg['kcal'] > 0 else 0
             consumed_c = today_agg['c'] if today_agg and today_agg['kcal'] > 0 else 0
@@ -3688,15 +3843,11 @@ async def show_points(update: Update, st: Dict[str, Any]):
         return
 
     pts = int(st.get("points", 0))
-    board_all = leaderboard_all()
-    total = len(board_all)
-    rank = None
+    board = leaderboard()
+    total = len(board)
+    rank = board.rank(u.id)
     uid_str = str(u.id)
-    for i, user_data in enumerate(board_all, 1):
-        if str(user_data["user_id"]) == uid_str:
-            rank = i
-            break
-    top = board_all[:10]
+    top = board.top(10)
     lines = [f"Ваши баллы: {pts} 🏅"]
     if rank:
         lines.append(f"Ваше место: {rank} из {total} 🙂")
@@ -3797,6 +3948,7 @@ async def successful_payment_callback(update: Update, context: ContextTypes.DEFA
         _, tier, user_id = payload.split("_")
         st["access_level"] = tier
         save_state(u.id, st)
+        db_flush()  # оплату не держим в буфере отложенной записи
         await context.bot.send_message(chat_id=u.id, text=f"Оплата прошла успешно! Ваш тариф обновлён до «{tier.capitalize()}». Спасибо за поддержку! 🎉")
     elif payload.startswith("motivation_"):
         _, role, user_id = payload.split("_")
@@ -4176,9 +4328,7 @@ async def handle_text_or_photo(update: Update, context: ContextTypes.DEFAULT_TYP
 
         # --- Дневник питания ---
         if awaiting == "food_diary":
-            food_count = len(st["diaries"].get("food", []))
-            train_count = len(st["diaries"].get("train", []))
-            if get_user_access(st, u.id) == "free" and (food_count + train_count) >= FREE_DIARY_LIMIT:
+            if get_user_access(st, u.id) == "free" and diary_entry_count(u.id, st) >= FREE_DIARY_LIMIT:
                 await update.message.reply_text(
                     f"Вы достигли лимита в {FREE_DIARY_LIMIT} записи в дневнике. "
                     "Для неограниченных записей перейдите на тариф «Базовый» или выше. ⭐",
@@ -4311,7 +4461,7 @@ async def handle_text_or_photo(update: Update, context: ContextTypes.DEFAULT_TYP
             else:
                 reply += "❌ Продукт не найден. Попробуйте указать более точное название или добавьте бренд для готовых продуктов. 🙂"
 
-            st["diaries"]["food"].append(entry)
+            add_food_entry(st, entry)
             st["awaiting"] = None
             eat, burn = day_totals(st)
             if profile_complete(st["profile"]):
@@ -4347,7 +4497,7 @@ async def handle_text_or_photo(update: Update, context: ContextTypes.DEFAULT_TYP
 
                 if kcal > 0:
                     add_kcal_in(st, kcal)
-                    st["diaries"]["food"].append({
+                    add_food_entry(st, {
                         "ts": now_ts(),
                         "text": f"Меню на день: {last_menu}",
                         "kcal": kcal,
@@ -4367,9 +4517,7 @@ async def handle_text_or_photo(update: Update, context: ContextTypes.DEFAULT_TYP
 
         # --- Внести тренировку ---
         elif awaiting == "add_workout":
-            food_count = len(st["diaries"].get("food", []))
-            train_count = len(st["diaries"].get("train", []))
-            if get_user_access(st, u.id) == "free" and (food_count + train_count) >= FREE_DIARY_LIMIT:
+            if get_user_access(st, u.id) == "free" and diary_entry_count(u.id, st) >= FREE_DIARY_LIMIT:
                 await update.message.reply_text(
                     f"Лимит в {FREE_DIARY_LIMIT} записи в дневнике. Для безлимита нужен тариф «Базовый». ⭐",
                     reply_markup=role_keyboard(st.get("current_role")),
@@ -4572,7 +4720,7 @@ async def handle_text_or_photo(update: Update, context: ContextTypes.DEFAULT_TYP
             if text.lower() == "да":
                 current_recipe = st["tmp"].get("current_recipe")
                 if current_recipe:
-                    st["diaries"]["food"].append({
+                    add_food_entry(st, {
                         "ts": now_ts(),
                         "text": f"Рецепт: {current_recipe['title']}",
                         "kcal": current_recipe["kcal"],
@@ -4623,6 +4771,7 @@ async def handle_text_or_photo(update: Update, context: ContextTypes.DEFAULT_TYP
                     total_kcal = sum(entry.get("kcal", 0) for entry in foods)
                     # Очищаем список
                     st["diaries"]["food"] = []
+                    st["daily_nutrition"] = {}
                     # Корректируем дневную калорийность
                     day = ensure_day(st)
                     day["in"] = max(0, day["in"] - total_kcal)
@@ -4645,6 +4794,7 @@ async def handle_text_or_photo(update: Update, context: ContextTypes.DEFAULT_TYP
                     # Правильно вычисляем индекс для удаления из последних 10 записей
                     actual_index = len(foods) - display_count + entry_num - 1
                     removed_entry = foods.pop(actual_index)
+                    rebuild_food_rollups(st)
 
                     # Корректируем дневную калорийность
                     removed_kcal = removed_entry.get("kcal", 0)
@@ -4895,7 +5045,7 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
                 if kcal > 0:
                     add_kcal_in(st, kcal)
-                    st["diaries"]["food"].append({
+                    add_food_entry(st, {
                         "ts": now_ts(),
                         "text": f"Меню на день: {last_menu}",
                         "kcal": kcal,
@@ -5134,6 +5284,7 @@ async def _gpt_extract_nutrition(text: str) -> Optional[dict]:
         logger.warning(f"GPT extractor failed: {e}")
         return None
 
+@single_flight
 async def search_av_ru_branded(query: str, grams: Optional[float], ml: Optional[float]) -> Optional[Dict[str, Any]]:
     """Поиск брендовых продуктов на av.ru с автоматическим выбором Москвы"""
     try:
@@ -5154,14 +5305,11 @@ async def search_av_ru_branded(query: str, grams: Optional[float], ml: Optional[
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"
         }
         
-        def _fetch_av():
-            response = requests.get(search_url, headers=headers, timeout=20)
-            if response.status_code != 200:
-                logger.warning(f"av.ru search returned status {response.status_code}")
-                return None
-            return response.text
-            
-        html = await asyncio.to_thread(_fetch_av)
+        response = await http.get(search_url, headers=headers, timeout=20)
+        if response.status_code != 200:
+            logger.warning(f"av.ru search returned status {response.status_code}")
+            return None
+        html = response.text
         if not html:
             return None
             
@@ -5180,10 +5328,7 @@ async def search_av_ru_branded(query: str, grams: Optional[float], ml: Optional[
         logger.info(f"Found av.ru product: {first_product_url}")
         
         # Загружаем страницу продукта
-        def _fetch_product():
-            return requests.get(first_product_url, headers=headers, timeout=20)
-            
-        product_response = await asyncio.to_thread(_fetch_product)
+        product_response = await http.get(first_product_url, headers=headers, timeout=20)
         if product_response.status_code != 200:
             return None
             
@@ -5370,6 +5515,47 @@ def _extract_from_state(product: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         "carbs_100g": to_float(nutrition.get("carbohydrates")),
     }
 
+# источник -> хосты, к которым он ходит (для circuit breaker'ов из utils.breaker).
+# Первый — основной: если его цепь открыта, источник пропускаем целиком.
+_GOOGLE_HOSTS = ("www.googleapis.com", "platform.fatsecret.com", "vision.googleapis.com")
+_PROVIDER_HOSTS = {
+    "avru": ("av.ru",),
+    "google": _GOOGLE_HOSTS,
+    "google.brand": _GOOGLE_HOSTS,  # брендовый поиск сначала идёт в FatSecret
+    "usda": ("api.nal.usda.gov",),
+    "fatsecret": ("platform.fatsecret.com",),
+    "off": (OFF_HOST,),
+}
+
+def _usda_neg_query(query: str, base_en: Optional[str] = None) -> str:
+    """Запрос USDA для негативного кэша: base_en фильтрует выдачу, поэтому входит в ключ"""
+    return f"{query} base:{base_en}" if base_en else query
+
+async def _try_provider(provider: str, query: str, fn, *args, **kwargs):
+    """
+    Вызывает источник, если он недавно не промахивался на этом запросе
+    и его circuit breaker не открыт.
+    Пустой ответ запоминаем в негативном кэше на NEG_CACHE_TTL источника;
+    исключения и сбои источника (таймауты, 5xx, 401/403) не кэшируются.
+    """
+    hosts = _PROVIDER_HOSTS.get(provider) or _PROVIDER_HOSTS.get(provider.split(".", 1)[0]) or ()
+    touched = [breakers.get(h) for h in hosts]
+    if touched and touched[0].is_open:
+        logger.info(f"Skip {provider} for '{query}': circuit open")
+        return None
+    if not query:
+        return await fn(*args, **kwargs)
+    if await _neg_cached_async(provider, query):
+        logger.info(f"Skip {provider} for '{query}': recent miss")
+        return None
+    failures = [b.failures for b in touched]
+    result = await fn(*args, **kwargs)
+    # пустой ответ из-за сбоя любого из хостов — не промах
+    failed = any(b.failures > n or b.state != CLOSED for b, n in zip(touched, failures))
+    if not result and not failed:
+        await _neg_store_async(provider, query)
+    return result
+
 async def search_product_on_internet(user_text: str) -> Optional[Dict[str, Any]]:
     """Поиск продукта в интернете с нормализацией через LLM"""
     try:
@@ -5384,13 +5570,13 @@ async def search_product_on_internet(user_text: str) -> Optional[Dict[str, Any]]
         # Брендовый поиск
         if info.get("query_type") == "brand":
             # Приоритетный поиск на av.ru
-            r = await search_av_ru_branded(user_text, grams, mills)
+            r = await _try_provider("avru", user_text, search_av_ru_branded, user_text, grams, mills)
             if r:
                 r['source'] = 'av_ru'
                 return r
             
             # Fallback к Google CSE если av.ru не дал результата
-            r = await search_branded_product_via_google(user_text)
+            r = await _try_provider("google.brand", user_text, search_branded_product_via_google, user_text)
             if r: 
                 r['source'] = 'google_cse_jsonld'
                 return r
@@ -5398,13 +5584,15 @@ async def search_product_on_internet(user_text: str) -> Optional[Dict[str, Any]]
         # Натуральный поиск через USDA
         if info.get("query_type") == "natural" and info.get("usda_queries"):
             for query in info["usda_queries"]:
-                r = await search_usda_fdc_product(query, info.get("base_en"))
+                r = await _try_provider(
+                    "usda", _usda_neg_query(query, info.get("base_en")), search_usda_fdc_product, query, info.get("base_en")
+                )
                 if r:
                     r['source'] = 'usda'
                     return r
         
         # Последний шанс — USDA по сырому тексту (натуралка)
-        r = await search_usda_fdc_product(user_text)
+        r = await _try_provider("usda", user_text, search_usda_fdc_product, user_text)
         if r:
             r['source'] = 'usda'
         return r
@@ -5445,13 +5633,13 @@ async def ai_meal_json(profile: Dict[str, Any], user_text: str) -> Optional[Dict
             logger.info("=== BRANDED SEARCH ===")
             for query in route_info["queries"]:
                 logger.info(f"Trying av.ru branded query: '{query}'")
-                result = await search_av_ru_branded(query, user_grams, None)
+                result = await _try_provider("avru", query, search_av_ru_branded, query, user_grams, None)
                 if result:
                     logger.info(f"Found av.ru branded result: {result.get('name', 'Unknown')}")
                     break
                     
                 logger.info(f"Trying Google CSE branded query: '{query}'")
-                result = await search_branded_product_via_google(query)
+                result = await _try_provider("google.brand", query, search_branded_product_via_google, query)
                 if result:
                     logger.info(f"Found Google CSE branded result: {result.get('name', 'Unknown')}")
                     break
@@ -5459,7 +5647,7 @@ async def ai_meal_json(profile: Dict[str, Any], user_text: str) -> Optional[Dict
             # Fallback: попробуем обычный Google поиск для брендовых продуктов
             if not result:
                 logger.info("No branded result found, trying Google search fallback")
-                result = await search_google_for_product(user_text)
+                result = await _try_provider("google", user_text, search_google_for_product, user_text)
                 if result:
                     logger.info(f"Found via Google search fallback: {result.get('name', 'Unknown')}")
                     result['source'] = 'smart_search'
@@ -5469,7 +5657,10 @@ async def ai_meal_json(profile: Dict[str, Any], user_text: str) -> Optional[Dict
             logger.info("=== USDA SEARCH ===")
             for query in route_info["queries"]:
                 logger.info(f"Trying USDA query: '{query}'")
-                result = await search_usda_fdc_product(query, route_info.get("base_en"))
+                result = await _try_provider(
+                    "usda", _usda_neg_query(query, route_info.get("base_en")),
+                    search_usda_fdc_product, query, route_info.get("base_en")
+                )
                 if result:
                     logger.info(f"Found USDA result: {result.get('name', 'Unknown')}")
                     break
@@ -5487,7 +5678,7 @@ async def ai_meal_json(profile: Dict[str, Any], user_text: str) -> Optional[Dict
                     if barcode_match:
                         barcode = barcode_match.group()
                         logger.info(f"Searching FatSecret by barcode: {barcode}")
-                        fid = await _fs_find_by_barcode(barcode)
+                        fid = await _try_provider("fatsecret.bar", barcode, _fs_find_by_barcode, barcode)
                         if fid:
                             food = await _fs_get_food(fid)
                             if food:
@@ -5501,7 +5692,7 @@ async def ai_meal_json(profile: Dict[str, Any], user_text: str) -> Optional[Dict
                         clean_query = re.sub(r'\d+\s*(?:г|гр|g|grams?)', '', user_text, flags=re.IGNORECASE).strip()
                         if clean_query:
                             logger.info(f"Searching FatSecret by name: {clean_query}")
-                            food = await _fs_search_best(clean_query)
+                            food = await _try_provider("fatsecret", clean_query, _fs_search_best, clean_query)
                             if food:
                                 result = _fs_norm(food, user_grams, None)
                                 if result and result.get('kcal_100g'):
@@ -5546,7 +5737,7 @@ async def ai_meal_json(profile: Dict[str, Any], user_text: str) -> Optional[Dict
                     if barcode_match:
                         barcode = barcode_match.group()
                         logger.info(f"Detected barcode: {barcode}")
-                        result = await off_by_barcode(barcode, grams=user_grams_off)
+                        result = await _try_provider("off.bar", barcode, off_by_barcode, barcode, grams=user_grams_off)
                         if result:
                             logger.info(f"Found by barcode in Open Food Facts: {result.get('name', 'Unknown')}")
                     
@@ -5554,14 +5745,14 @@ async def ai_meal_json(profile: Dict[str, Any], user_text: str) -> Optional[Dict
                     if not result:
                         clean_query_off = re.sub(r'\d+\s*(?:г|гр|g|grams?|мл|ml)', '', user_text, flags=re.IGNORECASE).strip()
                         if clean_query_off:
-                            result = await off_search_by_name(clean_query_off, grams=user_grams_off)
+                            result = await _try_provider("off", clean_query_off, off_search_by_name, clean_query_off, grams=user_grams_off)
                             if result:
                                 logger.info(f"Found by name in Open Food Facts: {result.get('name', 'Unknown')}")
                     
                     # Если не нашли через новый модуль, пробуем старый метод
                     if not result:
                         logger.info("Trying legacy Open Food Facts...")
-                        result = await search_openfoodfacts_product(user_text)
+                        result = await _try_provider("off.legacy", user_text, search_openfoodfacts_product, user_text)
                         if result:
                             logger.info(f"Found in legacy Open Food Facts: {result.get('name', 'Unknown')}")
                         else:
@@ -5571,7 +5762,7 @@ async def ai_meal_json(profile: Dict[str, Any], user_text: str) -> Optional[Dict
             elif not result:
                 logger.info("Trying legacy Open Food Facts...")
                 try:
-                    result = await search_openfoodfacts_product(user_text)
+                    result = await _try_provider("off.legacy", user_text, search_openfoodfacts_product, user_text)
                     if result:
                         logger.info(f"Found in legacy Open Food Facts: {result.get('name', 'Unknown')}")
                     else:
@@ -5583,7 +5774,7 @@ async def ai_meal_json(profile: Dict[str, Any], user_text: str) -> Optional[Dict
             if not result:
                 logger.info("Trying Google search fallback...")
                 try:
-                    result = await search_google_for_product(user_text)
+                    result = await _try_provider("google", user_text, search_google_for_product, user_text)
                     if result:
                         logger.info(f"Found via Google search: {result.get('name', 'Unknown')}")
                     else:
@@ -5692,7 +5883,7 @@ async def ai_meal_json(profile: Dict[str, Any], user_text: str) -> Optional[Dict
         return None
 
 def get_last_hrrest(st: Dict[str, Any], default: int = 60) -> int:
-    """Получает последний записанный пульс покоя из метрик"""
+    """Получает последний записанный пульс покоя из метрик (или из профиля, если записи уже в архиве)"""
     metrics = st.get("diaries", {}).get("metrics", [])
     for m in reversed(metrics):
         if isinstance(m, dict) and m.get("type") == "zones":
@@ -5700,6 +5891,9 @@ def get_last_hrrest(st: Dict[str, Any], default: int = 60) -> int:
             hrrest = data.get("hrrest")
             if hrrest and isinstance(hrrest, int) and 35 <= hrrest <= 110:
                 return hrrest
+    hrrest = (st.get("profile") or {}).get("hrrest")
+    if hrrest and isinstance(hrrest, int) and 35 <= hrrest <= 110:
+        return hrrest
     return default
 
 def estimate_kcal_workout(profile: Dict[str, Any], desc: str, mins: int, hrm: Optional[int] = None) -> int:
@@ -6021,6 +6215,7 @@ def _regex_nutrition(html: str) -> Optional[Dict[str, Any]]:
         logger.warning(f"Regex nutrition parsing error: {e}")
         return None
 
+@single_flight
 async def _vision_ocr_text(image_url: str) -> Optional[str]:
     """Извлекает текст из изображения через Google Vision API"""
     if not VISION_KEY:
@@ -6028,12 +6223,8 @@ async def _vision_ocr_text(image_url: str) -> Optional[str]:
     
     try:
         # Загружаем изображение
-        def _fetch_image():
-            response = requests.get(image_url, timeout=15)
-            return response if response.status_code == 200 else None
-        
-        response = await asyncio.to_thread(_fetch_image)
-        if not response:
+        response = await http.get(image_url, timeout=15)
+        if response.status_code != 200:
             return None
         
         import base64
@@ -6049,10 +6240,7 @@ async def _vision_ocr_text(image_url: str) -> Optional[str]:
             }]
         }
         
-        def _make_vision_request():
-            return requests.post(vision_url, json=payload, timeout=20)
-        
-        ocr_response = await asyncio.to_thread(_make_vision_request)
+        ocr_response = await http.post(vision_url, json=payload, timeout=20)
         if ocr_response.status_code == 200:
             result = ocr_response.json()
             annotations = result.get('responses', [{}])[0].get('textAnnotations', [])
@@ -6267,11 +6455,59 @@ def start_keepalive_server():
         logger.warning(f"Keep‑alive server не запущен: {e}")
 
 
+async def _on_shutdown(app: Application):
+    """Сбрасываем отложенные записи БД и закрываем пул HTTP-соединений перед остановкой."""
+    db_flush()
+    await http.aclose()
+
+
 def _add_healthz(app: web.Application):
     async def ok(_):
         return web.Response(text="ok")
     app.router.add_get("/healthz", ok)
 
+
+def _add_metrics(app: web.Application):
+    """GET /metrics/cache и /metrics/http в JSON; без CACHE_STATS_TOKEN эндпоинты не регистрируются"""
+    if not CACHE_STATS_TOKEN:
+        return
+
+    def _authorized(request: web.Request) -> bool:
+        token = request.headers.get("X-Stats-Token") or request.query.get("token", "")
+        # байты, а не str: compare_digest падает с TypeError на не-ASCII строках
+        return hmac.compare_digest(token.encode(), CACHE_STATS_TOKEN.encode())
+
+    async def cache_metrics(request: web.Request):
+        if not _authorized(request):
+            raise web.HTTPNotFound()
+        return web.json_response(await asyncio.to_thread(cache_stats))
+
+    async def http_metrics(request: web.Request):
+        if not _authorized(request):
+            raise web.HTTPNotFound()
+        return web.json_response({"rate_limits": limiter.stats(), "breakers": breakers.stats()})
+
+    app.router.add_get("/metrics/cache", cache_metrics)
+    app.router.add_get("/metrics/http", http_metrics)
+
+# ========= ОЧЕРЁДНОСТЬ ОБНОВЛЕНИЙ =========
+# concurrent_updates(True) обрабатывает апдейты параллельно, но два быстрых
+# сообщения одного пользователя не должны одновременно делать
+# load_state → изменение → save_state (иначе теряется одна из записей).
+USER_LOCKS = KeyedLocks()
+
+
+def per_user(handler):
+    """Выполняет апдейты одного пользователя по очереди, разных — параллельно."""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            return await handler(update, context)
+        async with USER_LOCKS.hold(user.id):
+            return await handler(update, context)
+    return wrapper
+
 # ========= ЗАПУСК =========
 def main():
     with single_instance_lock():
@@ -6284,6 +6520,9 @@ def main():
             )
 
         log_egress_ip_once()
+        rebuild_leaderboard()
+        # веб-сервер (и /healthz) поднимается только в run_webhook — к этому моменту кэш уже прогрет
+        load_cache_snapshot()
 
         # запустим keep‑alive сервер в фоне (отдельный поток)
         try:
@@ -6292,34 +6531,43 @@ def main():
         except Exception as e:
             logger.warning(f"Не удалось запустить keep-alive: {e}")
 
-        app = Application.builder().token(BOT_TOKEN).concurrent_updates(True).build()
+        app = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .concurrent_updates(True)
+            .post_shutdown(_on_shutdown)
+            .build()
+        )
 
         _add_healthz(app.web_app)
+        _add_metrics(app.web_app)
 
-        app.add_handler(CommandHandler("start", start))
-        app.add_handler(CommandHandler("help", help_cmd))
+        app.add_handler(CommandHandler("start", per_user(start)))
+        app.add_handler(CommandHandler("help", per_user(help_cmd)))
         app.add_handler(CommandHandler("whoami", whoami_cmd))
         app.add_handler(CommandHandler("health", health_cmd))
         app.add_handler(CommandHandler("version", version_cmd))
-        app.add_handler(CommandHandler("shop", shop_command))
+        app.add_handler(CommandHandler("shop", per_user(shop_command)))
         app.add_handler(CommandHandler("add_admin", add_admin_cmd))
         app.add_handler(CommandHandler("remove_admin", remove_admin_cmd))
         app.add_handler(CommandHandler("list_admins", list_admins_cmd))
+        app.add_handler(CommandHandler("cache_snapshot", cache_snapshot_cmd))
+        app.add_handler(CommandHandler("cache_stats", cache_stats_cmd))
 
 
         app.add_handler(
             CallbackQueryHandler(
-                recipes_callbacks, pattern=r"^(rroot|rcat:|rpage:|rshow:|radd:|rback|shop_open)"
+                per_user(recipes_callbacks), pattern=r"^(rroot|rcat:|rpage:|rshow:|radd:|rback|shop_open)"
             )
         )
-        app.add_handler(CallbackQueryHandler(on_callback, pattern=r"^(save_menu|save_workout|buy):"))
+        app.add_handler(CallbackQueryHandler(per_user(on_callback), pattern=r"^(save_menu|save_workout|buy):"))
 
-        # платежи
+        # платежи (pre-checkout не трогает состояние и должен ответить за 10 с — без очереди)
         app.add_handler(PreCheckoutQueryHandler(precheckout_callback))
-        app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_callback))
+        app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, per_user(successful_payment_callback)))
 
         # основной обработчик
-        app.add_handler(MessageHandler(filters.TEXT | filters.PHOTO, handle_text_or_photo))
+        app.add_handler(MessageHandler(filters.TEXT | filters.PHOTO, per_user(handle_text_or_photo)))
         app.add_error_handler(error_handler)
 
         logger.info(f"{PROJECT_NAME} запущен. {VERSION}")
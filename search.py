@@ -2,20 +2,20 @@ import asyncio
 import json
 import logging
 import re
-import time
 from typing import Any, Dict, List, Optional, Tuple
 
-import requests
-from requests_oauthlib import OAuth1
 from bs4 import BeautifulSoup
 
-from utils.cache import CACHE_SCHEMA, _cache_get, _cache_put
+from utils.cache import CACHE_SCHEMA, _cache_get_async, _cache_get_swr_async, _cache_put_async
+from utils import http
 from utils.config import get_secret
 from utils.consts import (
     CACHE_DAYS,
     DB_PATH,
     DB_SCHEMA,
     EAT_NOW_DB,
+    FATSECRET_KEY,
+    FATSECRET_SECRET,
     GOOGLE_CSE_ID,
     GOOGLE_CSE_KEY,
     MAX_QUERY_LEN,
@@ -24,7 +24,9 @@ from utils.consts import (
     USER_AGENT,
 )
 from utils.db import DB
+from utils.fatsecret import _fs_find_by_barcode, _fs_get_food, _fs_search_best
 from utils.logging import logger
+from utils.singleflight import SingleFlight
 from utils.utils import (
     _extract_barcode,
     _extract_country,
@@ -44,13 +46,12 @@ from utils.utils import (
     _norm_text,
     _parse_google_recipes,
     _parse_link,
+    _scale_portion,
+    _strip_portion,
     _url_to_base64,
 )
 
-# ===================== FATSECRET CONFIG =====================
-FATSECRET_KEY = get_secret("FATSECRET_KEY", "")
-FATSECRET_SECRET = get_secret("FATSECRET_SECRET", "")
-FS_BASE = "https://platform.fatsecret.com/rest/server.api"
+# ===================== GOOGLE VISION CONFIG =====================
 VISION_KEY = get_secret("VISION_KEY", "")
 
 # ===================== AV.RU SCRAPER CONFIG =====================
@@ -58,17 +59,7 @@ AV_UA_HEADERS = {
     "User-Agent": "healco-lite/1.0 (+mailto:Rafael.sayadi@gmail.com)",
     "Accept-Language": "ru,ru-RU;q=0.9,en;q=0.8",
 }
-# глобальный лимитер: <= 1 запрос/сек к av.ru
-_av_sem = asyncio.Semaphore(1)
-_av_last_ts = 0.0
-async def _av_rate_limit():
-    global _av_last_ts
-    async with _av_sem:
-        now = time.time()
-        delay = max(0.0, 1.0 - (now - _av_last_ts))
-        if delay:
-            await asyncio.sleep(delay)
-        _av_last_ts = time.time()
+# не чаще 1 запроса/сек к av.ru — см. HOST_LIMITS в utils/ratelimit.py
 
 
 def _to_float(v):
@@ -185,164 +176,29 @@ def _parse_av_ru_html(html: str) -> dict | None:
 async def _fetch_av_ru(url: str) -> dict | None:
     """Загружает и парсит av.ru (с кэшем и лимитом)."""
     ck = f"avru:{url}"
-    cached = _cache_get(ck)
+    cached = await _cache_get_async(ck)
     if cached:
         return cached
     try:
-        await _av_rate_limit()
-        def _do():
-            return requests.get(url, headers=AV_UA_HEADERS, timeout=20)
-        r = await asyncio.to_thread(_do)
+        r = await http.get(url, headers=AV_UA_HEADERS, timeout=20)
         if r.status_code != 200:
             logger.warning("av.ru HTTP %s for %s", r.status_code, url)
             return None
         data = _parse_av_ru_html(r.text)
         if data:
-            _cache_put(ck, data, ttl=60*60*24*3)  # кэш 3 дня
+            await _cache_put_async(ck, data, ttl=60*60*24*3)  # кэш 3 дня
         return data
     except Exception as e:
         logger.warning("av.ru fetch failed: %s", e)
         return None
 
 
-def _fatsecret_auth():
-    if not FATSECRET_KEY or not FATSECRET_SECRET:
-        return None
-    # FatSecret требует точно такую подпись OAuth1
-    return OAuth1(
-        client_key=FATSECRET_KEY,
-        client_secret=FATSECRET_SECRET,
-        signature_method='HMAC-SHA1',
-        signature_type='QUERY'  # FatSecret требует параметры в query string
-    )
-
-
-async def _fs_request(method: str, params: dict | None = None) -> dict | None:
-    """Universal FatSecret REST call (OAuth1 signed)."""
-    auth = _fatsecret_auth()
-    if not auth:
-        logger.warning("FatSecret credentials are not set (empty key/secret). Skip FS call.")
-        return None
-    
-    # FatSecret API требует GET запрос с параметрами в query string
-    query_params = {"method": method, "format": "json"}
-    if params:
-        query_params.update(params)
-
-    def _do():
-        # FatSecret API использует GET с OAuth подписью в query string
-        return requests.get(FS_BASE, params=query_params, auth=auth, timeout=25)
-
-    try:
-        logger.info(f"FatSecret API call: {method}, params: {params}")
-        r = await asyncio.to_thread(_do)
-        logger.info(f"FatSecret API call: {method}, status: {r.status_code}")
-        logger.debug(f"FatSecret request URL: {r.url}")
-        
-        if r.status_code != 200:
-            body = r.text[:1000]
-            logger.error(f"FatSecret HTTP {r.status_code}. Body: {body}")
-            if r.status_code in (401, 403):
-                logger.error("Check: 1) API keys correct 2) IP whitelisted 3) Plan active")
-            return None
-        
-        try:
-            json_data = r.json()
-            logger.info(f"FatSecret response received: {type(json_data)}")
-            logger.debug(f"FatSecret raw response: {json_data}")
-            
-            # Проверяем на ошибки в ответе
-            if isinstance(json_data, dict) and "error" in json_data:
-                error_info = json_data["error"]
-                logger.error(f"FatSecret API error: {error_info}")
-                return json_data  # Возвращаем ошибку для отладки
-                
-            return json_data
-        except Exception as je:
-            logger.warning("FatSecret JSON decode failed: %s... (%s)", r.text[:300], je)
-            return None
-    except Exception as e:
-        logger.warning("FatSecret request failed: %s", e)
-        return None
-
-
-async def _fs_get_food(food_id: str) -> Optional[Dict[str, Any]]:
-    """Get food item by ID from FatSecret (v2)."""
-    res = await _fs_request("food.get.v2", {"food_id": str(food_id)})
-    if res and "food" in res:
-        return res["food"]
-    return res  # Возвращаем как есть, если структура отличается
-
-async def _fs_find_by_barcode(barcode: str) -> Optional[str]:
-    """Find food ID by barcode from FatSecret."""
-    res = await _fs_request("food.find_id_for_barcode", {"barcode": barcode})
-    if res and isinstance(res, dict):
-        return res.get("food_id", res.get("id"))
-    return None
-
 def _extract_barcode(text: str) -> Optional[str]:
     """Extract barcode from text."""
     # Ищем последовательности из 8-14 цифр
     match = re.search(r'\b(\d{8,14})\b', text)
     return match.group(1) if match else None
 
-async def _fs_search_best(query: str) -> Optional[Dict[str, Any]]:
-    """Search for the best matching food item from FatSecret."""
-    # Правильные параметры для foods.search
-    res = await _fs_request("foods.search", {"search_expression": query, "max_results": "10"})
-    
-    logger.info(f"FatSecret search response for '{query}': {res}")
-    
-    if not res:
-        logger.info(f"No response from FatSecret for: {query}")
-        return None
-    
-    # Обработка разных форматов ответа
-    foods_data = None
-    if "foods" in res:
-        foods_data = res["foods"]
-        if "food" in foods_data:
-            foods_data = foods_data["food"]
-    elif "food" in res:
-        foods_data = res["food"]
-    
-    if not foods_data:
-        logger.info(f"No foods found in FatSecret response for: {query}")
-        return None
-        
-    # Нормализуем в список
-    if isinstance(foods_data, dict):
-        foods = [foods_data]
-    else:
-        foods = foods_data
-    
-    if not foods:
-        logger.info(f"Empty foods list for: {query}")
-        return None
-    
-    logger.info(f"Found {len(foods)} foods for '{query}'")
-    
-    # Выбираем лучший результат
-    def _score(fd: Dict[str, Any]) -> int:
-        score = 0
-        # Приоритет брендовым продуктам
-        if fd.get("brand_name"):
-            score += 2
-        # Приоритет продуктам с ID (полные записи)
-        if fd.get("food_id"):
-            score += 1
-        return score
-    
-    best = max(foods, key=_score)
-    food_id = str(best.get("food_id", ""))
-    
-    if not food_id:
-        logger.warning(f"No food_id found for best match: {best}")
-        return None
-    
-    logger.info(f"Selected best food ID {food_id} for '{query}'")
-    return await _fs_get_food(food_id)
-
 def _fs_norm(food: Optional[Dict[str, Any]], grams: Optional[float], milli_l: Optional[float]) -> Optional[Dict[str, Any]]:
     """Normalize FatSecret food item to our internal format."""
     if not food:
@@ -405,6 +261,31 @@ def _fs_norm(food: Optional[Dict[str, Any]], grams: Optional[float], milli_l: Op
     }
 
 
+async def _fs_barcode_per100(barcode: str) -> Optional[Dict[str, Any]]:
+    """FatSecret lookup by barcode, per 100 g/ml (no portion)."""
+    food_id = await _fs_find_by_barcode(barcode)
+    food = await _fs_get_food(str(food_id)) if food_id else None
+    res = _fs_norm(food, None, None)
+    return res if res and res.get("kcal_100g") is not None else None
+
+
+async def _fs_query_per100(query: str) -> Optional[Dict[str, Any]]:
+    """FatSecret best match for *query*, per 100 g/ml (no portion)."""
+    res = _fs_norm(await _fs_search_best(query), None, None)
+    return res if res and res.get("kcal_100g") is not None else None
+
+
+def _scale_all(items: Any, grams: Optional[float], milli_l: Optional[float]) -> List[Dict[str, Any]]:
+    """Apply the user's portion to cached per-100 g/ml results."""
+    if not isinstance(items, list):
+        items = [items]
+    return [_scale_portion(it, grams, milli_l) for it in items]
+
+
+# одинаковые одновременные search() (по ключу кэша) выполняют один обход CSE/OCR
+_SEARCH_FLIGHT = SingleFlight()
+
+
 async def search(
     query_text: str,
     grams: Optional[float] = None,
@@ -414,9 +295,35 @@ async def search(
     user_id: int = 0,
 ) -> List[Dict[str, Any]]:
     """Search for food data, prioritizing FatSecret and then Google CSE."""
-    clean = _norm_text(query_text)
+    # порция («150 г») не входит в ключи кэша — результаты хранятся на 100 г/мл
+    clean = _norm_text(_strip_portion(query_text))
     query_text = query_text.strip()  # Keep original query for potential barcode extraction
+    cache_key = f"search:{CACHE_SCHEMA}:{clean}:{lang}:{country}"
 
+    # просроченная запись отдаётся сразу, обновление идёт в фоне
+    cached = await _cache_get_swr_async(
+        cache_key, lambda: _search_fresh(query_text, clean, revalidate=True), ttl=SEARCH_CACHE_TTL
+    )
+    if cached:
+        logger.info(f"Search cache hit for '{clean}'")
+        return _scale_all(cached, grams, milli_l)
+
+    candidates = await _SEARCH_FLIGHT.do(cache_key, _search_and_store, query_text, clean, cache_key)
+    return _scale_all(candidates, grams, milli_l)
+
+
+async def _search_and_store(query_text: str, clean: str, cache_key: str) -> List[Dict[str, Any]]:
+    candidates = await _search_fresh(query_text, clean)
+    await _cache_put_async(cache_key, candidates, ttl=SEARCH_CACHE_TTL)
+    return candidates
+
+
+async def _search_fresh(query_text: str, clean: str, revalidate: bool = False) -> List[Dict[str, Any]]:
+    """Run the FatSecret / Google CSE lookup; returns per-100 g/ml candidates.
+
+    With *revalidate* (background refresh of ``search:``) the ``fs:*`` entries
+    are not read but refetched: they are usually just as stale.
+    """
     # Определяем категорию для фильтрации
     cat = _guess_category(query_text)
 
@@ -428,36 +335,34 @@ async def search(
             # 0a) штрих-код
             barcode = _extract_barcode(query_text)
             if barcode:
-                ck = f"fs:bar:{CACHE_SCHEMA}:{barcode}:{grams}:{milli_l}"
-                cached = _cache_get(ck)
+                ck = f"fs:bar:{CACHE_SCHEMA}:{barcode}"
+                cached = None if revalidate else await _cache_get_swr_async(
+                    ck, lambda: _fs_barcode_per100(barcode), ttl=SEARCH_CACHE_TTL
+                )
                 if cached:
                     logger.info(f"FatSecret cached by barcode {barcode}")
                     return cached if isinstance(cached, list) else [cached]
                 
                 # Поиск по штрих-коду
-                food_id = await _fs_find_by_barcode(barcode)
-                if food_id:
-                    food = await _fs_get_food(str(food_id))
-                    if food:
-                        res = _fs_norm(food, grams, milli_l)
-                        if res and res.get("kcal_100g") is not None:
-                            _cache_put(ck, [res], ttl=SEARCH_CACHE_TTL)
-                            return [res]
+                res = await _fs_barcode_per100(barcode)
+                if res:
+                    await _cache_put_async(ck, res, ttl=SEARCH_CACHE_TTL)
+                    return [res]
             
             # 0b) поиск по названию
-            ck = f"fs:q:{CACHE_SCHEMA}:{clean}:{grams}:{milli_l}"
-            cached = _cache_get(ck)
+            ck = f"fs:q:{CACHE_SCHEMA}:{clean}"
+            cached = None if revalidate else await _cache_get_swr_async(
+                ck, lambda: _fs_query_per100(clean), ttl=SEARCH_CACHE_TTL
+            )
             if cached:
                 logger.info(f"FatSecret cached by query {clean}")
                 return cached if isinstance(cached, list) else [cached]
             
-            food = await _fs_search_best(clean)
-            if food:
-                res = _fs_norm(food, grams, milli_l)
-                if res and res.get("kcal_100g") is not None:
-                    _cache_put(ck, [res], ttl=SEARCH_CACHE_TTL)
-                    logger.info(f"FatSecret success for '{clean}': {res.get('name')}")
-                    return [res]
+            res = await _fs_query_per100(clean)
+            if res:
+                await _cache_put_async(ck, res, ttl=SEARCH_CACHE_TTL)
+                logger.info(f"FatSecret success for '{clean}': {res.get('name')}")
+                return [res]
     except Exception as e:
         logger.warning(f"FatSecret branch failed: {e}")
         import traceback
@@ -496,21 +401,21 @@ async def search(
         if "://av.ru/" in url:
             tasks.append(asyncio.create_task(_fetch_av_ru(url)))
         elif "fatsecret" in url and ("ru" in url or "com" in url):
-            tasks.append(asyncio.create_task(_parse_fatsecret_item(url, title, snippet, grams, milli_l)))
+            tasks.append(asyncio.create_task(_parse_fatsecret_item(url, title, snippet, None, None)))
         elif "ozon" in url or "wildberries" in url:
-            tasks.append(asyncio.create_task(_parse_retail_item(url, title, snippet, grams, milli_l)))
+            tasks.append(asyncio.create_task(_parse_retail_item(url, title, snippet, None, None)))
         else:
             # CSE images → Vision OCR (с base64) — пробуем, если есть ключ
             if VISION_KEY:
                 # Try to extract image URL from snippet or use cached image
                 image_url = re.search(r"https?://[^\s]+?\.(?:jpe?g|png|gif|bmp)", snippet)
                 if image_url:
-                    tasks.append(asyncio.create_task(_parse_vision_ocr(image_url.group(0), url, title, grams, milli_l)))
+                    tasks.append(asyncio.create_task(_parse_vision_ocr(image_url.group(0), url, title, None, None)))
                 else:
                     # Fallback to image search if no image in snippet
                     tasks.append(asyncio.create_task(
                         _google_cse_search_images(
-                            f"{clean} nutrition facts", url, title, grams, milli_l
+                            f"{clean} nutrition facts", url, title, None, None
                         )
                     ))
 
@@ -531,10 +436,7 @@ async def search(
     # Sort by kcal_100g if available, otherwise by name
     candidates.sort(key=lambda x: (x.get("kcal_100g") is None, x.get("name", "").lower()))
 
-    # Cache results for the query
-    cache_key = f"search:{CACHE_SCHEMA}:{clean}:{grams}:{milli_l}:{lang}:{country}"
-    _cache_put(cache_key, candidates, ttl=SEARCH_CACHE_TTL)
-
+    # per 100 g/ml; search() caches them and applies the portion on the way out
     return candidates
 
 
@@ -590,7 +492,7 @@ async def _parse_vision_ocr(
 ) -> List[Dict[str, Any]]:
     """Parse food data from an image using Google Vision OCR."""
     try:
-        image_data = requests.get(image_url, timeout=10).content
+        image_data = (await http.get(image_url, timeout=10)).content
         base64_image = _url_to_base64(image_data)
         if not base64_image:
             return []
@@ -598,7 +500,7 @@ async def _parse_vision_ocr(
         # Use Google Vision API for OCR
         if not VISION_KEY:
             return []
-        response = requests.post(
+        response = await http.post(
             f"https://vision.googleapis.com/v1/images:annotate?key={VISION_KEY}",
             json={
                 "requests": [
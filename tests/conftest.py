@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# utils.* creates db.json, bot.log and ./data/cache.db relative to the working
+# directory at import time, so keep the test run away from the checkout.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(tempfile.mkdtemp(prefix="healco-tests-"))
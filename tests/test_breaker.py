@@ -0,0 +1,74 @@
+import asyncio
+import functools
+
+import httpx
+import pytest
+
+from utils import breaker as breaker_mod
+from utils import http
+from utils.breaker import CLOSED, HALF_OPEN, OPEN, BreakerRegistry, CircuitBreaker, CircuitOpenError
+
+
+def test_breaker_opens_half_opens_and_closes(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(breaker_mod.time, "monotonic", lambda: now[0])
+    b = CircuitBreaker("x", failures=2, cooldown=10, probes=1)
+
+    b.failure()
+    assert b.allow() and b.state == CLOSED
+    b.failure()
+    assert b.state == OPEN and b.is_open and not b.allow()
+
+    now[0] += 10
+    assert b.allow() and b.state == HALF_OPEN
+    assert not b.allow()  # one probe at a time
+    b.failure()
+    assert b.state == OPEN and not b.allow()
+
+    now[0] += 10
+    assert b.allow()
+    b.success()
+    assert b.state == CLOSED and b.failures == 0
+    assert b.snapshot()["opened"] == 2
+
+
+def test_http_fails_fast_while_host_circuit_is_open(monkeypatch):
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.host)
+        return httpx.Response(503)
+
+    monkeypatch.setattr(
+        http.httpx, "AsyncClient", functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(handler))
+    )
+    monkeypatch.setattr(http, "breakers", BreakerRegistry(failures=3, cooldown=60, probes=1))
+
+    async def run():
+        for _ in range(3):
+            assert (await http.get("https://down.test/")).status_code == 503
+        with pytest.raises(CircuitOpenError):
+            await http.get("https://down.test/")
+        assert (await http.get("https://up.test/")).status_code == 503  # other hosts unaffected
+        await http.aclose()
+
+    asyncio.run(run())
+    assert calls == ["down.test"] * 3 + ["up.test"]
+    assert http.breakers.stats()["down.test"]["rejected"] == 1
+
+
+def test_blocking_sdk_calls_feed_the_host_breaker(monkeypatch):
+    monkeypatch.setattr(http, "breakers", BreakerRegistry(failures=2, cooldown=60, probes=1))
+
+    def broken():
+        raise ConnectionError("down")
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await http.call_blocking("sdk.test", broken)
+        with pytest.raises(CircuitOpenError):
+            await http.call_blocking("sdk.test", lambda: 1)
+
+    asyncio.run(run())
+    assert http.breakers.get("sdk.test").state == OPEN
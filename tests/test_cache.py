@@ -0,0 +1,246 @@
+import asyncio
+import time
+
+from utils import cache
+from utils.cache import _MemoryLRU, _cache_get, _cache_get_async, _cache_put, _cache_put_async
+
+
+def test_memory_lru_respects_entry_and_byte_budget():
+    lru = _MemoryLRU(max_entries=2, max_bytes=10)
+    lru.put("a", b"1234", 100, 0)
+    lru.put("b", b"1234", 100, 0)
+    assert lru.get("a", 100) == b"1234"  # "a" is now most recent
+    lru.put("c", b"1234", 100, 0)
+    assert lru.get("b", 100) is None
+    lru.put("d", b"12345678", 100, 0)
+    assert lru.bytes <= 10
+    assert lru.get("d", 100) == b"12345678"
+
+
+def test_memory_lru_expires_with_ttl():
+    lru = _MemoryLRU(max_entries=10, max_bytes=100)
+    lru.put("a", b"x", 100, ttl=5)
+    assert lru.get("a", 104) == b"x"
+    assert lru.get("a", 200) is None
+    assert len(lru) == 0
+
+
+def test_hot_keys_are_served_from_memory():
+    _cache_put("fs:bar:test:1", [{"kcal_100g": 50}], ttl=60)
+    cache._con.execute("DELETE FROM cache WHERE key=?", ("fs:bar:test:1",))
+    hits = cache._mem.hits
+    first = _cache_get("fs:bar:test:1")
+    assert first == [{"kcal_100g": 50}]
+    first[0]["kcal_100g"] = 0  # callers get their own copy
+    assert _cache_get("fs:bar:test:1") == [{"kcal_100g": 50}]
+    assert cache._mem.hits == hits + 2
+
+
+def test_reads_buffer_last_used_until_flush():
+    _cache_put("brand:test:touch", {"name": "x"}, ttl=0)
+    cache._con.execute("UPDATE cache SET last_used=1 WHERE key=?", ("brand:test:touch",))
+    cache._con.commit()
+    cache._mem.pop("brand:test:touch")
+
+    assert _cache_get("brand:test:touch") == {"name": "x"}
+    assert cache._con.in_transaction is False
+    row = cache._con.execute("SELECT last_used FROM cache WHERE key=?", ("brand:test:touch",)).fetchone()
+    assert row[0] == 1
+
+    cache.cache_flush()
+    row = cache._con.execute("SELECT last_used FROM cache WHERE key=?", ("brand:test:touch",)).fetchone()
+    assert row[0] > 1
+
+
+def test_put_tracks_size_and_evicts_only_what_is_needed(monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_COMPRESS_MIN", 0)  # keep the blobs at their raw size
+    cache._con.execute("DELETE FROM cache")
+    cache._con.execute("UPDATE cache_meta SET value=0 WHERE name='size_bytes'")
+    cache._con.commit()
+    blob = "x" * 300_000
+    for i in range(3):
+        _cache_put(f"search:test:{i}", blob, limit_mb=1)
+        cache._con.execute("UPDATE cache SET last_used=? WHERE key=?", (i, f"search:test:{i}"))
+        cache._con.commit()
+    assert cache._cache_size() == sum(
+        r[0] for r in cache._con.execute("SELECT size_bytes FROM cache")
+    )
+
+    _cache_put("search:test:3", blob, limit_mb=1)
+    keys = [r[0] for r in cache._con.execute("SELECT key FROM cache ORDER BY key")]
+    assert keys == ["search:test:1", "search:test:2", "search:test:3"]
+    assert cache._cache_size() == sum(
+        r[0] for r in cache._con.execute("SELECT size_bytes FROM cache")
+    )
+    assert cache._cache_size() <= 1024 * 1024
+
+
+def test_async_api_round_trips_off_the_event_loop():
+    async def run():
+        await _cache_put_async("avru:test:async", {"kcal_100g": 12}, ttl=60)
+        cache._mem.pop("avru:test:async")
+        return await _cache_get_async("avru:test:async")
+
+    assert asyncio.run(run()) == {"kcal_100g": 12}
+
+
+def test_negative_cache_expires_on_its_own_deadline(monkeypatch):
+    from utils.cache import _neg_cached_async as neg_cached, _neg_store_async as neg_store
+
+    assert not asyncio.run(neg_cached("fatsecret", "сырок тест 40 г"))
+    asyncio.run(neg_store("fatsecret", "Сырок  тест 45г"))
+    assert asyncio.run(neg_cached("fatsecret", "сырок тест 40 г"))  # portion is not part of the key
+    assert not asyncio.run(neg_cached("usda", "сырок тест"))
+
+    later = time.time() + cache.NEG_CACHE_TTL["fatsecret"] + 1
+    monkeypatch.setattr(cache.time, "time", lambda: later)
+    assert not asyncio.run(neg_cached("fatsecret", "сырок тест"))
+
+
+def test_swr_serves_stale_entry_and_refreshes_once():
+    from utils.cache import _cache_get_swr_async
+
+    cache._cache_put("fs:q:test:swr", {"kcal_100g": 1}, ttl=10)
+    cache._con.execute("UPDATE cache SET last_used=? WHERE key=?", (int(time.time()) - 60, "fs:q:test:swr"))
+    cache._con.commit()
+    cache._mem.pop("fs:q:test:swr")
+    calls = []
+
+    async def refresh():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"kcal_100g": 2}
+
+    async def run():
+        first = await asyncio.gather(*[
+            _cache_get_swr_async("fs:q:test:swr", refresh, ttl=10) for _ in range(3)
+        ])
+        await asyncio.gather(*list(cache._refreshing.values()))
+        return first, await _cache_get_async("fs:q:test:swr")
+
+    first, after = asyncio.run(run())
+    assert first == [{"kcal_100g": 1}] * 3
+    assert calls == [1]
+    assert after == {"kcal_100g": 2}
+    assert not cache._refreshing
+
+
+def test_large_payloads_are_compressed_and_raw_rows_stay_readable():
+    rows = [{"name": f"сырок {i}", "brand": None, "kcal_100ml": None, "url": None} for i in range(200)]
+    _cache_put("search:test:zip", rows, ttl=60)
+    cache._mem.pop("search:test:zip")
+    size, codec = cache._con.execute(
+        "SELECT size_bytes, codec FROM cache WHERE key='search:test:zip'"
+    ).fetchone()
+    assert codec != 0
+    assert size * 3 < len(cache.dumps(rows))
+    assert _cache_get("search:test:zip") == rows
+
+    cache._con.execute(
+        "INSERT OR REPLACE INTO cache(key,payload,last_used,ttl,size_bytes) VALUES (?,?,?,?,?)",
+        ("brand:test:legacy", '{"name": "x"}', int(time.time()), 0, 13),
+    )
+    cache._con.commit()
+    assert _cache_get("brand:test:legacy") == {"name": "x"}
+
+
+def test_snapshot_round_trip_keeps_hot_rows_and_local_keys(tmp_path, monkeypatch):
+    cache._con.execute("DELETE FROM cache")
+    cache._con.commit()
+    now = int(time.time())
+    _cache_put("brand:test:hot", {"name": "hot"}, ttl=600)
+    _cache_put("search:test:big", [{"name": "x" * 50}] * 40, ttl=600)
+    _cache_put("brand:test:cold", {"name": "cold"}, ttl=600)
+    _cache_put("brand:test:dead", {"name": "dead"}, ttl=5)
+    cache._con.execute("UPDATE cache SET last_used=? WHERE key='brand:test:cold'", (now - 100,))
+    cache._con.execute("UPDATE cache SET last_used=? WHERE key='brand:test:dead'", (now - 100,))
+    cache._con.commit()
+
+    path = str(tmp_path / "cache.snapshot")
+    assert cache.cache_export(path, top=2) == 2
+
+    cache._con.execute("DELETE FROM cache")
+    cache._con.commit()
+    monkeypatch.setattr(cache, "_mem", cache._MemoryLRU(10, 10_000))
+    _cache_put("brand:test:hot", {"name": "local"}, ttl=600)
+
+    assert cache.cache_import(path) == 1
+    assert _cache_get("brand:test:hot") == {"name": "local"}
+    assert _cache_get("search:test:big") == [{"name": "x" * 50}] * 40
+    assert _cache_get("brand:test:cold") is None
+    assert cache._cache_size() == sum(r[0] for r in cache._con.execute("SELECT size_bytes FROM cache"))
+
+
+def test_namespace_from_key_prefix():
+    assert cache._namespace("fs:bar:r1:4607001234567") == "fs:bar"
+    assert cache._namespace("fs:q:r1:творог") == "fs:q"
+    assert cache._namespace("search:r1:творог:ru:ru") == "search"
+    assert cache._namespace("avru:https://av.ru/x") == "avru"
+    assert cache._namespace("plainkey") == ""
+
+
+def test_search_burst_cannot_evict_barcodes(monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_COMPRESS_MIN", 0)
+    monkeypatch.setitem(cache.NAMESPACE_POLICIES, "search", cache.NamespacePolicy(quota_mb=0.5, priority=0))
+    cache._con.execute("DELETE FROM cache")
+    cache._con.execute("DELETE FROM cache_meta")
+    cache._con.execute("INSERT INTO cache_meta VALUES ('size_bytes', 0)")
+    cache._con.commit()
+    blob = "x" * 200_000
+
+    _cache_put("fs:bar:test:1", blob, limit_mb=1)
+    _cache_put("fs:bar:test:2", blob, limit_mb=1)
+    for i in range(5):
+        _cache_put(f"search:test:{i}", blob, limit_mb=1)
+
+    keys = {r[0] for r in cache._con.execute("SELECT key FROM cache")}
+    assert {"fs:bar:test:1", "fs:bar:test:2"} <= keys
+    assert {"search:test:3", "search:test:4"} <= keys
+    assert "search:test:0" not in keys
+    assert cache._cache_size("search") <= 512 * 1024
+    assert cache._cache_size() == cache._cache_size("search") + cache._cache_size("fs:bar")
+
+    # global pressure: priority 0 goes first even when it is more recent
+    _cache_put("fs:bar:test:3", blob, limit_mb=1)
+    _cache_put("fs:bar:test:4", blob, limit_mb=1)
+    keys = {r[0] for r in cache._con.execute("SELECT key FROM cache")}
+    assert {f"fs:bar:test:{i}" for i in range(1, 5)} <= keys
+    assert cache._cache_size() <= 1024 * 1024
+
+    ns = cache.cache_stats()["namespaces"]
+    assert ns["search"]["evictions"] >= 3
+    assert ns["fs:bar"]["entries"] == 4
+
+
+def test_namespace_stats_track_expirations_fill_latency_and_sizes(monkeypatch):
+    assert _cache_get("statstest:a") is None
+    _cache_put("statstest:a", {"kcal": 100}, ttl=60)
+    assert _cache_get("statstest:a") == {"kcal": 100}
+
+    later = time.time() + 61
+    monkeypatch.setattr(cache.time, "time", lambda: later)
+    assert _cache_get("statstest:a") is None
+
+    ns = cache.cache_stats()["namespaces"]["statstest"]
+    assert (ns["hits"], ns["misses"], ns["expirations"]) == (1, 2, 1)
+    assert ns["hit_ratio"] == round(1 / 3, 4)
+    assert ns["fill_ms"]["count"] == 1 and ns["hit_ms"]["count"] == 1
+    assert ns["sizes"]["count"] == 1 and ns["bytes_written"] == ns["sizes"]["sum"] > 0
+
+
+def test_bad_namespace_policy_override_is_ignored(monkeypatch):
+    monkeypatch.setattr(cache, "NAMESPACE_POLICIES", dict(cache.NAMESPACE_POLICIES))
+    cache._apply_ns_overrides('{"search": {"quota_mb": "30", "ttl": 60}}')
+    assert cache.NAMESPACE_POLICIES["search"] == cache.NamespacePolicy(quota_mb=30.0, ttl=60, priority=0)
+
+    before = dict(cache.NAMESPACE_POLICIES)
+    for raw in ("{not json", '{"brand": {"quota": 1}}', '{"brand": {"ttl": "soon"}}', "[1]"):
+        cache._apply_ns_overrides(raw)
+    assert cache.NAMESPACE_POLICIES == before
+
+
+def test_namespace_policy_override_is_all_or_nothing(monkeypatch):
+    monkeypatch.setattr(cache, "NAMESPACE_POLICIES", dict(cache.NAMESPACE_POLICIES))
+    before = dict(cache.NAMESPACE_POLICIES)
+    cache._apply_ns_overrides('{"search": {"quota_mb": 30}, "brand": {"ttl": "soon"}}')
+    assert cache.NAMESPACE_POLICIES == before
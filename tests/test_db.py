@@ -0,0 +1,176 @@
+import asyncio
+import json
+import threading
+import time
+
+from utils.db import LocalDB, SQLiteDB, WriteBehind, _open_db
+
+
+def test_journal_appends_instead_of_rewriting_snapshot(tmp_path):
+    path = tmp_path / "db.json"
+    db = LocalDB(str(path), journal=True, compact_every=100)
+    db["user:1"] = {"points": 1}
+    db["user:1"] = {"points": 2}
+    db["user:2"] = {"points": 5}
+
+    assert json.loads(path.read_text(encoding="utf-8")) == {}
+    lines = (tmp_path / "db.json.journal").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 3
+
+    reopened = LocalDB(str(path), journal=True, compact_every=100)
+    assert reopened["user:1"] == {"points": 2}
+    assert reopened["user:2"] == {"points": 5}
+
+
+def test_journal_compaction_folds_records_into_snapshot(tmp_path):
+    path = tmp_path / "db.json"
+    db = LocalDB(str(path), journal=True, compact_every=100)
+    db["a"] = 1
+    db["b"] = [1, 2]
+    db.compact()
+
+    assert json.loads(path.read_text(encoding="utf-8")) == {"a": 1, "b": [1, 2]}
+    assert not (tmp_path / "db.json.journal").exists()
+    assert not (tmp_path / "db.json.journal.1").exists()
+
+    db["a"] = 3
+    reopened = LocalDB(str(path), journal=True)
+    assert reopened["a"] == 3
+    assert reopened["b"] == [1, 2]
+
+
+def test_journal_skips_torn_tail(tmp_path):
+    path = tmp_path / "db.json"
+    db = LocalDB(str(path), journal=True, compact_every=100)
+    db["a"] = 1
+    with open(tmp_path / "db.json.journal", "a", encoding="utf-8") as f:
+        f.write('{"k": "b", "v"')
+
+    reopened = LocalDB(str(path), journal=True)
+    assert reopened["a"] == 1
+    assert "b" not in reopened
+
+
+def test_sqlite_backend_roundtrip_and_prefix_scan(tmp_path):
+    db = SQLiteDB(str(tmp_path / "db.sqlite3"))
+    db["user:1"] = {"points": 3}
+    db["user:10"] = {"points": 7}
+    db["users_count"] = 2
+    db["admin_users"] = [1]
+
+    assert db.get("user:1") == {"points": 3}
+    assert db.get("missing", {}) == {}
+    assert "user:10" in db
+    assert db.keys_prefix("user:") == ["user:1", "user:10"]
+
+
+def test_sqlite_prefix_scan_streams_in_batches(tmp_path, monkeypatch):
+    db = SQLiteDB(str(tmp_path / "db.sqlite3"))
+    monkeypatch.setattr(SQLiteDB, "SCAN_BATCH", 3)
+    db.set_many({f"user:{i:02d}": {"points": i} for i in range(7)} | {"other": 1, "user;": 2})
+
+    scan = db.items_prefix("user:")
+    assert next(scan) == ("user:00", {"points": 0})
+    db["user:05"] = {"points": 50}  # writers are not blocked by an open scan
+    rest = dict(scan)
+    assert list(rest) == [f"user:{i:02d}" for i in range(1, 7)]
+    assert rest["user:05"] == {"points": 50}
+    assert len(dict(db.items_prefix(""))) == 9
+
+
+def test_open_db_migrates_json_store_into_sqlite(tmp_path):
+    json_path = tmp_path / "db.json"
+    json_path.write_text(json.dumps({"user:1": {"points": 4}}), encoding="utf-8")
+
+    db = _open_db(str(json_path), backend="sqlite")
+    assert isinstance(db, SQLiteDB)
+    assert db.get("user:1") == {"points": 4}
+
+    db = _open_db(f"sqlite:///{tmp_path / 'other.db'}")
+    assert isinstance(db, SQLiteDB)
+    assert db.keys() == []
+
+
+class _CountingBackend(dict):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def set_many(self, items):
+        self.batches.append(dict(items))
+        self.update(items)
+
+    def keys_prefix(self, prefix):
+        return [k for k in self if k.startswith(prefix)]
+
+
+def test_write_behind_coalesces_until_flush():
+    backend = _CountingBackend()
+    db = WriteBehind(backend, flush_ms=60_000, max_batch=100)
+    db["user:1"] = {"points": 1}
+    db["user:1"] = {"points": 2}
+    db["user:2"] = {"points": 3}
+
+    assert backend.batches == []
+    assert db.get("user:1") == {"points": 2}
+    assert db.keys_prefix("user:") == ["user:1", "user:2"]
+
+    db.flush()
+    assert backend.batches == [{"user:1": {"points": 2}, "user:2": {"points": 3}}]
+
+
+def test_write_behind_flushes_when_batch_is_full():
+    backend = _CountingBackend()
+    db = WriteBehind(backend, flush_ms=60_000, max_batch=2)
+    db["a"] = 1
+    db["b"] = 2
+    assert backend.batches == [{"a": 1, "b": 2}]
+
+
+def test_lru_pages_states_and_keeps_dirty_entries(tmp_path):
+    backend = SQLiteDB(str(tmp_path / "db.sqlite3"))
+    for i in range(5):
+        backend[f"user:{i}"] = {"points": i}
+    db = WriteBehind(backend, flush_ms=60_000, max_batch=100, cache_size=2)
+
+    db["user:9"] = {"points": 9}  # dirty, must survive eviction
+    for i in range(5):
+        assert db.get(f"user:{i}") == {"points": i}
+    assert len(db._cache) <= 3
+    assert "user:9" in db._cache
+    assert dict(db.items_prefix("user:"))["user:9"] == {"points": 9}
+
+    db.flush()
+    assert backend.get("user:9") == {"points": 9}
+
+
+def test_local_db_loads_lazily_and_skips_lru(tmp_path):
+    path = tmp_path / "db.json"
+    path.write_text(json.dumps({"a": 1}), encoding="utf-8")
+    db = LocalDB(str(path))
+    assert db._store is None
+    assert db.get("a") == 1
+    assert WriteBehind(db, cache_size=10).cache_size == 0
+
+
+def test_write_behind_never_flushes_from_a_thread_of_its_own():
+    backend = _CountingBackend()
+    flushed_in = []
+    backend.set_many = lambda items: flushed_in.append(threading.current_thread())
+    db = WriteBehind(backend, flush_ms=10, max_batch=100)
+
+    # No loop: nothing flushes in the background; the next late write does it
+    db["a"] = 1
+    time.sleep(0.03)
+    assert flushed_in == []
+    db["b"] = 2
+    assert flushed_in == [threading.current_thread()]
+
+    async def run():
+        db["c"] = 3  # remembers the loop
+        await asyncio.sleep(0.03)
+        await asyncio.to_thread(db.__setitem__, "d", 4)
+        await asyncio.sleep(0.03)
+
+    asyncio.run(run())
+    assert flushed_in[1:] == [threading.current_thread()] * 2
@@ -0,0 +1,83 @@
+import ast
+import pathlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+# Load the archive helpers from main.py without executing the whole module
+MAIN_PATH = pathlib.Path(__file__).resolve().parent.parent / "main.py"
+NAMES = {"_ARCHIVE_LISTS", "_ARCHIVE_DAYS", "_safe_list", "_entry_day", "archive_key", "archive_old_diaries", "diary_view",
+         "archived_counts", "diary_entry_count", "get_last_hrrest"}
+with MAIN_PATH.open("r", encoding="utf-8") as f:
+    module_ast = ast.parse(f.read(), filename="main.py")
+
+nodes = [
+    node
+    for node in module_ast.body
+    if (isinstance(node, ast.FunctionDef) and node.name in NAMES)
+    or (isinstance(node, ast.Assign) and any(getattr(t, "id", None) in NAMES for t in node.targets))
+]
+STORE: Dict[str, Any] = {}
+ns: Dict[str, Any] = {
+    "Dict": Dict, "Any": Any, "List": List, "Optional": Optional,
+    "datetime": datetime, "timedelta": timedelta, "DIARY_HOT_DAYS": 30,
+    "db_get": lambda k, default=None: STORE.get(k, default),
+    "db_set": STORE.__setitem__,
+}
+exec(compile(ast.Module(body=nodes, type_ignores=[]), filename="main.py", mode="exec"), ns)
+
+
+def _ts(days_ago: int) -> str:
+    return (datetime.now() - timedelta(days=days_ago)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def test_old_entries_move_to_monthly_partitions_and_back_into_view():
+    STORE.clear()
+    old, fresh = _ts(90), _ts(1)
+    st = {
+        "diaries": {"food": [{"ts": old, "kcal": 100}, {"ts": fresh, "kcal": 200}], "train": [], "metrics": []},
+        "daily_energy": {old[:10]: {"in": 100, "out": 0}, fresh[:10]: {"in": 200, "out": 0}},
+        "daily_nutrition": {old[:10]: {"kcal": 100}, fresh[:10]: {"kcal": 200}},
+        "awards": {},
+    }
+
+    assert ns["archive_old_diaries"](7, st) == 1
+    assert st["diaries"]["food"] == [{"ts": fresh, "kcal": 200}]
+    assert list(st["daily_energy"]) == [fresh[:10]]
+    assert st["archive_months"] == [old[:7]]
+    part = STORE[f"diary:7:{old[:7]}"]
+    assert part["food"] == [{"ts": old, "kcal": 100}]
+    assert part["daily_nutrition"] == {old[:10]: {"kcal": 100}}
+
+    # Nothing old left: the fast path does not touch storage again
+    assert ns["archive_old_diaries"](7, st) == 0
+
+    view = ns["diary_view"](7, st)
+    assert [x["kcal"] for x in view["diaries"]["food"]] == [100, 200]
+    assert set(view["daily_energy"]) == {old[:10], fresh[:10]}
+    assert len(st["diaries"]["food"]) == 1
+
+
+def test_archived_entries_still_count_towards_the_free_limit():
+    STORE.clear()
+    st = {"diaries": {"food": [{"ts": _ts(90), "kcal": 100}], "train": [{"ts": _ts(60)}, {"ts": _ts(1)}]}}
+    assert ns["diary_entry_count"](8, st) == 3
+    assert ns["archive_old_diaries"](8, st) == 2
+    assert st["archived_counts"] == {"food": 1, "train": 1}
+    assert ns["diary_entry_count"](8, st) == 3
+
+    # accounts archived before the counter existed are counted from their partitions once
+    legacy = {"diaries": {"food": [], "train": []}, "archive_months": sorted(st["archive_months"])}
+    assert ns["diary_entry_count"](8, legacy) == 2
+    assert legacy["archived_counts"] == {"food": 1, "train": 1, "metrics": 0}
+
+
+def test_resting_hr_survives_archiving_of_zones_entry():
+    STORE.clear()
+    st = {
+        "profile": {"age": 30},
+        "diaries": {"food": [], "train": [], "metrics": [{"ts": _ts(90), "type": "zones", "data": {"hrrest": 52}}]},
+    }
+    assert ns["get_last_hrrest"](st) == 52
+    assert ns["archive_old_diaries"](9, st) == 1
+    assert st["diaries"]["metrics"] == []
+    assert ns["get_last_hrrest"](st) == 52
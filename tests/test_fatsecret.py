@@ -0,0 +1,38 @@
+import asyncio
+
+import search
+from utils import fatsecret
+
+
+def test_search_module_uses_the_shared_client():
+    assert search._fs_get_food is fatsecret._fs_get_food
+    assert search._fs_search_best is fatsecret._fs_search_best
+
+
+def test_lookups_parse_responses_and_coalesce(monkeypatch):
+    calls = []
+    responses = {
+        "food.find_id_for_barcode": {"food_id": {"value": "42"}},
+        "foods.search": {"foods": {"food": [
+            {"food_id": "1", "food_name": "сыр"},
+            {"food_id": "2", "food_name": "сыр", "brand_name": "Бренд"},
+        ]}},
+        "food.get.v2": {"food": {"food_id": "2", "food_name": "сыр"}},
+    }
+
+    async def fake_request(method, params=None):
+        calls.append(method)
+        await asyncio.sleep(0.01)
+        return responses[method]
+
+    monkeypatch.setattr(fatsecret, "_fs_request", fake_request)
+
+    async def run():
+        fid = await fatsecret._fs_find_by_barcode("4600000000000")
+        best = await asyncio.gather(fatsecret._fs_search_best("сыр"), fatsecret._fs_search_best("сыр"))
+        return fid, best
+
+    fid, best = asyncio.run(run())
+    assert fid == "42"
+    assert best[0] == best[1] == {"food_id": "2", "food_name": "сыр"}
+    assert calls == ["food.find_id_for_barcode", "foods.search", "food.get.v2"]
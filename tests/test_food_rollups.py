@@ -0,0 +1,43 @@
+import ast
+import pathlib
+from typing import Any, Dict, List, Optional
+
+# Load the rollup helpers from main.py without executing the whole module
+MAIN_PATH = pathlib.Path(__file__).resolve().parent.parent / "main.py"
+NAMES = {"_ROLLUP_KEYS", "_safe_list", "_food_rollup_add", "add_food_entry", "rebuild_food_rollups", "food_day_totals"}
+with MAIN_PATH.open("r", encoding="utf-8") as f:
+    module_ast = ast.parse(f.read(), filename="main.py")
+
+nodes = [
+    node
+    for node in module_ast.body
+    if (isinstance(node, ast.FunctionDef) and node.name in NAMES)
+    or (isinstance(node, ast.Assign) and any(getattr(t, "id", None) in NAMES for t in node.targets))
+]
+ns: Dict[str, Any] = {"Dict": Dict, "Any": Any, "List": List, "Optional": Optional}
+exec(compile(ast.Module(body=nodes, type_ignores=[]), filename="main.py", mode="exec"), ns)
+
+
+def _state():
+    return {"diaries": {"food": [], "train": [], "metrics": []}, "daily_nutrition": {}}
+
+
+def test_add_food_entry_maintains_day_rollup():
+    st = _state()
+    ns["add_food_entry"](st, {"ts": "2024-05-01 08:00:00", "kcal": 300, "p": 10.5, "f": 5, "c": 40})
+    ns["add_food_entry"](st, {"ts": "2024-05-01 13:00:00", "kcal": 450, "p": 20, "f": "x", "c": None})
+    ns["add_food_entry"](st, {"ts": "2024-05-02 09:00:00", "text": "не найдено"})
+
+    assert len(st["diaries"]["food"]) == 3
+    assert ns["food_day_totals"](st, "2024-05-01") == {"kcal": 750, "p": 30, "f": 5, "c": 40}
+    assert ns["food_day_totals"](st, "2024-05-02") == {"kcal": 0, "p": 0, "f": 0, "c": 0}
+    assert ns["food_day_totals"](st, "2024-05-03") is None
+
+
+def test_rebuild_after_delete_matches_remaining_entries():
+    st = _state()
+    for kcal in (100, 200, 300):
+        ns["add_food_entry"](st, {"ts": "2024-05-01 08:00:00", "kcal": kcal})
+    st["diaries"]["food"].pop(1)
+    ns["rebuild_food_rollups"](st)
+    assert ns["food_day_totals"](st, "2024-05-01")["kcal"] == 400
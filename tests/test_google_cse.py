@@ -0,0 +1,72 @@
+import ast
+import asyncio
+import functools
+import pathlib
+from typing import List
+
+import httpx
+
+from utils import http
+from utils.breaker import BreakerRegistry
+from utils.logging import logger
+from utils.ratelimit import HostLimit, RateLimiter
+
+# Load the legacy CSE helpers used by _branded_lookup from main.py without executing the whole module
+MAIN_PATH = pathlib.Path(__file__).resolve().parent.parent / "main.py"
+NAMES = {"_google_cse_search", "_google_cse_images"}
+with MAIN_PATH.open("r", encoding="utf-8") as f:
+    module_ast = ast.parse(f.read(), filename="main.py")
+
+nodes = [node for node in module_ast.body if isinstance(node, ast.AsyncFunctionDef) and node.name in NAMES]
+ns = {"List": List, "http": http, "logger": logger, "GOOGLE_CSE_KEY": "key", "GOOGLE_CSE_CX": "cx"}
+exec(compile(ast.Module(body=nodes, type_ignores=[]), filename="main.py", mode="exec"), ns)
+
+CSE_HOST = "www.googleapis.com"
+
+
+def _mock_transport(monkeypatch, status=200):
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.params.get("searchType", "web"))
+        return httpx.Response(status, json={"items": [{"link": "https://shop.test/p"}]})
+
+    monkeypatch.setattr(
+        http.httpx, "AsyncClient", functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(handler))
+    )
+    return calls
+
+
+def test_branded_cse_fallbacks_take_tokens_from_the_googleapis_bucket(monkeypatch):
+    calls = _mock_transport(monkeypatch)
+    monkeypatch.setattr(http, "limiter", RateLimiter({CSE_HOST: HostLimit(rate=50, burst=1)}))
+
+    async def run():
+        pages = await ns["_google_cse_search"]("сырок бренд", num=6)
+        images = await ns["_google_cse_images"]("сырок бренд nutrition facts", num=4)
+        await http.aclose()
+        return pages, images
+
+    pages, images = asyncio.run(run())
+    assert pages == images == ["https://shop.test/p"]
+    assert calls == ["web", "image"]
+    stats = http.limiter.stats()[CSE_HOST]
+    assert stats["requests"] == 2
+    assert stats["delayed"] == 1  # burst of one: the image search waited for a token
+
+
+def test_cse_outage_opens_the_googleapis_breaker(monkeypatch):
+    calls = _mock_transport(monkeypatch, status=503)
+    monkeypatch.setattr(http, "breakers", BreakerRegistry(failures=2, cooldown=60, probes=1))
+
+    async def run():
+        assert await ns["_google_cse_search"]("сырок бренд") == []
+        assert await ns["_google_cse_images"]("сырок бренд") == []
+        # the open circuit is swallowed like any other CSE error, without calling out
+        assert await ns["_google_cse_search"]("сырок бренд") == []
+        await http.aclose()
+
+    asyncio.run(run())
+    assert len(calls) == 2
+    assert http.breakers.get(CSE_HOST).is_open
+    assert http.breakers.stats()[CSE_HOST]["rejected"] == 1
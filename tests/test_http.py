@@ -0,0 +1,53 @@
+import asyncio
+import functools
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+from utils import http
+
+
+def test_oauth1_query_url_signs_in_query_string():
+    url = http.oauth1_query_url("https://example.com/api", {"method": "foods.search", "q": "сыр"}, "key", "secret")
+    query = parse_qs(urlsplit(url).query)
+    assert query["method"] == ["foods.search"] and query["q"] == ["сыр"]
+    assert query["oauth_consumer_key"] == ["key"]
+    assert query["oauth_signature_method"] == ["HMAC-SHA1"]
+    assert query["oauth_signature"]
+
+
+def test_client_is_shared_per_loop_and_requests_are_capped_per_host(monkeypatch):
+    running = {"now": 0, "max": 0}
+
+    async def handler(request):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+        return httpx.Response(200, json={"host": request.url.host})
+
+    monkeypatch.setattr(
+        http.httpx, "AsyncClient", functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(handler))
+    )
+    monkeypatch.setattr(http, "HTTP_PER_HOST", 2)
+
+    async def run():
+        assert http.get_client() is http.get_client()
+        responses = await asyncio.gather(*(http.get(f"https://a.test/{i}") for i in range(6)))
+        client = http.get_client()
+        await http.aclose()
+        return responses, client
+
+    responses, client = asyncio.run(run())
+    assert [r.json()["host"] for r in responses] == ["a.test"] * 6
+    assert running["max"] == 2
+    assert client.is_closed
+
+
+def test_call_blocking_takes_a_token_from_the_host_bucket(monkeypatch):
+    from utils.ratelimit import HostLimit, RateLimiter
+
+    monkeypatch.setattr(http, "limiter", RateLimiter({"*": HostLimit(rate=10, burst=1)}))
+    result = asyncio.run(http.call_blocking("sdk.test", lambda a, b=0: a + b, 1, b=2))
+    assert result == 3
+    assert http.limiter.stats()["sdk.test"]["requests"] == 1
@@ -0,0 +1,17 @@
+from utils.leaderboard import LeaderboardIndex
+
+
+def test_rank_and_top_follow_point_updates():
+    board = LeaderboardIndex()
+    board.rebuild([("1", 10), ("2", 30), ("3", 20)])
+    assert [x["user_id"] for x in board.top(10)] == ["2", "3", "1"]
+    assert board.rank(1) == 3
+
+    board.update(1, 40)
+    board.update(4, 5)
+    assert board.top(2) == [{"user_id": "1", "points": 40}, {"user_id": "2", "points": 30}]
+    assert board.rank("1") == 1
+    assert board.rank(4) == 4
+    assert board.rank(99) is None
+    assert board.points(1) == 40 and board.points(99) is None
+    assert len(board) == 4
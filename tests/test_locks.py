@@ -0,0 +1,23 @@
+import asyncio
+
+from utils.locks import KeyedLocks
+
+
+def test_same_key_runs_in_order_other_keys_in_parallel():
+    locks = KeyedLocks()
+    log = []
+
+    async def work(key, tag, delay):
+        async with locks.hold(key):
+            log.append(("start", tag))
+            await asyncio.sleep(delay)
+            log.append(("end", tag))
+
+    async def run():
+        await asyncio.gather(work(1, "a", 0.02), work(1, "b", 0), work(2, "c", 0))
+
+    asyncio.run(run())
+
+    assert log.index(("end", "a")) < log.index(("start", "b"))
+    assert log.index(("start", "c")) < log.index(("end", "a"))
+    assert len(locks) == 0
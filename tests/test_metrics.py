@@ -0,0 +1,14 @@
+from utils.metrics import Histogram
+
+
+def test_histogram_buckets_and_quantiles():
+    h = Histogram((1, 10, 100))
+    for v in (0.5, 3, 7, 9, 50, 1000):
+        h.observe(v)
+    snap = h.snapshot()
+    assert snap["buckets"] == {"1": 1, "10": 3, "100": 1, "+Inf": 1}
+    assert snap["count"] == 6
+    assert snap["p50"] == 10.0
+    assert h.quantile(0.99) == float("inf")
+    assert h.mean == sum((0.5, 3, 7, 9, 50, 1000)) / 6
+    assert Histogram((1,)).quantile(0.5) == 0.0
@@ -0,0 +1,30 @@
+import pytest
+
+from utils.utils import _scale_portion, _strip_portion
+
+
+def test_strip_portion_keeps_only_the_product():
+    assert _strip_portion("творог 150г") == "творог"
+    assert _strip_portion("творог 200 г") == "творог"
+    assert _strip_portion("сок 0,5 л") == "сок"
+    assert _strip_portion("4607001234567") == "4607001234567"
+    assert _strip_portion("150г") == "150г"
+
+
+def test_scale_portion_applies_grams_after_cache_read():
+    base = {"name": "творог", "kcal_100g": 120.0, "protein_100g": 16.0,
+            "fat_100g": 5.0, "carbs_100g": None, "portion_g": None, "kcal_portion": None}
+    res = _scale_portion(base, 150, None)
+    assert res["portion_g"] == 150
+    assert res["kcal_portion"] == pytest.approx(180.0)
+    assert res["protein_portion"] == pytest.approx(24.0)
+    assert res["carbs_portion"] is None
+    assert base["kcal_portion"] is None  # cached value stays per 100 g
+
+
+def test_scale_portion_prefers_per_100ml_for_volumes():
+    base = {"kcal_100g": 50.0, "kcal_100ml": 42.0, "protein_100ml": 1.0}
+    res = _scale_portion(base, None, 330)
+    assert res["kcal_portion"] == pytest.approx(138.6)
+    assert _scale_portion({"kcal_100g": 50.0}, None, 200)["kcal_portion"] == pytest.approx(100.0)
+    assert _scale_portion(base, None, None)["kcal_portion"] is None
@@ -0,0 +1,47 @@
+import asyncio
+
+from utils.ratelimit import HostLimit, RateLimiter, TokenBucket
+
+
+def test_bucket_allows_burst_then_serves_waiters_in_order():
+    bucket = TokenBucket(rate=50, burst=2)
+    done = []
+
+    async def call(i):
+        waited = await bucket.acquire()
+        done.append((i, waited))
+
+    async def run():
+        await asyncio.gather(*(call(i) for i in range(5)))
+
+    asyncio.run(run())
+    assert [i for i, _ in done] == [0, 1, 2, 3, 4]
+    assert [w for _, w in done[:2]] == [0.0, 0.0]
+    assert 0.015 < done[2][1] < done[3][1] < done[4][1] < 0.07
+    assert bucket.delayed == 3
+    assert bucket.waits.count == 5
+
+
+def test_cancelled_waiter_returns_its_token():
+    bucket = TokenBucket(rate=10, burst=1)
+
+    async def run():
+        await bucket.acquire()
+        waiter = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return await bucket.acquire()
+
+    assert asyncio.run(run()) < 0.11
+
+
+def test_registry_keys_buckets_by_host_with_default_limit():
+    limiter = RateLimiter({"a.test": HostLimit(rate=1, burst=1), "*": HostLimit(rate=5, burst=3)})
+    assert limiter.bucket("a.test").rate == 1
+    assert limiter.bucket("b.test") is limiter.bucket("b.test")
+    assert limiter.bucket("b.test") is not limiter.bucket("c.test")
+    assert limiter.bucket("c.test").burst == 3
+
+    asyncio.run(limiter.acquire("a.test"))
+    assert limiter.stats()["a.test"]["requests"] == 1
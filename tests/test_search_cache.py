@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+import search
+from utils import cache
+
+
+def test_search_reads_through_and_shares_in_flight_calls(monkeypatch):
+    calls = []
+
+    async def fake_fresh(query_text, clean, revalidate=False):
+        calls.append(clean)
+        await asyncio.sleep(0.05)
+        return [{"name": clean, "kcal_100g": 100.0}]
+
+    monkeypatch.setattr(search, "_search_fresh", fake_fresh)
+
+    async def run():
+        first, second = await asyncio.gather(
+            search.search("кефир тест 200 г", grams=200),
+            search.search("кефир тест", grams=100),
+        )
+        third = await search.search("кефир тест 50г", grams=50)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert calls == ["кефир тест"]
+    assert first[0]["kcal_portion"] == 200.0
+    assert second[0]["kcal_portion"] == 100.0
+    assert third[0]["kcal_portion"] == 50.0
+    assert not len(search._SEARCH_FLIGHT)
+
+
+def _make_stale(key):
+    cache._con.execute("UPDATE cache SET last_used=? WHERE key=?", (int(time.time()) - 120, key))
+    cache._con.commit()
+    cache._mem.pop(key)
+
+
+def test_background_refresh_does_not_reuse_stale_inner_entries(monkeypatch):
+    monkeypatch.setattr(search, "FATSECRET_KEY", "key")
+    monkeypatch.setattr(search, "FATSECRET_SECRET", "secret")
+
+    async def fresh_fs(query):
+        return {"name": "NEW", "kcal_100g": 50.0}
+
+    monkeypatch.setattr(search, "_fs_query_per100", fresh_fs)
+    search_key = f"search:{search.CACHE_SCHEMA}:сырок рефреш:en:us"
+    fs_key = f"fs:q:{search.CACHE_SCHEMA}:сырок рефреш"
+    cache._cache_put(search_key, [{"name": "OLD", "kcal_100g": 10.0}], ttl=60)
+    cache._cache_put(fs_key, {"name": "OLD", "kcal_100g": 10.0}, ttl=60)
+    _make_stale(search_key)
+    _make_stale(fs_key)
+
+    async def run():
+        stale = await search.search("сырок рефреш")
+        await asyncio.gather(*list(cache._refreshing.values()))
+        return stale, await cache._cache_get_async(search_key), await cache._cache_get_async(fs_key)
+
+    stale, refreshed, inner = asyncio.run(run())
+    assert stale[0]["name"] == "OLD"
+    assert refreshed[0]["name"] == "NEW"
+    assert inner["name"] == "NEW"
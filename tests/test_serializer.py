@@ -0,0 +1,21 @@
+import json
+
+import pytest
+
+from utils import serializer
+
+
+def test_roundtrip_and_legacy_json_text():
+    obj = {"name": "Творог 5%", "kcal_100g": 121.0, "tags": [1, None, True]}
+    assert serializer.loads(serializer.dumps(obj)) == obj
+    # Rows written by older versions are plain JSON text
+    assert serializer.loads(json.dumps(obj, ensure_ascii=False, indent=2)) == obj
+    assert serializer.loads(serializer.dumps_json(obj).encode("utf-8")) == obj
+
+
+def test_msgpack_payloads_are_tagged(monkeypatch):
+    pytest.importorskip("msgpack")
+    monkeypatch.setattr(serializer, "CODEC", "msgpack")
+    data = serializer.dumps([{"a": 1}])
+    assert isinstance(data, bytes) and data.startswith(b"\x00mp")
+    assert serializer.loads(memoryview(data)) == [{"a": 1}]
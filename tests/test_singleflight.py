@@ -0,0 +1,48 @@
+import asyncio
+
+from utils.singleflight import SingleFlight, single_flight
+
+
+def test_identical_calls_share_one_flight_and_get_copies():
+    calls = []
+
+    @single_flight
+    async def lookup(query):
+        calls.append(query)
+        await asyncio.sleep(0.02)
+        return {"name": query}
+
+    async def run():
+        return await asyncio.gather(lookup("сырок"), lookup("сырок"), lookup("кефир"))
+
+    a, b, c = asyncio.run(run())
+    assert sorted(calls) == ["кефир", "сырок"]
+    assert a == b == {"name": "сырок"} and a is not b
+    assert c == {"name": "кефир"}
+    assert len(lookup.flight) == 0
+
+
+def test_errors_reach_waiters_and_cancelled_leader_hands_over():
+    group = SingleFlight()
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("provider down")
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return 1
+
+    async def run():
+        res = await asyncio.gather(group.do("k", boom), group.do("k", boom), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in res)
+
+        leader = asyncio.create_task(group.do("k", slow))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(group.do("k", slow))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await waiter
+
+    assert asyncio.run(run()) == 1
+    assert len(group) == 0
@@ -3,9 +3,29 @@ functions for the HealCo Lite project."""
 
 from .config import get_secret
 from .logging import logger
-from .cache import _cache_get, _cache_put, CACHE_SCHEMA
-from .db import DB, db_get, db_set, db_keys_prefix
-from . import consts
+from .cache import (
+    _cache_get,
+    _cache_put,
+    _cache_get_async,
+    _cache_put_async,
+    _cache_get_swr_async,
+    _neg_cached_async,
+    _neg_store_async,
+    NamespacePolicy,
+    cache_flush,
+    cache_export,
+    cache_import,
+    cache_stats,
+    CACHE_SCHEMA,
+)
+from .db import DB, db_get, db_set, db_keys_prefix, db_items_prefix, db_flush
+from .leaderboard import LeaderboardIndex
+from .locks import KeyedLocks
+from .metrics import Histogram
+from .ratelimit import HostLimit, RateLimiter, TokenBucket
+from .breaker import CircuitBreaker, CircuitOpenError
+from .singleflight import SingleFlight, single_flight
+from . import consts, http
 from .utils import (
     _extract_barcode,
     _extract_country,
@@ -25,6 +45,8 @@ from .utils import (
     _norm_text,
     _parse_google_recipes,
     _parse_link,
+    _scale_portion,
+    _strip_portion,
     _url_to_base64,
 )
 
@@ -33,12 +55,35 @@ __all__ = [
     "logger",
     "_cache_get",
     "_cache_put",
+    "_cache_get_async",
+    "_cache_put_async",
+    "_cache_get_swr_async",
+    "_neg_cached_async",
+    "_neg_store_async",
+    "NamespacePolicy",
+    "cache_flush",
+    "cache_export",
+    "cache_import",
+    "cache_stats",
     "CACHE_SCHEMA",
     "DB",
     "db_get",
     "db_set",
     "db_keys_prefix",
+    "db_items_prefix",
+    "db_flush",
+    "LeaderboardIndex",
+    "KeyedLocks",
+    "Histogram",
+    "HostLimit",
+    "RateLimiter",
+    "TokenBucket",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "SingleFlight",
+    "single_flight",
     "consts",
+    "http",
     "_extract_barcode",
     "_extract_country",
     "_extract_lang",
@@ -57,5 +102,7 @@ __all__ = [
     "_norm_text",
     "_parse_google_recipes",
     "_parse_link",
+    "_scale_portion",
+    "_strip_portion",
     "_url_to_base64",
 ]
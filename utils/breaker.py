@@ -0,0 +1,129 @@
+"""Per-host circuit breakers for outbound provider calls.
+
+A breaker opens after ``HTTP_BREAKER_FAILURES`` consecutive failures
+(transport errors, timeouts, 5xx, 429 and 401/403, which is how an IP
+whitelist problem at FatSecret looks). While open, :mod:`utils.http` rejects
+calls to that host at once with :class:`CircuitOpenError` instead of letting
+every lookup wait out its timeout. After ``HTTP_BREAKER_COOLDOWN_S`` the
+breaker half-opens and lets ``HTTP_BREAKER_PROBES`` requests through: a
+success closes it, a failure opens it for another cooldown.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict
+
+from .consts import HTTP_BREAKER_COOLDOWN_S, HTTP_BREAKER_FAILURES, HTTP_BREAKER_PROBES
+from .logging import logger
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a host whose breaker is open."""
+
+    def __init__(self, host: str):
+        super().__init__(f"circuit open for {host}")
+        self.host = host
+
+
+def is_failure_status(status: int) -> bool:
+    return status >= 500 or status in (401, 403, 429)
+
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures -> half-open after a cooldown."""
+
+    def __init__(self, name: str, failures: int = 5, cooldown: float = 30.0, probes: int = 1):
+        self.name = name
+        self.max_failures = max(1, failures)
+        self.cooldown = cooldown
+        self.max_probes = max(1, probes)
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.opened = 0  # times opened since start
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; in half-open state each allowed call is a probe."""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                self.rejected += 1
+                return False
+            self.state, self.probes = HALF_OPEN, 0
+        if self.state == HALF_OPEN:
+            if self.probes >= self.max_probes:
+                self.rejected += 1
+                return False
+            self.probes += 1
+        return True
+
+    def success(self) -> None:
+        if self.state != CLOSED:
+            logger.info("circuit for %s closed", self.name)
+        self.state, self.failures, self.probes = CLOSED, 0, 0
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.max_failures:
+            if self.state != OPEN:
+                logger.warning("circuit for %s open after %s failures", self.name, self.failures)
+                self.opened += 1
+            self.state, self.opened_at, self.probes = OPEN, time.monotonic(), 0
+
+    def abandon(self) -> None:
+        """A call ended without a verdict (cancelled): free its probe slot."""
+        if self.state == HALF_OPEN and self.probes:
+            self.probes -= 1
+
+    @property
+    def is_open(self) -> bool:
+        """True while calls are being rejected (open and still cooling down)."""
+        return self.state == OPEN and time.monotonic() - self.opened_at < self.cooldown
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class BreakerRegistry:
+    """Circuit breakers keyed by host, created on first use."""
+
+    def __init__(self, failures: int, cooldown: float, probes: int):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.probes = probes
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str) -> CircuitBreaker:
+        b = self._breakers.get(host)
+        if b is None:
+            with self._lock:
+                b = self._breakers.setdefault(
+                    host, CircuitBreaker(host, self.failures, self.cooldown, self.probes)
+                )
+        return b
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {host: b.snapshot() for host, b in list(self._breakers.items())}
+
+
+breakers = BreakerRegistry(HTTP_BREAKER_FAILURES, HTTP_BREAKER_COOLDOWN_S, HTTP_BREAKER_PROBES)
+
+
+__all__ = [
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "BreakerRegistry",
+    "breakers",
+    "is_failure_status",
+]
@@ -1,70 +1,726 @@
-"""Simple SQLite based cache used for search results."""
+"""Simple SQLite based cache used for search results.
+
+A bounded in-process LRU sits in front of the SQLite table; keys are grouped
+into namespaces by prefix, each with its own :class:`NamespacePolicy`.
+:func:`cache_export` / :func:`cache_import` move the hottest entries between
+instances (see ``python -m utils.cache_snapshot``).
+"""
 
 from __future__ import annotations
 
+import asyncio
+import atexit
+import dataclasses
+import gzip
 import json
 import os
 import sqlite3
+import threading
+import struct
 import time
-from typing import Any, Optional
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from .consts import (
+    CACHE_MEM_ENTRIES,
+    CACHE_COMPRESS_MIN,
+    CACHE_MEM_MB,
+    CACHE_NS_POLICY,
+    CACHE_SCHEMA,
+    CACHE_STALE_S,
+    CACHE_TOUCH_BATCH,
+    CACHE_TOUCH_FLUSH_S,
+    NEG_CACHE_TTL,
+    SEARCH_CACHE_TTL,
+)
+from .logging import logger
+from .metrics import LATENCY_BUCKETS_MS, SIZE_BUCKETS, Histogram
+from .serializer import dumps, loads
+from .utils import _norm_text, _strip_portion
+
+try:
+    import zstandard
+
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+
+@dataclass(frozen=True)
+class NamespacePolicy:
+    """Cache policy for keys sharing a prefix.
+
+    The quota is enforced on the namespace's own LRU; the priority decides
+    which namespaces lose entries when the whole table exceeds ``limit_mb``.
+    """
+
+    quota_mb: float = 0  # 0: only the global limit_mb applies
+    ttl: int = 0  # used when a put does not pass a TTL; 0 never expires
+    priority: int = 1  # under global pressure lower priorities are evicted first
+
+
+_DEFAULT_POLICY = NamespacePolicy()
+NAMESPACE_POLICIES: Dict[str, NamespacePolicy] = {
+    "search": NamespacePolicy(quota_mb=20, ttl=SEARCH_CACHE_TTL, priority=0),
+    "neg": NamespacePolicy(quota_mb=2, priority=0),
+    "avru": NamespacePolicy(quota_mb=5, ttl=3 * 24 * 60 * 60, priority=1),
+    "brand": NamespacePolicy(quota_mb=10, ttl=SEARCH_CACHE_TTL, priority=1),
+    "fs:q": NamespacePolicy(quota_mb=10, ttl=SEARCH_CACHE_TTL, priority=1),
+    # barcodes are the most expensive entries to refetch
+    "fs:bar": NamespacePolicy(quota_mb=15, ttl=SEARCH_CACHE_TTL, priority=2),
+}
+
+
+def _apply_ns_overrides(raw: str) -> None:
+    """Merge ``CACHE_NS_POLICY`` JSON into the policies.
+
+    All or nothing: if any entry is bad the whole value is logged and ignored,
+    keeping the defaults.
+    """
+    merged: Dict[str, NamespacePolicy] = {}
+    try:
+        for ns, fields in json.loads(raw).items():
+            p = dataclasses.replace(NAMESPACE_POLICIES.get(ns, _DEFAULT_POLICY), **fields)
+            merged[ns] = NamespacePolicy(float(p.quota_mb), int(p.ttl), int(p.priority))
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning("CACHE_NS_POLICY ignored: %s", e)
+        return
+    NAMESPACE_POLICIES.update(merged)
+
+
+if CACHE_NS_POLICY:
+    _apply_ns_overrides(CACHE_NS_POLICY)
 
-from .consts import CACHE_SCHEMA
+
+def _namespace(k: str) -> str:
+    """Key prefix before the first ':'; two segments when a policy names them (``fs:bar``)."""
+    parts = k.split(":", 2)
+    if len(parts) > 2 and f"{parts[0]}:{parts[1]}" in NAMESPACE_POLICIES:
+        return f"{parts[0]}:{parts[1]}"
+    return parts[0] if len(parts) > 1 else ""
+
+
+def _policy(ns: str) -> NamespacePolicy:
+    return NAMESPACE_POLICIES.get(ns, _DEFAULT_POLICY)
 
 # Location for the cache database
 os.makedirs("./data", exist_ok=True)
-_con = sqlite3.connect("./data/cache.db")
+_con = sqlite3.connect("./data/cache.db", check_same_thread=False)
+_con.execute("PRAGMA journal_mode=WAL")
+_con.execute("PRAGMA synchronous=NORMAL")
 _con.execute(
     """CREATE TABLE IF NOT EXISTS cache (
     key TEXT PRIMARY KEY,
     payload TEXT NOT NULL,
     last_used INTEGER NOT NULL,
     ttl INTEGER NOT NULL,
-    size_bytes INTEGER NOT NULL
+    size_bytes INTEGER NOT NULL,
+    codec INTEGER NOT NULL DEFAULT 0,
+    ns TEXT,
+    prio INTEGER NOT NULL DEFAULT 1
 )"""
 )
+_columns = {row[1] for row in _con.execute("PRAGMA table_info(cache)")}
+# Databases created before compression lack the codec column; their rows are raw
+if "codec" not in _columns:
+    _con.execute("ALTER TABLE cache ADD COLUMN codec INTEGER NOT NULL DEFAULT 0")
+# ... and before namespaces the ns/prio columns, backfilled from the keys below
+if "ns" not in _columns:
+    _con.execute("ALTER TABLE cache ADD COLUMN ns TEXT")
+    _con.execute("ALTER TABLE cache ADD COLUMN prio INTEGER NOT NULL DEFAULT 1")
+_con.executemany(
+    "UPDATE cache SET ns=?, prio=? WHERE key=?",
+    [
+        (_namespace(k), _policy(_namespace(k)).priority, k)
+        for (k,) in _con.execute("SELECT key FROM cache WHERE ns IS NULL").fetchall()
+    ],
+)
+_con.execute("CREATE INDEX IF NOT EXISTS cache_prio_last_used ON cache(prio, last_used)")
+_con.execute("CREATE INDEX IF NOT EXISTS cache_ns_last_used ON cache(ns, last_used)")
+_con.execute("DROP INDEX IF EXISTS cache_last_used")
+_con.execute(
+    "CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+)
+# Running totals of size_bytes ('size_bytes' and 'size_bytes:<ns>'), seeded
+# once from the table for older databases
+_con.execute(
+    "INSERT OR IGNORE INTO cache_meta(name,value) SELECT 'size_bytes', COALESCE(SUM(size_bytes),0) FROM cache"
+)
+_con.execute(
+    "INSERT OR IGNORE INTO cache_meta(name,value) SELECT 'size_bytes:'||ns, SUM(size_bytes) FROM cache GROUP BY ns"
+)
 _con.commit()
 
+Payload = Union[str, bytes]
 
-def _cache_get(k: str) -> Optional[Any]:
-    """Return cached object for *k* if it has not expired."""
-    row = _con.execute(
-        "SELECT payload,last_used,ttl FROM cache WHERE key=?", (k,)
-    ).fetchone()
+# Values of the codec column
+_RAW, _ZLIB, _ZSTD = 0, 1, 2
+
+
+def _compress(data: Payload) -> Tuple[Payload, int]:
+    """Compress payloads of at least ``CACHE_COMPRESS_MIN`` bytes when it pays off.
+
+    zstd when ``zstandard`` is installed, zlib otherwise; the returned codec goes
+    to the ``codec`` column, so raw rows from older versions stay readable.
+    """
+    if not CACHE_COMPRESS_MIN or len(data) < CACHE_COMPRESS_MIN:
+        return data, _RAW
+    raw = data.encode("utf-8") if isinstance(data, str) else data
+    if HAS_ZSTD:
+        packed, codec = zstandard.ZstdCompressor(level=3).compress(raw), _ZSTD
+    else:
+        packed, codec = zlib.compress(raw, 6), _ZLIB
+    if len(packed) >= len(raw):
+        return data, _RAW
+    return packed, codec
+
+
+def _decompress(payload: Payload, codec: int) -> Payload:
+    if codec == _ZLIB:
+        return zlib.decompress(payload)
+    if codec == _ZSTD:
+        if not HAS_ZSTD:
+            raise ValueError("zstd payload found but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return payload
+
+
+class _MemoryLRU:
+    """In-process LRU of encoded payloads with TTL awareness.
+
+    Holding encoded payloads keeps the byte accounting exact and hands every
+    caller its own decoded copy.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max(0, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._d: "OrderedDict[str, Tuple[Payload, int, int]]" = OrderedDict()
+
+    def get(self, k: str, now: int) -> Optional[Payload]:
+        hit = self.lookup(k, now)
+        return hit[0] if hit else None
+
+    def lookup(self, k: str, now: int, stale: int = 0) -> Optional[Tuple[Payload, bool]]:
+        """``(payload, fresh)``; expired entries are kept for *stale* more seconds."""
+        item = self._d.get(k)
+        if item is None:
+            self.misses += 1
+            return None
+        payload, last_used, ttl = item
+        if ttl and last_used + ttl < now:
+            if last_used + ttl + stale < now:
+                self.pop(k)
+                self.misses += 1
+                return None
+            # Stale reads do not slide the expiry, or the entry would look fresh again
+            self.hits += 1
+            return payload, False
+        # Same sliding expiry as the SQLite rows
+        self._d[k] = (payload, now, ttl)
+        self._d.move_to_end(k)
+        self.hits += 1
+        return payload, True
+
+    def put(self, k: str, payload: Payload, now: int, ttl: int) -> None:
+        self.pop(k)
+        size = len(payload)
+        if not self.max_entries or size > self.max_bytes:
+            return
+        self._d[k] = (payload, now, int(ttl))
+        self.bytes += size
+        while len(self._d) > self.max_entries or self.bytes > self.max_bytes:
+            _, (old, _, _) = self._d.popitem(last=False)
+            self.bytes -= len(old)
+
+    def pop(self, k: str) -> None:
+        item = self._d.pop(k, None)
+        if item is not None:
+            self.bytes -= len(item[0])
+
+    def __len__(self) -> int:
+        return len(self._d)
+
+
+_mem = _MemoryLRU(CACHE_MEM_ENTRIES, CACHE_MEM_MB * 1024 * 1024)
+# Guards _mem and _touched; held only for dictionary operations so the
+# event loop never waits on a disk write to read the in-process tier.
+_mem_lock = threading.Lock()
+# Serializes every use of the SQLite connection.
+_db_lock = threading.RLock()
+# Single writer thread: the async API queues its SQLite work here.
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-writer")
+
+# key -> last read time not yet written to SQLite
+_touched: Dict[str, int] = {}
+# key -> background refresh of a stale entry, so each key is refreshed once
+_refreshing: Dict[str, "asyncio.Task[None]"] = {}
+_touch_flushed_at = time.monotonic()
+
+
+class _NamespaceStats:
+    """Counters and histograms of one key namespace since start."""
+
+    EVENTS = ("hits", "misses", "stale", "expirations", "evictions")
+
+    def __init__(self) -> None:
+        self.events: Dict[str, int] = dict.fromkeys(self.EVENTS, 0)
+        self.bytes_written = 0
+        self.hit_ms = Histogram(LATENCY_BUCKETS_MS)  # lookup time of hits
+        self.fill_ms = Histogram(LATENCY_BUCKETS_MS)  # miss -> put: what a hit saves
+        self.sizes = Histogram(SIZE_BUCKETS)  # stored payload bytes
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.events["hits"] + self.events["stale"] + self.events["misses"]
+        served = self.events["hits"] + self.events["stale"]
+        return {
+            **self.events,
+            "hit_ratio": round(served / lookups, 4) if lookups else None,
+            "bytes_written": self.bytes_written,
+            "saved_ms": round(served * self.fill_ms.mean, 1),
+            "hit_ms": self.hit_ms.snapshot(),
+            "fill_ms": self.fill_ms.snapshot(),
+            "sizes": self.sizes.snapshot(),
+        }
+
+
+# namespace -> stats (guarded by _mem_lock)
+_ns_stats: Dict[str, _NamespaceStats] = defaultdict(_NamespaceStats)
+# key -> perf_counter() of its last miss, to time the fill that follows
+_missed_at: "OrderedDict[str, float]" = OrderedDict()
+_MISSED_MAX = 10_000
+
+
+def _mem_get(k: str, now: int, stale: int = 0) -> Optional[Tuple[Payload, bool]]:
+    with _mem_lock:
+        return _mem.lookup(k, now, stale)
+
+
+def _record_get(k: str, event: str, started: float) -> None:
+    """Count a lookup; hits feed the latency histogram, misses start the fill timer."""
+    with _mem_lock:
+        st = _ns_stats[_namespace(k)]
+        st.events[event] += 1
+        if event == "misses":
+            _missed_at[k] = started
+            _missed_at.move_to_end(k)
+            if len(_missed_at) > _MISSED_MAX:
+                _missed_at.popitem(last=False)
+        else:
+            st.hit_ms.observe((time.perf_counter() - started) * 1000)
+
+
+def _record_put(k: str, size: int) -> None:
+    with _mem_lock:
+        st = _ns_stats[_namespace(k)]
+        st.bytes_written += size
+        st.sizes.observe(size)
+        missed = _missed_at.pop(k, None)
+        if missed is not None:
+            st.fill_ms.observe((time.perf_counter() - missed) * 1000)
+
+
+def _touch(k: str, now: int) -> None:
+    """Buffer a ``last_used`` update; reads never write to SQLite themselves.
+
+    The buffer is flushed every ``CACHE_TOUCH_FLUSH_S`` seconds or once
+    ``CACHE_TOUCH_BATCH`` keys are pending.
+    """
+    with _mem_lock:
+        _touched[k] = now
+        due = len(_touched) >= CACHE_TOUCH_BATCH or time.monotonic() - _touch_flushed_at >= CACHE_TOUCH_FLUSH_S
+    if due:
+        _writer.submit(cache_flush)
+
+
+def cache_flush() -> None:
+    """Write buffered ``last_used`` timestamps in a single transaction."""
+    global _touched, _touch_flushed_at
+    with _mem_lock:
+        _touch_flushed_at = time.monotonic()
+        if not _touched:
+            return
+        batch, _touched = _touched, {}
+    with _db_lock, _con:
+        _con.executemany(
+            "UPDATE cache SET last_used=MAX(last_used,?) WHERE key=?",
+            [(ts, k) for k, ts in batch.items()],
+        )
+
+
+atexit.register(cache_flush)
+
+
+def _db_get(k: str, now: int, stale: int = 0) -> Optional[Tuple[Payload, bool]]:
+    """SQLite tier lookup; fills the in-process tier on a hit.
+
+    Expired rows are left for eviction rather than deleted here, which lets
+    :func:`_cache_get_swr_async` serve them while a refresh runs.
+    """
+    with _db_lock:
+        row = _con.execute(
+            "SELECT payload,last_used,ttl,codec FROM cache WHERE key=?", (k,)
+        ).fetchone()
     if not row:
         return None
-    payload, last_used, ttl = row
-    now = int(time.time())
-    if ttl and last_used + ttl < now:
-        _con.execute("DELETE FROM cache WHERE key=?", (k,))
-        _con.commit()
+    payload, last_used, ttl, codec = row
+    try:
+        payload = _decompress(payload, codec)
+    except Exception as e:
+        logger.warning("cache entry %s cannot be decompressed: %s", k, e)
         return None
-    _con.execute("UPDATE cache SET last_used=? WHERE key=?", (now, k))
-    _con.commit()
+    with _mem_lock:
+        last_used = max(last_used, _touched.get(k, 0))
+        fresh = not ttl or last_used + ttl >= now
+        if not fresh and last_used + ttl + stale < now:
+            _ns_stats[_namespace(k)].events["expirations"] += 1
+            return None
+        _mem.put(k, payload, now if fresh else last_used, ttl)
+    return payload, fresh
+
+
+def _decode(payload: Payload) -> Optional[Any]:
+    """:mod:`utils.serializer` payload (or legacy JSON text) -> object; ``None`` if unreadable."""
     try:
-        return json.loads(payload)
+        return loads(payload)
     except Exception:
         return None
 
 
-def _cache_put(k: str, obj: Any, ttl: int = 0, limit_mb: int = 50) -> None:
-    """Store *obj* in the cache under *k* for *ttl* seconds."""
-    data = json.dumps(obj, ensure_ascii=False)
+def _cache_get(k: str) -> Optional[Any]:
+    """Return cached object for *k* if it has not expired."""
+    started = time.perf_counter()
+    now = int(time.time())
+    hit = _mem_get(k, now) or _db_get(k, now)
+    if hit is None:
+        _record_get(k, "misses", started)
+        return None
+    _record_get(k, "hits", started)
+    _touch(k, now)
+    return _decode(hit[0])
+
+
+async def _cache_get_async(k: str) -> Optional[Any]:
+    """Non-blocking :func:`_cache_get`: SQLite reads run on the writer thread."""
+    started = time.perf_counter()
     now = int(time.time())
+    hit = _mem_get(k, now)
+    if hit is None:
+        hit = await asyncio.get_running_loop().run_in_executor(_writer, _db_get, k, now)
+        if hit is None:
+            _record_get(k, "misses", started)
+            return None
+    _record_get(k, "hits", started)
+    _touch(k, now)
+    return _decode(hit[0])
+
+
+async def _cache_get_swr_async(
+    k: str,
+    refresh: Callable[[], Awaitable[Any]],
+    ttl: Optional[int] = None,
+    limit_mb: int = 50,
+) -> Optional[Any]:
+    """Stale-while-revalidate variant of :func:`_cache_get_async`.
+
+    An entry up to ``CACHE_STALE_S`` seconds past its TTL is returned as is,
+    and ``refresh()`` is started in the background to replace it; its
+    non-empty result is stored under *k* with *ttl*. At most one refresh
+    runs per key.
+    """
+    started = time.perf_counter()
+    now = int(time.time())
+    hit = _mem_get(k, now, CACHE_STALE_S)
+    if hit is None:
+        hit = await asyncio.get_running_loop().run_in_executor(
+            _writer, _db_get, k, now, CACHE_STALE_S
+        )
+        if hit is None:
+            _record_get(k, "misses", started)
+            return None
+    payload, fresh = hit
+    _record_get(k, "hits" if fresh else "stale", started)
+    if fresh:
+        _touch(k, now)
+    elif k not in _refreshing:
+        _refreshing[k] = asyncio.create_task(_revalidate(k, refresh, ttl, limit_mb))
+    return _decode(payload)
+
+
+async def _revalidate(
+    k: str, refresh: Callable[[], Awaitable[Any]], ttl: Optional[int], limit_mb: int
+) -> None:
+    try:
+        obj = await refresh()
+        if obj:
+            await _cache_put_async(k, obj, ttl=ttl, limit_mb=limit_mb)
+    except Exception as e:
+        # keep serving the stale copy; the next read past the TTL retries
+        logger.warning("cache refresh failed for %s: %s", k, e)
+    finally:
+        _refreshing.pop(k, None)
+
+
+def _meta(name: str) -> int:
+    with _db_lock:
+        row = _con.execute("SELECT value FROM cache_meta WHERE name=?", (name,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def _cache_size(ns: Optional[str] = None) -> int:
+    return _meta("size_bytes" if ns is None else f"size_bytes:{ns}")
+
+
+def _add_size(deltas: Dict[str, int]) -> None:
+    """Apply per-namespace size changes to the running totals (inside a transaction)."""
     _con.execute(
-        "INSERT OR REPLACE INTO cache(key,payload,last_used,ttl,size_bytes) VALUES (?,?,?,?,?)",
-        (k, data, now, int(ttl), len(data)),
+        "UPDATE cache_meta SET value=value+? WHERE name='size_bytes'", (sum(deltas.values()),)
     )
-    _con.commit()
+    _con.executemany(
+        "INSERT INTO cache_meta(name,value) VALUES (?,?) "
+        "ON CONFLICT(name) DO UPDATE SET value=value+excluded.value",
+        [(f"size_bytes:{ns}", d) for ns, d in deltas.items() if d],
+    )
+
 
-    # Prune old items if the database grows too large
-    total = _con.execute("SELECT COALESCE(SUM(size_bytes),0) FROM cache").fetchone()[0] or 0
+def _evict(excess: int, keep: str, ns: Optional[str] = None) -> None:
+    """Delete just enough rows to free *excess* bytes.
+
+    Without *ns* the walk goes by eviction priority, then least recently
+    used; with *ns* it stays inside that namespace. Either way it follows an
+    index only as far as needed, so the cost depends on the number of rows
+    evicted rather than on the table size. Must run inside the caller's
+    transaction.
+    """
+    if ns is None:
+        rows = _con.execute("SELECT key,size_bytes,ns FROM cache ORDER BY prio ASC, last_used ASC")
+    else:
+        rows = _con.execute(
+            "SELECT key,size_bytes,ns FROM cache WHERE ns=? ORDER BY last_used ASC", (ns,)
+        )
+    victims, freed = [], 0
+    deltas: Dict[str, int] = defaultdict(int)
+    evicted: Dict[str, int] = defaultdict(int)
+    for key, size, row_ns in rows:
+        if freed >= excess:
+            break
+        if key != keep:
+            victims.append((key,))
+            freed += size
+            deltas[row_ns] -= size
+            evicted[row_ns] += 1
+    _con.executemany("DELETE FROM cache WHERE key=?", victims)
+    _add_size(deltas)
+    with _mem_lock:
+        for (key,) in victims:
+            _mem.pop(key)
+            _touched.pop(key, None)
+        for row_ns, n in evicted.items():
+            _ns_stats[row_ns].events["evictions"] += n
+
+
+def _store(k: str, data: Payload, ttl: Optional[int], limit_mb: int) -> None:
+    now = int(time.time())
     limit = limit_mb * 1024 * 1024
-    while total > limit:
+    ns = _namespace(k)
+    policy = _policy(ns)
+    if ttl is None:
+        ttl = policy.ttl
+    # size_bytes counts what is on disk, so compressed rows stretch limit_mb
+    stored, codec = _compress(data)
+    with _db_lock, _con:
+        old = _con.execute("SELECT size_bytes FROM cache WHERE key=?", (k,)).fetchone()
+        _con.execute(
+            "INSERT OR REPLACE INTO cache(key,payload,last_used,ttl,size_bytes,codec,ns,prio) "
+            "VALUES (?,?,?,?,?,?,?,?)",
+            (k, stored, now, int(ttl), len(stored), codec, ns, policy.priority),
+        )
+        _add_size({ns: len(stored) - (old[0] if old else 0)})
+        # Keep the namespace within its quota, then the whole table within limit_mb
+        if policy.quota_mb:
+            quota = int(policy.quota_mb * 1024 * 1024)
+            used = _con.execute(
+                "SELECT value FROM cache_meta WHERE name=?", (f"size_bytes:{ns}",)
+            ).fetchone()[0]
+            if used > quota:
+                _evict(used - quota, keep=k, ns=ns)
+        total = _con.execute("SELECT value FROM cache_meta WHERE name='size_bytes'").fetchone()[0]
+        if total > limit:
+            _evict(total - limit, keep=k)
+    with _mem_lock:
+        _mem.put(k, data, now, ttl)
+        _touched.pop(k, None)
+
+
+def _cache_put(k: str, obj: Any, ttl: Optional[int] = None, limit_mb: int = 50) -> None:
+    """Store *obj* in the cache under *k* for *ttl* seconds (namespace default if omitted)."""
+    data = dumps(obj)
+    _record_put(k, len(data))
+    _store(k, data, ttl, limit_mb)
+
+
+async def _cache_put_async(k: str, obj: Any, ttl: Optional[int] = None, limit_mb: int = 50) -> None:
+    """Non-blocking :func:`_cache_put`.
+
+    *obj* is encoded on the calling thread, so later mutations by the caller
+    cannot race with the write queued on the writer thread.
+    """
+    data = dumps(obj)
+    _record_put(k, len(data))
+    await asyncio.get_running_loop().run_in_executor(_writer, _store, k, data, ttl, limit_mb)
+
+
+def _neg_key(provider: str, query: str) -> str:
+    """Key remembering a provider miss, kept for the provider's ``NEG_CACHE_TTL``."""
+    return f"neg:{provider}:{CACHE_SCHEMA}:{_norm_text(_strip_portion(query))}"
+
+
+def _neg_ttl(provider: str) -> int:
+    # "off.legacy" and friends share the TTL of their base provider
+    return NEG_CACHE_TTL.get(provider.split(".", 1)[0], 6 * 60 * 60)
+
+
+# Cache TTLs slide on every read, so the skip check itself would keep a miss
+# alive forever; the entry carries its own absolute deadline instead.
+async def _neg_cached_async(provider: str, query: str) -> bool:
+    """True if *provider* returned nothing for *query* recently."""
+    until = await _cache_get_async(_neg_key(provider, query))
+    return isinstance(until, (int, float)) and until > time.time()
+
+
+async def _neg_store_async(provider: str, query: str) -> None:
+    """Remember that *provider* had no result for *query*."""
+    ttl = _neg_ttl(provider)
+    await _cache_put_async(_neg_key(provider, query), int(time.time()) + ttl, ttl=ttl)
+
+
+# Snapshot file: gzip stream of a magic line followed by length-prefixed rows
+# (key, last_used, ttl, codec, is_text, payload). Payloads are copied as
+# stored, so compressed rows are not re-encoded.
+_SNAPSHOT_MAGIC = b"HLCACHE1\n"
+_SNAPSHOT_ROW = struct.Struct("<HqIBBI")
+
+
+def cache_export(path: str, top: int = 5000) -> int:
+    """Write the *top* most recently used live entries to *path*; returns the row count."""
+    cache_flush()
+    now = int(time.time())
+    with _db_lock:
+        rows = _con.execute(
+            "SELECT key,last_used,ttl,codec,payload FROM cache "
+            "WHERE ttl=0 OR last_used+ttl>=? ORDER BY last_used DESC LIMIT ?",
+            (now, int(top)),
+        ).fetchall()
+    tmp = f"{path}.tmp"
+    with gzip.open(tmp, "wb") as f:
+        f.write(_SNAPSHOT_MAGIC)
+        for key, last_used, ttl, codec, payload in rows:
+            kb = key.encode("utf-8")
+            is_text = isinstance(payload, str)
+            data = payload.encode("utf-8") if is_text else bytes(payload)
+            f.write(_SNAPSHOT_ROW.pack(len(kb), last_used, ttl, codec, is_text, len(data)))
+            f.write(kb)
+            f.write(data)
+    os.replace(tmp, path)
+    return len(rows)
+
+
+def cache_import(path: str) -> int:
+    """Bulk-load a snapshot written by :func:`cache_export`.
+
+    Keys already present locally are kept; returns the number of rows added.
+    """
+    rows = []
+    with gzip.open(path, "rb") as f:
+        if f.read(len(_SNAPSHOT_MAGIC)) != _SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a cache snapshot")
+        while True:
+            head = f.read(_SNAPSHOT_ROW.size)
+            if len(head) < _SNAPSHOT_ROW.size:
+                break
+            klen, last_used, ttl, codec, is_text, plen = _SNAPSHOT_ROW.unpack(head)
+            key = f.read(klen).decode("utf-8")
+            data = f.read(plen)
+            if len(data) < plen:
+                break  # truncated upload: keep what was complete
+            payload = data.decode("utf-8") if is_text else data
+            ns = _namespace(key)
+            rows.append((key, payload, last_used, ttl, len(data), codec, ns, _policy(ns).priority))
+    with _db_lock, _con:
+        before = _con.total_changes
+        _con.executemany(
+            "INSERT OR IGNORE INTO cache(key,payload,last_used,ttl,size_bytes,codec,ns,prio) "
+            "VALUES (?,?,?,?,?,?,?,?)",
+            rows,
+        )
+        added = _con.total_changes - before
+        _con.execute("DELETE FROM cache_meta WHERE name LIKE 'size_bytes%'")
+        _con.execute(
+            "INSERT INTO cache_meta(name,value) SELECT 'size_bytes', COALESCE(SUM(size_bytes),0) FROM cache"
+        )
         _con.execute(
-            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_used ASC LIMIT 50)"
+            "INSERT INTO cache_meta(name,value) SELECT 'size_bytes:'||ns, SUM(size_bytes) FROM cache GROUP BY ns"
         )
-        _con.commit()
-        total = _con.execute("SELECT COALESCE(SUM(size_bytes),0) FROM cache").fetchone()[0] or 0
+    return added
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Counters of the in-process tier and per-namespace usage.
+
+    Per namespace: hit/miss/stale/expiration/eviction counts, bytes written and
+    histograms of hit latency, fill latency (miss to put) and payload size.
+    """
+    with _mem_lock:
+        stats = {
+            "mem_entries": len(_mem),
+            "mem_bytes": _mem.bytes,
+            "mem_hits": _mem.hits,
+            "mem_misses": _mem.misses,
+            "pending_touches": len(_touched),
+        }
+        counters = {ns: st.snapshot() for ns, st in _ns_stats.items()}
+    stats["db_bytes"] = _cache_size()
+    with _db_lock:
+        entries = dict(_con.execute("SELECT ns, COUNT(*) FROM cache GROUP BY ns").fetchall())
+        sizes = {
+            name.split(":", 1)[1]: value
+            for name, value in _con.execute(
+                "SELECT name, value FROM cache_meta WHERE name LIKE 'size_bytes:%'"
+            )
+        }
+    namespaces: Dict[str, Dict[str, Any]] = {}
+    for ns in set(entries) | set(sizes) | set(counters):
+        policy = _policy(ns)
+        namespaces[ns] = {
+            "entries": entries.get(ns, 0),
+            "bytes": sizes.get(ns, 0),
+            "quota_bytes": int(policy.quota_mb * 1024 * 1024),
+            "priority": policy.priority,
+            **(counters.get(ns) or _NamespaceStats().snapshot()),
+        }
+    stats["namespaces"] = namespaces
+    return stats
 
 
-__all__ = ["_cache_get", "_cache_put", "CACHE_SCHEMA"]
+__all__ = [
+    "_cache_get",
+    "_cache_put",
+    "_cache_get_async",
+    "_cache_put_async",
+    "_cache_get_swr_async",
+    "_neg_cached_async",
+    "_neg_store_async",
+    "NamespacePolicy",
+    "NAMESPACE_POLICIES",
+    "cache_flush",
+    "cache_export",
+    "cache_import",
+    "cache_stats",
+    "CACHE_SCHEMA",
+]
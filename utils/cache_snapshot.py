@@ -0,0 +1,38 @@
+"""Command line entry point for cache snapshots.
+
+    python -m utils.cache_snapshot export snapshot.bin --top 5000
+    python -m utils.cache_snapshot import snapshot.bin
+
+Run it from the bot's working directory: the cache lives in
+``./data/cache.db`` relative to it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import List, Optional
+
+from .cache import cache_export, cache_import
+from .consts import CACHE_SNAPSHOT_TOP
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m utils.cache_snapshot")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    exp = sub.add_parser("export", help="write the hottest entries to a snapshot")
+    exp.add_argument("path")
+    exp.add_argument("--top", type=int, default=CACHE_SNAPSHOT_TOP)
+    imp = sub.add_parser("import", help="bulk-load a snapshot into the cache")
+    imp.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "export":
+        print(f"exported {cache_export(args.path, args.top)} entries to {args.path}")
+    else:
+        print(f"imported {cache_import(args.path)} entries from {args.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
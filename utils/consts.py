@@ -10,16 +10,69 @@ CACHE_DAYS: int = int(os.getenv("CACHE_DAYS", "30"))
 # Default TTL for cached search results in seconds
 SEARCH_CACHE_TTL: int = int(os.getenv("SEARCH_CACHE_TTL", str(CACHE_DAYS * 24 * 60 * 60)))
 CACHE_SCHEMA: str = os.getenv("CACHE_SCHEMA", "r1")
+# In-process LRU in front of the SQLite cache
+CACHE_MEM_ENTRIES: int = int(os.getenv("CACHE_MEM_ENTRIES", "2000"))
+CACHE_MEM_MB: int = int(os.getenv("CACHE_MEM_MB", "16"))
+# Cache payloads of at least this many bytes are stored compressed (0 disables)
+CACHE_COMPRESS_MIN: int = int(os.getenv("CACHE_COMPRESS_MIN", "512"))
+# Per-namespace overrides, JSON: {"search": {"quota_mb": 30, "ttl": 86400, "priority": 0}}
+CACHE_NS_POLICY: str = os.getenv("CACHE_NS_POLICY", "")
+# Expired entries are still served (and refreshed in the background) this long
+CACHE_STALE_S: int = int(os.getenv("CACHE_STALE_S", str(7 * 24 * 60 * 60)))
+# Buffered last_used updates: flush every N seconds or once M keys are pending
+CACHE_TOUCH_FLUSH_S: float = float(os.getenv("CACHE_TOUCH_FLUSH_S", "30"))
+CACHE_TOUCH_BATCH: int = int(os.getenv("CACHE_TOUCH_BATCH", "500"))
+# Negative cache: how long a provider miss for a query is remembered, in seconds
+NEG_CACHE_TTL: dict[str, int] = {
+    "fatsecret": int(os.getenv("NEG_TTL_FATSECRET", str(6 * 60 * 60))),
+    "usda": int(os.getenv("NEG_TTL_USDA", str(24 * 60 * 60))),
+    "off": int(os.getenv("NEG_TTL_OFF", str(12 * 60 * 60))),
+    "avru": int(os.getenv("NEG_TTL_AVRU", str(6 * 60 * 60))),
+    "google": int(os.getenv("NEG_TTL_GOOGLE", str(6 * 60 * 60))),
+}
+# Cache snapshot loaded at startup and written by /cache_snapshot ("" disables)
+CACHE_SNAPSHOT_PATH: str = os.getenv("CACHE_SNAPSHOT_PATH", "")
+CACHE_SNAPSHOT_TOP: int = int(os.getenv("CACHE_SNAPSHOT_TOP", "5000"))
+CACHE_STATS_TOKEN: str = os.getenv("CACHE_STATS_TOKEN", "")
+# Codec for DB values and cache payloads: auto, json, orjson or msgpack
+SERIALIZER: str = os.getenv("HLITE_SERIALIZER", "auto").lower()
 
 # Database
 DB_PATH: str = os.getenv("HLITE_DB_PATH", "db.json")
+# "json" (LocalDB) or "sqlite"; a sqlite:/// HLITE_DB_PATH selects SQLite too
+DB_BACKEND: str = os.getenv("HLITE_DB_BACKEND", "json").lower()
 DB_SCHEMA: str = os.getenv("DB_SCHEMA", "r1")
 EAT_NOW_DB: str = os.getenv("EAT_NOW_DB", "eat_now.json")
+# Append-only journal instead of rewriting the whole snapshot on every write
+DB_JOURNAL: bool = os.getenv("HLITE_DB_JOURNAL", "0") == "1"
+# Compact the journal after this many records or seconds, whichever comes first
+DB_COMPACT_EVERY: int = int(os.getenv("HLITE_DB_COMPACT_EVERY", "1000"))
+DB_COMPACT_INTERVAL: float = float(os.getenv("HLITE_DB_COMPACT_INTERVAL", "300"))
+# Write-behind: flush dirty keys after this many ms or pending keys (0 ms = write-through)
+DB_FLUSH_MS: int = int(os.getenv("HLITE_DB_FLUSH_MS", "250"))
+DB_FLUSH_BATCH: int = int(os.getenv("HLITE_DB_FLUSH_BATCH", "100"))
+# Decoded values kept in memory for backends that page from disk (SQLite)
+DB_CACHE_SIZE: int = int(os.getenv("HLITE_DB_CACHE_SIZE", "1000"))
 
 # Google Custom Search configuration
 GOOGLE_CSE_KEY: str = get_secret("GOOGLE_CSE_KEY", "")
 GOOGLE_CSE_ID: str = get_secret("GOOGLE_CSE_ID", "")
 
+# FatSecret REST API
+FATSECRET_KEY: str = get_secret("FATSECRET_KEY", "")
+FATSECRET_SECRET: str = get_secret("FATSECRET_SECRET", "")
+
+# Shared HTTP client for providers: pool size, concurrent requests per host, default timeout (s)
+HTTP_MAX_CONNECTIONS: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_PER_HOST: int = int(os.getenv("HTTP_PER_HOST", "10"))
+HTTP_TIMEOUT: float = float(os.getenv("HTTP_TIMEOUT", "20"))
+# Per-host token buckets, JSON overrides: {"api.nal.usda.gov": {"rate": 0.5, "burst": 10}}
+HTTP_RATE_LIMITS: str = os.getenv("HTTP_RATE_LIMITS", "")
+# Circuit breaker per host: open after N consecutive failures, probe again after a cooldown (s)
+HTTP_BREAKER_FAILURES: int = int(os.getenv("HTTP_BREAKER_FAILURES", "5"))
+HTTP_BREAKER_COOLDOWN_S: float = float(os.getenv("HTTP_BREAKER_COOLDOWN_S", "30"))
+HTTP_BREAKER_PROBES: int = int(os.getenv("HTTP_BREAKER_PROBES", "1"))
+
 # Miscellaneous
 MAX_QUERY_LEN: int = int(os.getenv("MAX_QUERY_LEN", "80"))
 ML_LIMIT: int = int(os.getenv("ML_LIMIT", "10"))
@@ -29,11 +82,39 @@ __all__ = [
     "CACHE_DAYS",
     "SEARCH_CACHE_TTL",
     "CACHE_SCHEMA",
+    "CACHE_MEM_ENTRIES",
+    "CACHE_MEM_MB",
+    "CACHE_COMPRESS_MIN",
+    "CACHE_NS_POLICY",
+    "CACHE_STALE_S",
+    "CACHE_TOUCH_FLUSH_S",
+    "CACHE_TOUCH_BATCH",
+    "NEG_CACHE_TTL",
+    "CACHE_SNAPSHOT_PATH",
+    "CACHE_SNAPSHOT_TOP",
+    "CACHE_STATS_TOKEN",
+    "SERIALIZER",
     "DB_PATH",
+    "DB_BACKEND",
     "DB_SCHEMA",
     "EAT_NOW_DB",
+    "DB_JOURNAL",
+    "DB_COMPACT_EVERY",
+    "DB_COMPACT_INTERVAL",
+    "DB_FLUSH_MS",
+    "DB_FLUSH_BATCH",
+    "DB_CACHE_SIZE",
     "GOOGLE_CSE_KEY",
     "GOOGLE_CSE_ID",
+    "FATSECRET_KEY",
+    "FATSECRET_SECRET",
+    "HTTP_MAX_CONNECTIONS",
+    "HTTP_PER_HOST",
+    "HTTP_TIMEOUT",
+    "HTTP_RATE_LIMITS",
+    "HTTP_BREAKER_FAILURES",
+    "HTTP_BREAKER_COOLDOWN_S",
+    "HTTP_BREAKER_PROBES",
     "MAX_QUERY_LEN",
     "ML_LIMIT",
     "USER_AGENT",
@@ -3,54 +3,478 @@ are unavailable."""
 
 from __future__ import annotations
 
+import asyncio
+import atexit
 import json
 import os
-from typing import Any, List
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Tuple
 
-from .consts import DB_PATH
+from .consts import (
+    DB_BACKEND,
+    DB_CACHE_SIZE,
+    DB_COMPACT_EVERY,
+    DB_COMPACT_INTERVAL,
+    DB_FLUSH_BATCH,
+    DB_FLUSH_MS,
+    DB_JOURNAL,
+    DB_PATH,
+)
+from .logging import logger
+from .serializer import dumps, dumps_json, loads
 
 
 class LocalDB:
-    """Very small JSON backed key/value store."""
+    """Very small JSON backed key/value store.
 
-    def __init__(self, path: str = DB_PATH):
+    Snapshots and journal records are compact JSON (orjson-accelerated when
+    installed) so the file stays line-oriented and human readable.
+
+    In journaled mode every write appends one compact ``{"k": ..., "v": ...}``
+    line to ``<path>.journal`` instead of rewriting the whole snapshot. The
+    snapshot is rebuilt in a background thread from the previous snapshot and
+    the rotated journal, so compaction never touches the live objects that
+    handlers may be mutating.
+
+    The file is read on first access rather than at construction, so merely
+    importing the module does not parse the whole store.
+    """
+
+    # The whole store lives in ``self.store``; a cache in front adds nothing.
+    in_memory = True
+
+    def __init__(
+        self,
+        path: str = DB_PATH,
+        journal: bool = DB_JOURNAL,
+        compact_every: int = DB_COMPACT_EVERY,
+        compact_interval: float = DB_COMPACT_INTERVAL,
+    ):
         self.path = path
+        self.journal = journal
+        self.journal_path = f"{path}.journal"
+        self.compact_every = max(1, int(compact_every))
+        self.compact_interval = float(compact_interval)
+        self._lock = threading.Lock()
+        self._jf = None
+        self._journal_records = 0
+        self._last_compact = time.monotonic()
+        self._compactor: threading.Thread | None = None
+        self._store: Dict[str, Any] | None = None
         if not os.path.exists(self.path):
             with open(self.path, "w", encoding="utf-8") as f:
                 json.dump({}, f, ensure_ascii=False, indent=2)
-        self._load()
+
+    @property
+    def store(self) -> Dict[str, Any]:
+        if self._store is None:
+            self._load()
+        return self._store
 
     def _load(self) -> None:
         try:
             with open(self.path, "r", encoding="utf-8") as f:
-                self.store = json.load(f)
+                store = loads(f.read())
         except Exception:
-            self.store = {}
+            store = {}
+        if self.journal:
+            # A leftover ``.1`` means the previous compaction did not finish.
+            for jp in (self._rotated_path(), self.journal_path):
+                self._journal_records += self._replay(jp, store)
+        self._store = store
 
     def _save(self) -> None:
         with open(self.path, "w", encoding="utf-8") as f:
-            json.dump(self.store, f, ensure_ascii=False, indent=2)
+            f.write(dumps_json(self.store))
+
+    # Journal ---------------------------------------------------------------
+    def _rotated_path(self) -> str:
+        return f"{self.journal_path}.1"
+
+    @staticmethod
+    def _replay(path: str, store: dict) -> int:
+        """Apply journal records from *path* to *store*, return their count."""
+        if not os.path.exists(path):
+            return 0
+        n = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = loads(line)
+                except ValueError:
+                    # Torn tail after a crash: everything before it is valid.
+                    logger.warning("LocalDB: skipping corrupt journal record in %s", path)
+                    continue
+                store[rec["k"]] = rec["v"]
+                n += 1
+        return n
+
+    def _append(self, items: Dict[str, Any]) -> None:
+        lines = "".join(
+            dumps_json({"k": k, "v": v}) + "\n"
+            for k, v in items.items()
+        )
+        with self._lock:
+            if self._jf is None:
+                self._jf = open(self.journal_path, "a", encoding="utf-8")
+            self._jf.write(lines)
+            self._jf.flush()
+            self._journal_records += len(items)
+        self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        due = self._journal_records >= self.compact_every or (
+            self._journal_records
+            and time.monotonic() - self._last_compact >= self.compact_interval
+        )
+        if not due or (self._compactor and self._compactor.is_alive()):
+            return
+        self._compactor = threading.Thread(target=self.compact, name="localdb-compact", daemon=True)
+        self._compactor.start()
+
+    def compact(self) -> None:
+        """Fold the journal into a fresh snapshot file."""
+        rotated = self._rotated_path()
+        with self._lock:
+            if self._jf is not None:
+                self._jf.close()
+                self._jf = None
+            if os.path.exists(self.journal_path):
+                if os.path.exists(rotated):
+                    # Merge into the unfinished rotation instead of losing it.
+                    with open(rotated, "a", encoding="utf-8") as dst, open(
+                        self.journal_path, "r", encoding="utf-8"
+                    ) as src:
+                        dst.write(src.read())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, rotated)
+            self._journal_records = 0
+            self._last_compact = time.monotonic()
+        if not os.path.exists(rotated):
+            return
+        try:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    snapshot = loads(f.read())
+            except Exception:
+                snapshot = {}
+            self._replay(rotated, snapshot)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(dumps_json(snapshot))
+            os.replace(tmp, self.path)
+            os.remove(rotated)
+        except Exception as e:
+            logger.error("LocalDB compaction failed: %s", e)
 
     # Mapping style helpers -------------------------------------------------
     def __getitem__(self, k: str) -> Any:
         return self.store.get(k)
 
     def __setitem__(self, k: str, v: Any) -> None:
-        self.store[k] = v
-        self._save()
+        self.set_many({k: v})
+
+    def set_many(self, items: Dict[str, Any]) -> None:
+        self.store.update(items)
+        if self.journal:
+            self._append(items)
+        else:
+            self._save()
 
     def __contains__(self, k: str) -> bool:
         return k in self.store
 
+    def get(self, k: str, default: Any = None) -> Any:
+        return self.store.get(k, default)
+
     def keys(self) -> List[str]:
         return list(self.store.keys())
 
+    def keys_prefix(self, prefix: str) -> List[str]:
+        return [k for k in self.store.keys() if str(k).startswith(prefix)]
+
+    def items_prefix(self, prefix: str) -> Iterator[Tuple[str, Any]]:
+        return ((k, v) for k, v in list(self.store.items()) if str(k).startswith(prefix))
+
+
+class SQLiteDB:
+    """Key/value store keeping every key in its own SQLite row.
+
+    Values are encoded with :mod:`utils.serializer`, so rows may hold legacy
+    JSON text or binary msgpack/orjson payloads side by side.
+
+    Reads and writes touch a single row, and prefix listings are range scans
+    over the primary key index instead of a pass over every key.
+    """
+
+    in_memory = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID"
+        )
+        self._con.commit()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._con.execute("SELECT 1 FROM kv LIMIT 1").fetchone() is None
+
+    def import_items(self, data: dict) -> int:
+        """Bulk-copy *data* (e.g. a ``LocalDB`` store), return rows written."""
+        with self._lock:
+            rows = [(str(k), dumps(v)) for k, v in data.items()]
+            with self._con:
+                self._con.executemany("INSERT OR REPLACE INTO kv(key,value) VALUES (?,?)", rows)
+        return len(rows)
+
+    def __getitem__(self, k: str) -> Any:
+        return self.get(k)
+
+    def __setitem__(self, k: str, v: Any) -> None:
+        self.set_many({k: v})
+
+    def set_many(self, items: Dict[str, Any]) -> None:
+        rows = [(k, dumps(v)) for k, v in items.items()]
+        with self._lock, self._con:
+            self._con.executemany("INSERT OR REPLACE INTO kv(key,value) VALUES (?,?)", rows)
+
+    def __contains__(self, k: str) -> bool:
+        with self._lock:
+            return self._con.execute("SELECT 1 FROM kv WHERE key=?", (k,)).fetchone() is not None
+
+    def get(self, k: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._con.execute("SELECT value FROM kv WHERE key=?", (k,)).fetchone()
+        if not row:
+            return default
+        try:
+            return loads(row[0])
+        except ValueError:
+            logger.error("SQLiteDB: corrupt value for %s", k)
+            return default
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._con.execute("SELECT key FROM kv ORDER BY key")]
+
+    @staticmethod
+    def _prefix_range(prefix: str) -> Tuple[str, str]:
+        # [prefix, prefix with the last char bumped) is exactly the prefix range
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
 
-DB = LocalDB()
+    def keys_prefix(self, prefix: str) -> List[str]:
+        if not prefix:
+            return self.keys()
+        with self._lock:
+            rows = self._con.execute(
+                "SELECT key FROM kv WHERE key >= ? AND key < ? ORDER BY key", self._prefix_range(prefix)
+            )
+            return [r[0] for r in rows]
+
+    SCAN_BATCH = 500
+
+    def items_prefix(self, prefix: str) -> Iterator[Tuple[str, Any]]:
+        """Stream ``(key, value)`` pairs in key order, ``SCAN_BATCH`` rows at a time.
+
+        Each batch is a fresh range query after the last key seen, so the lock
+        is only held per batch and writers interleave with a long scan.
+        """
+        lo, hi = self._prefix_range(prefix) if prefix else ("", None)
+        op = ">="
+        while True:
+            with self._lock:
+                if hi is None:
+                    rows = self._con.execute(
+                        f"SELECT key,value FROM kv WHERE key {op} ? ORDER BY key LIMIT ?", (lo, self.SCAN_BATCH)
+                    ).fetchall()
+                else:
+                    rows = self._con.execute(
+                        f"SELECT key,value FROM kv WHERE key {op} ? AND key < ? ORDER BY key LIMIT ?",
+                        (lo, hi, self.SCAN_BATCH),
+                    ).fetchall()
+            for k, data in rows:
+                try:
+                    yield k, loads(data)
+                except ValueError:
+                    logger.error("SQLiteDB: corrupt value for %s", k)
+            if len(rows) < self.SCAN_BATCH:
+                return
+            lo, op = rows[-1][0], ">"
+
+
+_MISSING = object()
+
+
+class WriteBehind:
+    """Coalesce writes in memory and flush them to *backend* in batches.
+
+    A write marks its key dirty; dirty keys are written together after
+    ``flush_ms`` or as soon as ``max_batch`` keys are pending, so several
+    ``save_state`` calls within one update cost a single backend write.
+    The flush only ever runs on the event loop (or in the writing thread),
+    never in a thread of its own, so a state is not serialized while a
+    handler is mutating it. Writes from other threads hand the timer to the
+    last loop seen; with no loop at all the next write past the deadline,
+    :func:`db_flush` or exit writes the batch.
+
+    For backends that are not memory resident, values read or written are
+    also kept in an LRU of at most ``cache_size`` entries, so memory follows
+    the number of active users rather than all users. Dirty keys are never
+    evicted before they are flushed.
+    """
+
+    def __init__(
+        self,
+        backend,
+        flush_ms: int = DB_FLUSH_MS,
+        max_batch: int = DB_FLUSH_BATCH,
+        cache_size: int = DB_CACHE_SIZE,
+    ):
+        self.backend = backend
+        self.flush_ms = max(0, int(flush_ms))
+        self.max_batch = max(1, int(max_batch))
+        self.cache_size = 0 if getattr(backend, "in_memory", False) else max(0, int(cache_size))
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._dirty: Dict[str, Any] = {}
+        self._dirty_since = 0.0
+        self._lock = threading.RLock()
+        self._timer = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def __getitem__(self, k: str) -> Any:
+        return self.get(k)
+
+    def __setitem__(self, k: str, v: Any) -> None:
+        self._remember(k, v)
+        if not self.flush_ms:
+            self.backend[k] = v
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not self._dirty:
+                self._dirty_since = now
+            self._dirty[k] = v
+            # The deadline check also covers a timer lost with a closed loop.
+            if len(self._dirty) >= self.max_batch or now - self._dirty_since >= self.flush_ms / 1000.0:
+                self.flush()
+            elif self._timer is None:
+                self._schedule()
+
+    def __contains__(self, k: str) -> bool:
+        return k in self._dirty or k in self._cache or k in self.backend
+
+    def get(self, k: str, default: Any = None) -> Any:
+        if k in self._dirty:
+            return self._dirty[k]
+        if k in self._cache:
+            self._cache.move_to_end(k)
+            return self._cache[k]
+        v = self.backend.get(k, _MISSING)
+        if v is _MISSING:
+            return default
+        self._remember(k, v)
+        return v
+
+    def _remember(self, k: str, v: Any) -> None:
+        if not self.cache_size:
+            return
+        self._cache[k] = v
+        self._cache.move_to_end(k)
+        if len(self._cache) <= self.cache_size:
+            return
+        with self._lock:
+            for old in list(self._cache):
+                if len(self._cache) <= self.cache_size:
+                    break
+                if old not in self._dirty:
+                    del self._cache[old]
+
+    def items_prefix(self, prefix: str) -> Iterator[Tuple[str, Any]]:
+        """Iterate ``(key, value)`` pairs without filling the LRU (bulk scans)."""
+        pending = {k: v for k, v in list(self._dirty.items()) if k.startswith(prefix)}
+        for k, v in self.backend.items_prefix(prefix):
+            if k not in pending:
+                yield k, v
+        yield from pending.items()
+
+    def keys(self) -> List[str]:
+        keys = self.backend.keys()
+        known = set(keys)
+        return keys + [k for k in list(self._dirty) if k not in known]
+
+    def keys_prefix(self, prefix: str) -> List[str]:
+        keys = self.backend.keys_prefix(prefix)
+        known = set(keys)
+        return keys + [k for k in list(self._dirty) if k.startswith(prefix) and k not in known]
+
+    def _schedule(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = self._loop
+            if loop is not None and not loop.is_closed():
+                self._timer = loop.call_soon_threadsafe(self._arm)
+            return
+        self._loop = loop
+        self._timer = loop.call_later(self.flush_ms / 1000.0, self.flush)
+
+    def _arm(self) -> None:
+        """Start the flush timer on the loop for writes made in another thread."""
+        with self._lock:
+            if self._dirty:
+                self._timer = asyncio.get_running_loop().call_later(self.flush_ms / 1000.0, self.flush)
+
+    def flush(self) -> None:
+        """Write every dirty key to the backend now."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            try:
+                self.backend.set_many(batch)
+            except Exception as e:
+                # Keep the batch (unless overwritten meanwhile) for the next flush.
+                logger.error("DB flush of %d keys failed: %s", len(batch), e)
+                batch.update(self._dirty)
+                self._dirty = batch
+                self._schedule()
+
+
+def _open_db(path: str = DB_PATH, backend: str = DB_BACKEND):
+    """Pick the storage backend from the ``sqlite:///`` scheme or ``HLITE_DB_BACKEND``."""
+    if path.startswith("sqlite:///"):
+        return SQLiteDB(path[len("sqlite:///"):])
+    if backend == "sqlite":
+        json_path = path
+        if json_path.endswith(".json"):
+            path = json_path[: -len(".json")] + ".sqlite3"
+        db = SQLiteDB(path)
+        if json_path != path and os.path.exists(json_path) and db.is_empty():
+            # One-shot migration of the existing JSON store (journal included).
+            n = db.import_items(LocalDB(json_path).store)
+            logger.info("SQLiteDB: imported %d keys from %s", n, json_path)
+        return db
+    return LocalDB(path)
+
+
+DB = WriteBehind(_open_db())
+atexit.register(DB.flush)
 
 
 def db_get(k: str, default: Any = None) -> Any:
-    return DB.store.get(k, default)
+    return DB.get(k, default)
 
 
 def db_set(k: str, v: Any) -> None:
@@ -58,7 +482,16 @@ def db_set(k: str, v: Any) -> None:
 
 
 def db_keys_prefix(prefix: str) -> List[str]:
-    return [k for k in DB.keys() if str(k).startswith(prefix)]
+    return DB.keys_prefix(prefix)
+
+
+def db_items_prefix(prefix: str) -> Iterator[Tuple[str, Any]]:
+    return DB.items_prefix(prefix)
+
+
+def db_flush() -> None:
+    """Persist pending writes immediately (shutdown, payments)."""
+    DB.flush()
 
 
-__all__ = ["LocalDB", "DB", "db_get", "db_set", "db_keys_prefix"]
+__all__ = ["LocalDB", "SQLiteDB", "WriteBehind", "DB", "db_get", "db_set", "db_keys_prefix", "db_items_prefix", "db_flush"]
@@ -0,0 +1,107 @@
+"""FatSecret REST client shared by the bot and :mod:`search`.
+
+Both lookup paths import these functions, so identical concurrent calls
+are coalesced by one :func:`single_flight` group per function no matter
+which path issued them. Results are raw FatSecret ``food`` objects;
+normalization to our per-100 g/ml format stays with the callers.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+from . import http
+from .consts import FATSECRET_KEY, FATSECRET_SECRET
+from .http import oauth1_query_url
+from .logging import logger
+from .singleflight import single_flight
+
+FS_BASE = "https://platform.fatsecret.com/rest/server.api"
+
+
+async def _fs_request(method: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Signed FatSecret call; ``None`` on HTTP, transport or API errors."""
+    if not FATSECRET_KEY or not FATSECRET_SECRET:
+        logger.warning("FatSecret credentials are not set (FATSECRET_KEY/SECRET empty). Skipping FS call.")
+        return None
+
+    query = {"method": method, "format": "json", **(params or {})}
+    try:
+        # FatSecret wants GET with the OAuth1 (HMAC-SHA1) signature in the query string
+        r = await http.get(oauth1_query_url(FS_BASE, query, FATSECRET_KEY, FATSECRET_SECRET), timeout=25)
+    except Exception as e:
+        logger.warning("FatSecret request failed: %s", e)
+        return None
+    logger.info("FatSecret API call: %s, status: %s", method, r.status_code)
+
+    if r.status_code != 200:
+        body = r.text[:1000]
+        if r.status_code in (401, 403):
+            logger.error(
+                "FatSecret auth/permission error %s. Check: consumer key/secret, API plan, IP whitelist. "
+                "Response: %s", r.status_code, body
+            )
+        else:
+            logger.warning("FatSecret HTTP %s. Response: %s", r.status_code, body)
+        return None
+    try:
+        data = r.json()
+    except ValueError as e:
+        logger.warning("FatSecret JSON decode failed: %s... (%s)", r.text[:300], e)
+        return None
+    if isinstance(data, dict) and "error" in data:
+        logger.error("FatSecret API error for %s: %s", method, data["error"])
+        return None
+    return data
+
+
+@single_flight
+async def _fs_get_food(food_id: str) -> Optional[Dict[str, Any]]:
+    """Food details (with servings) by FatSecret id."""
+    data = await _fs_request("food.get.v2", {"food_id": str(food_id)})
+    food = (data or {}).get("food")
+    if not food:
+        logger.warning("No food object in FatSecret response for food_id: %s", food_id)
+    return food or None
+
+
+@single_flight
+async def _fs_find_by_barcode(barcode: str) -> Optional[str]:
+    """FatSecret food id for a barcode, if the plan allows barcode lookups."""
+    data = await _fs_request("food.find_id_for_barcode", {"barcode": barcode})
+    fid = (data or {}).get("food_id")
+    if isinstance(fid, dict):  # {"food_id": {"value": "123"}}
+        fid = fid.get("value")
+    return str(fid) if fid and str(fid) != "0" else None
+
+
+def _food_list(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    foods = data.get("foods", data)
+    foods = foods.get("food", []) if isinstance(foods, dict) else foods
+    return [foods] if isinstance(foods, dict) else list(foods or [])
+
+
+@single_flight
+async def _fs_search_best(query: str) -> Optional[Dict[str, Any]]:
+    """Search by name and return details of the best match."""
+    data = await _fs_request("foods.search", {"search_expression": query, "max_results": 10})
+    foods = [f for f in _food_list(data or {}) if f.get("food_id")]
+    if not foods:
+        logger.info("No foods found in FatSecret for: %s", query)
+        return None
+
+    def _score(fd: Dict[str, Any]) -> int:
+        servings = (fd.get("servings") or {}).get("serving") or []
+        if isinstance(servings, dict):
+            servings = [servings]
+        metric = sum(
+            1 for s in servings if (s.get("metric_serving_unit") or s.get("serving_unit") or "").lower() in ("g", "ml")
+        )
+        return (2 if fd.get("brand_name") else 0) + metric
+
+    best = max(foods, key=_score)
+    logger.info("Selected FatSecret food %s for '%s' out of %d", best["food_id"], query, len(foods))
+    return await _fs_get_food(str(best["food_id"]))
+
+
+__all__ = ["FS_BASE", "_fs_request", "_fs_get_food", "_fs_find_by_barcode", "_fs_search_best"]
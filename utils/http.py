@@ -0,0 +1,134 @@
+"""Shared async HTTP client for the nutrition providers.
+
+Every provider call goes through one long-lived ``httpx.AsyncClient`` per
+event loop, so TLS sessions to FatSecret, USDA, Google and friends are kept
+alive between lookups instead of being renegotiated on each request, and no
+thread of the default executor is parked on a blocking socket.
+
+httpx only bounds the pool as a whole; :func:`request` additionally caps
+concurrent requests per host (``HTTP_PER_HOST``) so a burst against one slow
+provider cannot take every pooled connection, paces each host through its
+token bucket in :mod:`utils.ratelimit` and fails fast while the host's
+circuit breaker (:mod:`utils.breaker`) is open.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import weakref
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+import httpx
+from oauthlib import oauth1
+
+from .breaker import CircuitOpenError, breakers, is_failure_status
+from .consts import HTTP_MAX_CONNECTIONS, HTTP_PER_HOST, HTTP_TIMEOUT, USER_AGENT
+from .ratelimit import limiter
+
+# loop -> (client, host -> semaphore); a client must not outlive its loop
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[httpx.AsyncClient, Dict[str, asyncio.Semaphore]]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _state() -> Tuple[httpx.AsyncClient, Dict[str, asyncio.Semaphore]]:
+    loop = asyncio.get_running_loop()
+    state = _clients.get(loop)
+    if state is None or state[0].is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=min(HTTP_TIMEOUT, 5.0)),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=60.0,
+            ),
+            headers={"User-Agent": USER_AGENT},
+            follow_redirects=True,
+        )
+        state = _clients[loop] = (client, {})
+    return state
+
+
+def get_client() -> httpx.AsyncClient:
+    """The shared client of the running event loop."""
+    return _state()[0]
+
+
+async def request(method: str, url: str, **kwargs: Any) -> httpx.Response:
+    """``client.request`` on the shared client, rate limited and at most
+    ``HTTP_PER_HOST`` at a time per host.
+
+    Raises :class:`CircuitOpenError` without calling out while the host's
+    breaker is open.
+    """
+    client, hosts = _state()
+    host = urlsplit(url).hostname or ""
+    breaker = breakers.get(host)
+    if not breaker.allow():
+        raise CircuitOpenError(host)
+    sem = hosts.get(host)
+    if sem is None:
+        sem = hosts[host] = asyncio.Semaphore(HTTP_PER_HOST)
+    try:
+        await limiter.acquire(host)
+        async with sem:
+            resp = await client.request(method, url, **kwargs)
+    except httpx.HTTPError:
+        breaker.failure()
+        raise
+    except BaseException:
+        breaker.abandon()
+        raise
+    if is_failure_status(resp.status_code):
+        breaker.failure()
+    else:
+        breaker.success()
+    return resp
+
+
+async def get(url: str, **kwargs: Any) -> httpx.Response:
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs: Any) -> httpx.Response:
+    return await request("POST", url, **kwargs)
+
+
+async def call_blocking(host: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a blocking SDK call that talks to *host* itself (e.g. the Open Food
+    Facts client) in the default executor, paced by the host's token bucket
+    and guarded by its breaker: any exception from *fn* counts as a failure."""
+    breaker = breakers.get(host)
+    if not breaker.allow():
+        raise CircuitOpenError(host)
+    try:
+        await limiter.acquire(host)
+        res = await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args, **kwargs))
+    except asyncio.CancelledError:
+        breaker.abandon()
+        raise
+    except Exception:
+        breaker.failure()
+        raise
+    breaker.success()
+    return res
+
+
+async def aclose() -> None:
+    """Close the running loop's client (call on shutdown)."""
+    state = _clients.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state[0].aclose()
+
+
+def oauth1_query_url(url: str, params: Optional[Dict[str, Any]], key: str, secret: str) -> str:
+    """*url* with *params* and an HMAC-SHA1 OAuth 1.0 signature in the query string."""
+    signer = oauth1.Client(key, client_secret=secret, signature_type=oauth1.SIGNATURE_TYPE_QUERY)
+    query = urlencode(params or {}, doseq=True)
+    signed, _, _ = signer.sign(f"{url}?{query}" if query else url)
+    return signed
+
+
+__all__ = ["get_client", "request", "get", "post", "call_blocking", "aclose", "oauth1_query_url"]
@@ -0,0 +1,55 @@
+"""In-memory points index for the leaderboard."""
+
+from __future__ import annotations
+
+from bisect import bisect_left, insort
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class LeaderboardIndex:
+    """Users ordered by points, kept sorted as points change.
+
+    Entries are ``(-points, user_id)`` tuples in a sorted list, so a rank is a
+    binary search and the top-N is a slice; ties are ordered by user id.
+    """
+
+    def __init__(self) -> None:
+        self._points: Dict[str, int] = {}
+        self._sorted: List[Tuple[int, str]] = []
+
+    def rebuild(self, items: Iterable[Tuple[str, int]]) -> None:
+        """Replace the index with ``(user_id, points)`` pairs."""
+        self._points = {str(uid): int(pts) for uid, pts in items}
+        self._sorted = sorted((-pts, uid) for uid, pts in self._points.items())
+
+    def update(self, user_id: Any, points: int) -> None:
+        uid, points = str(user_id), int(points)
+        old = self._points.get(uid)
+        if old == points:
+            return
+        if old is not None:
+            i = bisect_left(self._sorted, (-old, uid))
+            del self._sorted[i]
+        self._points[uid] = points
+        insort(self._sorted, (-points, uid))
+
+    def points(self, user_id: Any) -> Optional[int]:
+        """Indexed points of *user_id*, or ``None`` if it is not indexed."""
+        return self._points.get(str(user_id))
+
+    def rank(self, user_id: Any) -> Optional[int]:
+        """1-based place of *user_id*, or ``None`` if it is not indexed."""
+        uid = str(user_id)
+        pts = self._points.get(uid)
+        if pts is None:
+            return None
+        return bisect_left(self._sorted, (-pts, uid)) + 1
+
+    def top(self, n: int) -> List[Dict[str, Any]]:
+        return [{"user_id": uid, "points": -neg} for neg, uid in self._sorted[:n]]
+
+    def __len__(self) -> int:
+        return len(self._sorted)
+
+
+__all__ = ["LeaderboardIndex"]
@@ -0,0 +1,40 @@
+"""Keyed asyncio locks for serializing work per user."""
+
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, List
+
+
+class KeyedLocks:
+    """Lock table with one :class:`asyncio.Lock` per active key.
+
+    Work for the same key runs one at a time in arrival order (asyncio locks
+    wake waiters FIFO), while different keys never contend. Entries are
+    reference counted and dropped once nobody holds or waits for them, so the
+    table only grows with the number of users that are busy right now.
+    """
+
+    def __init__(self) -> None:
+        self._locks: Dict[Hashable, List] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+__all__ = ["KeyedLocks"]
@@ -0,0 +1,59 @@
+"""Tiny in-process metrics: fixed-bucket histograms.
+
+Cumulative since start, like Prometheus histograms; good enough to read
+hit ratios and latency percentiles off a running instance without pulling
+in a metrics client.
+"""
+
+from __future__ import annotations
+
+import bisect
+from typing import Any, Dict, Sequence
+
+# milliseconds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram:
+    """Counts of observations per upper bound, plus their sum."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the *q* quantile (inf past the last one)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return float(bound)
+        return float("inf")
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "buckets": {str(b): n for b, n in zip(self.bounds, self.counts)} | {"+Inf": self.counts[-1]},
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+        }
+
+
+__all__ = ["Histogram", "LATENCY_BUCKETS_MS", "SIZE_BUCKETS"]
@@ -0,0 +1,127 @@
+"""Per-host token-bucket rate limiting for outbound provider calls.
+
+Every request made through :mod:`utils.http` first takes a token from the
+bucket of its host. A bucket refills at ``rate`` tokens per second up to
+``burst``; callers that find it empty reserve the next token and sleep until
+it is due, so waiters are served strictly in arrival order and a burst is
+spread out instead of tripping the provider's quota.
+
+Limits come from :data:`HOST_LIMITS`, overridable per host with the
+``HTTP_RATE_LIMITS`` JSON (``{"api.nal.usda.gov": {"rate": 0.5, "burst": 10}}``).
+Hosts without an entry share the ``"*"`` limit, each with its own bucket.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict
+
+from .consts import HTTP_RATE_LIMITS
+from .logging import logger
+from .metrics import LATENCY_BUCKETS_MS, Histogram
+
+
+@dataclass(frozen=True)
+class HostLimit:
+    rate: float  # tokens per second
+    burst: int = 1
+
+
+HOST_LIMITS: Dict[str, HostLimit] = {
+    "av.ru": HostLimit(rate=1.0, burst=1),  # scraping: at most one page per second
+    "world.openfoodfacts.org": HostLimit(rate=3.0, burst=1),
+    "platform.fatsecret.com": HostLimit(rate=5.0, burst=10),
+    "api.nal.usda.gov": HostLimit(rate=0.3, burst=30),  # 1000 requests per hour per key
+    "www.googleapis.com": HostLimit(rate=1.5, burst=10),  # Custom Search: 100 queries per minute
+    "*": HostLimit(rate=10.0, burst=20),
+}
+
+if HTTP_RATE_LIMITS:
+    try:
+        for _host, _cfg in json.loads(HTTP_RATE_LIMITS).items():
+            HOST_LIMITS[_host] = HostLimit(float(_cfg["rate"]), int(_cfg.get("burst", 1)))
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        logger.warning("HTTP_RATE_LIMITS ignored: %s", e)
+
+
+class TokenBucket:
+    """FIFO token bucket; :meth:`acquire` returns the seconds spent waiting."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+        self.waits = Histogram(LATENCY_BUCKETS_MS)
+        self.delayed = 0
+
+    def _reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            # going negative books a future token, which keeps later callers behind us
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def _release(self) -> None:
+        with self._lock:
+            self._tokens += 1
+
+    async def acquire(self) -> float:
+        wait = self._reserve()
+        if wait > 0:
+            self.delayed += 1
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self._release()  # hand the booked token back to the queue
+                raise
+        self.waits.observe(wait * 1000)
+        return wait
+
+
+class RateLimiter:
+    """Registry of token buckets keyed by host."""
+
+    def __init__(self, limits: Dict[str, HostLimit]):
+        self.limits = limits
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, host: str) -> TokenBucket:
+        b = self._buckets.get(host)
+        if b is None:
+            with self._lock:
+                b = self._buckets.get(host)
+                if b is None:
+                    limit = self.limits.get(host) or self.limits["*"]
+                    b = self._buckets[host] = TokenBucket(limit.rate, limit.burst)
+        return b
+
+    async def acquire(self, host: str) -> float:
+        """Wait for a request slot to *host*; returns the seconds waited."""
+        return await self.bucket(host).acquire()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            host: {
+                "rate": b.rate,
+                "burst": b.burst,
+                "requests": b.waits.count,
+                "delayed": b.delayed,
+                "wait_ms": b.waits.snapshot(),
+            }
+            for host, b in list(self._buckets.items())
+        }
+
+
+limiter = RateLimiter(HOST_LIMITS)
+
+
+__all__ = ["HostLimit", "HOST_LIMITS", "TokenBucket", "RateLimiter", "limiter"]
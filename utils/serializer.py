@@ -0,0 +1,85 @@
+"""Pluggable serialization for stored payloads (DB values, cache entries).
+
+``dumps`` picks the fastest codec available (``HLITE_SERIALIZER=auto``):
+msgpack, then orjson, then the stdlib ``json``. ``loads`` recognizes every
+format regardless of the current setting, so rows written as plain JSON
+text before the switch stay readable.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Union
+
+from .consts import SERIALIZER
+from .logging import logger
+
+try:
+    import orjson
+
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+try:
+    import msgpack
+
+    HAS_MSGPACK = True
+except ImportError:
+    HAS_MSGPACK = False
+
+# msgpack payloads are prefixed so they can be told apart from JSON bytes
+_MSGPACK_TAG = b"\x00mp"
+
+
+def _pick(name: str) -> str:
+    if name == "auto":
+        return "msgpack" if HAS_MSGPACK else "orjson" if HAS_ORJSON else "json"
+    if name == "msgpack" and not HAS_MSGPACK or name == "orjson" and not HAS_ORJSON:
+        logger.warning("Serializer %s is not installed, falling back to json", name)
+        return "json"
+    return name if name in ("json", "orjson", "msgpack") else "json"
+
+
+CODEC: str = _pick(SERIALIZER)
+
+
+def dumps_json(obj: Any) -> str:
+    """Compact JSON text (orjson-accelerated when available)."""
+    if HAS_ORJSON:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass  # e.g. ints beyond 64 bits — let the stdlib handle it
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def dumps(obj: Any) -> Union[str, bytes]:
+    """Encode *obj* with the configured codec."""
+    if CODEC == "msgpack":
+        try:
+            return _MSGPACK_TAG + msgpack.packb(obj, use_bin_type=True)
+        except (TypeError, OverflowError, ValueError):
+            pass
+    if CODEC == "orjson":
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """Decode data written by :func:`dumps` with any codec, or legacy JSON."""
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    if isinstance(data, (bytes, bytearray)) and data[:3] == _MSGPACK_TAG:
+        if not HAS_MSGPACK:
+            raise ValueError("msgpack payload found but msgpack is not installed")
+        return msgpack.unpackb(data[3:], raw=False, strict_map_key=False)
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+__all__ = ["CODEC", "HAS_MSGPACK", "HAS_ORJSON", "dumps", "dumps_json", "loads"]
@@ -0,0 +1,93 @@
+"""Coalescing of identical concurrent async calls.
+
+When several updates ask for the same product at once, only the first call
+per key actually runs; the others await its future. Every waiter receives
+its own deep copy of the result, because callers routinely annotate the
+returned dicts (``r["source"] = ...``). The future is dropped as soon as
+the call finishes, so this never caches anything: that is the job of
+:mod:`utils.cache`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import functools
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class SingleFlight:
+    """Keyed group of in-flight calls."""
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """Run ``fn(*args, **kwargs)`` unless a call for *key* is already running."""
+        while True:
+            fut = self._calls.get(key)
+            if fut is None:
+                break
+            try:
+                res = await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                if not fut.cancelled():
+                    raise  # the waiter itself was cancelled
+                continue  # the leading call was cancelled: take over
+            self.shared += 1
+            return copy.deepcopy(res)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._calls[key] = fut
+        try:
+            res = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved when nobody was waiting
+            raise
+        else:
+            # snapshot before our caller gets a chance to mutate the result
+            fut.set_result(copy.deepcopy(res))
+            return res
+        finally:
+            if self._calls.get(key) is fut:
+                del self._calls[key]
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+def _default_key(args: tuple, kwargs: dict) -> Hashable:
+    return repr((args, sorted(kwargs.items())))
+
+
+def single_flight(
+    fn: Optional[Callable[..., Awaitable[Any]]] = None,
+    *,
+    key: Optional[Callable[..., Hashable]] = None,
+):
+    """Decorator: concurrent calls with equal arguments share one call.
+
+    *key* maps the call arguments to the coalescing key; by default the
+    ``repr`` of the arguments is used.
+    """
+
+    def wrap(func: Callable[..., Awaitable[Any]]):
+        group = SingleFlight()
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            k = key(*args, **kwargs) if key else _default_key(args, kwargs)
+            return await group.do(k, func, *args, **kwargs)
+
+        wrapper.flight = group  # type: ignore[attr-defined]
+        return wrapper
+
+    return wrap(fn) if fn is not None else wrap
+
+
+__all__ = ["SingleFlight", "single_flight"]
@@ -6,9 +6,10 @@ import base64
 import re
 from typing import Any, Dict, List, Optional
 
-import requests
-
+from . import http
+from .breaker import CircuitOpenError
 from .consts import GOOGLE_CSE_ID, GOOGLE_CSE_KEY, USER_AGENT
+from .singleflight import single_flight
 
 
 # ---------------------------------------------------------------------------
@@ -117,6 +118,7 @@ def _extract_query(text: str) -> str:
 # ---------------------------------------------------------------------------
 # Networking helpers
 
+@single_flight
 async def _google_cse_search(
     query: str,
     num: int = 10,
@@ -141,10 +143,10 @@ async def _google_cse_search(
 
     headers = {"User-Agent": USER_AGENT}
 
-    def _do_request():
-        return requests.get("https://www.googleapis.com/customsearch/v1", params=params, headers=headers, timeout=20)
-
-    resp = await __import__("asyncio").to_thread(_do_request)
+    try:
+        resp = await http.get("https://www.googleapis.com/customsearch/v1", params=params, headers=headers, timeout=20)
+    except CircuitOpenError:
+        return []
     if resp.status_code != 200:
         return []
     data = resp.json()
@@ -246,6 +248,49 @@ def _url_to_base64(data: bytes) -> str:
     return base64.b64encode(data).decode("utf-8")
 
 
+# ---------------------------------------------------------------------------
+# Nutrition helpers
+
+_MACROS = ("kcal", "protein", "fat", "carbs")
+
+_PORTION_RE = re.compile(
+    r"\b\d+(?:[.,]\d+)?\s*(?:кг|kg|гр|г|grams?|g|мл|ml|литр(?:а|ов)?|л|l)(?!\w)",
+    re.IGNORECASE,
+)
+
+
+def _strip_portion(text: str) -> str:
+    """Drop "150 г" / "0,5 л" style amounts so cache keys depend only on the product."""
+    stripped = " ".join(_PORTION_RE.sub(" ", text).split())
+    return stripped or text
+
+
+def _scale_portion(
+    res: Dict[str, Any], grams: Optional[float], ml: Optional[float]
+) -> Dict[str, Any]:
+    """Return a copy of a per-100 g/ml result with portion fields for ``grams``/``ml``.
+
+    Lookups are cached per 100 g/ml, so the user's portion is applied here,
+    after the cache read, instead of being part of the cache key.
+    """
+    out = dict(res)
+    if "kcal_100g" not in res and "kcal_100ml" not in res:
+        return out  # not a per-100 record, keep whatever the source gave
+    out["portion_g"], out["portion_ml"] = grams, ml
+    basis = None
+    if grams:
+        basis = "100g"
+    elif ml:
+        basis = "100ml" if res.get("kcal_100ml") is not None else "100g"
+    if basis and res.get(f"kcal_{basis}") is None:
+        basis = None
+    amount = grams or ml
+    for m in _MACROS:
+        v = res.get(f"{m}_{basis}") if basis else None
+        out[f"{m}_portion"] = v * amount / 100.0 if v is not None else None
+    return out
+
+
 __all__ = [
     "_extract_barcode",
     "_extract_country",
@@ -265,5 +310,7 @@ __all__ = [
     "_norm_text",
     "_parse_google_recipes",
     "_parse_link",
+    "_scale_portion",
+    "_strip_portion",
     "_url_to_base64",
 ]